@@ -1,20 +1,42 @@
-from flask import Flask, render_template
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import pandas as pd
-import numpy as np
-from main import backtest_portfolio, BacktestConfig
+from flask import Flask, Response, render_template, request, jsonify, redirect, stream_with_context, url_for
+from main import backtest_portfolio, get_result_store, BacktestConfig
+from clustering import CorrelationView
+from holding_periods import SURFACE_METRICS, surface_payload
+from jobs import JobRegistry, JobRunner
+from market_data import SharedMarketData, attach_market_data, select_portfolio
+from weight_schedule import load_weight_schedule, schedule_to_dict, schedule_weights
+from whatif import WhatIfSession
+from datetime import datetime
+import json
 import logging
+import threading
+import uuid
+from collections import OrderedDict
+import pandas as pd
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Bounded pool for backtests so slow downloads never hold a request thread;
+# jobs are saved in a registry shared by every worker process
+job_runner = JobRunner(registry=JobRegistry())
+
+# Dashboards built in this worker, keyed by result-store key (least
+# recently used first) and rebuilt from the store when evicted
+dashboards = OrderedDict()
+dashboards_lock = threading.Lock()
+
+# Market data published by `python market_data.py refresh`, mapped read-only
+# and shared by every worker process
+shared_market_data = SharedMarketData()
+
 def create_performance_chart(results):
     """Create main performance chart with benchmarks"""
-    returns_data = results['returns_data']
+    import plotly.graph_objects as go
+    
+    returns_data = results['strategy_returns']
     cum_returns = (1 + returns_data).cumprod()
     
     fig = go.Figure()
@@ -52,7 +74,9 @@ def create_performance_chart(results):
 
 def create_drawdown_chart(results):
     """Create drawdown comparison chart"""
-    returns_data = results['returns_data']
+    import plotly.graph_objects as go
+    
+    returns_data = results['strategy_returns']
     cum_returns = (1 + returns_data).cumprod()
     drawdowns = cum_returns / cum_returns.cummax() - 1
     
@@ -77,6 +101,9 @@ def create_drawdown_chart(results):
 
 def create_risk_metrics_chart(results):
     """Create risk metrics visualization"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    
     metrics_df = results['metrics']
     
     # Create subplots for different risk metrics
@@ -118,53 +145,322 @@ def create_risk_metrics_chart(results):
     
     return fig.to_json()
 
-def create_correlation_heatmap(results):
-    """Create correlation heatmap"""
-    corr_matrix = results['correlation']
+def create_correlation_heatmap(correlation_view):
+    """Create the clustered correlation heatmap payload.
+
+    Assets are in hierarchical-clustering order and values are quantized
+    to bytes; large universes start as a cluster-level matrix whose cells
+    expand into asset-level tiles from /api/jobs/<id>/correlation.
+    """
+    return json.dumps(correlation_view.overview())
+
+def create_holding_period_heatmap(results):
+    """Create the start x end holding-period heatmap payload.
+
+    Embeds the period dates, series names and the first strategy's
+    annualized return surface; other series and metrics are fetched from
+    /api/jobs/<id>/holding-periods as float32 arrays.
+    """
+    surface = results['holding_periods']
+    return json.dumps({
+        'dates': [d.strftime('%Y-%m') for d in surface['dates']],
+        'series': surface['series'],
+        'metrics': SURFACE_METRICS,
+        'initial': surface_payload(surface)
+    })
+
+def benchmark_table(benchmark_metrics):
+    """Full-sample benchmark statistics as {strategy: {'<statistic> vs <benchmark>': value}}"""
+    table = {}
+    for (benchmark, strategy), figures in benchmark_metrics.items():
+        row = table.setdefault(strategy, {})
+        for statistic, value in figures.items():
+            row[f"{statistic} vs {benchmark}"] = None if pd.isna(value) else value
+    return table
+
+def drawdown_table(episodes):
+    """Drawdown episodes as display rows (dates as text, open episodes unrecovered)"""
+    rows = []
+    for episode in episodes.to_dict(orient='records'):
+        for column in ('Peak', 'Trough', 'Recovery'):
+            episode[column] = episode[column].strftime('%Y-%m-%d') if pd.notna(episode[column]) else 'Not recovered'
+        if pd.isna(episode['Recovery Days']):
+            episode['Recovery Days'] = ''
+        rows.append(episode)
+    return rows
+
+def dashboard_payload(mutual_range, portfolio, progress=None, prices=None):
+    """Charts, tables and interactive views for a mutual-range backtest result.
+
+    prices, if given, is the result's price panel as a view of the shared
+    snapshot, kept for what-if scoring instead of the result's own copy.
+    """
+    report = progress or (lambda stage, done, total: None)
+    correlation_view = CorrelationView(mutual_range['correlation'],
+                                       mutual_range.get('correlation_clusters'))
+    chart_builders = {
+        'performance': create_performance_chart,
+        'drawdown': create_drawdown_chart,
+        'risk_metrics': create_risk_metrics_chart,
+        'correlation': lambda results: create_correlation_heatmap(correlation_view),
+        'holding_periods': create_holding_period_heatmap
+    }
+    charts = {}
+    for i, (name, builder) in enumerate(chart_builders.items()):
+        report('charting', i, len(chart_builders))
+        charts[name] = builder(mutual_range)
+    report('charting', len(chart_builders), len(chart_builders))
     
-    fig = px.imshow(
-        corr_matrix,
-        labels=dict(x="Asset", y="Asset", color="Correlation"),
-        x=corr_matrix.columns,
-        y=corr_matrix.columns,
-        color_continuous_scale='RdBu'
-    )
+    return {
+        'context': {
+            'charts': charts,
+            'metrics': mutual_range['metrics'].to_dict(),
+            'benchmark_metrics': benchmark_table(mutual_range['benchmark_metrics']),
+            'drawdown_episodes': drawdown_table(mutual_range['drawdown_episodes']),
+            'underwater': mutual_range['underwater'].T.to_dict(),
+            'portfolio': portfolio,
+            'periods': BacktestConfig.REBALANCING_PERIODS
+        },
+        'correlation_view': correlation_view,
+        'holding_periods': mutual_range['holding_periods'],
+        'whatif': WhatIfSession(mutual_range['price_data'] if prices is None else prices,
+                                mutual_range['strategy_returns'])
+    }
+
+def remember_dashboard(result_key, payload):
+    """Keep a dashboard in this worker's bounded cache"""
+    with dashboards_lock:
+        dashboards[result_key] = payload
+        dashboards.move_to_end(result_key)
+        while len(dashboards) > BacktestConfig.JOBS['CACHED_DASHBOARDS']:
+            dashboards.popitem(last=False)
+
+def snapshot_prices(generation, stored):
+    """A stored price panel as a view of the snapshot it was computed from.
+
+    Falls back to the stored panel when the backtest downloaded its own
+    prices or that snapshot generation has since been removed.
+    """
+    if generation is None:
+        return stored
+    market_data = shared_market_data.current()
+    try:
+        if market_data is None or market_data['generation'] != generation:
+            market_data = attach_market_data(shared_market_data.path, generation)
+        prices = select_portfolio(market_data, list(stored.columns))['price_data']
+        prices = prices.loc[stored.index[0]:stored.index[-1]]
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        logger.info(f"Using stored prices; snapshot {generation} unavailable: {e}")
+        return stored
+    if prices.shape != stored.shape or list(prices.columns) != list(stored.columns):
+        return stored
+    return prices
+
+def load_dashboard(job):
+    """Dashboard for a finished job, rebuilt from the result store if this worker lacks it.
+
+    Returns None if the stored result has since been evicted.
+    """
+    result_key = job.result['result_key']
+    with dashboards_lock:
+        if result_key in dashboards:
+            dashboards.move_to_end(result_key)
+            return dashboards[result_key]
+    mutual_range = get_result_store().get(result_key)
+    if mutual_range is None:
+        return None
+    prices = snapshot_prices(job.result.get('market_data'), mutual_range['price_data'])
+    payload = dashboard_payload(mutual_range, job.result['portfolio'], prices=prices)
+    remember_dashboard(result_key, payload)
+    return payload
+
+def build_dashboard(progress, market_data=None, weight_schedule=None):
+    """Run the dashboard backtest and build its charts (runs on a job worker).
+
+    market_data is the attached shared snapshot, if one covers the portfolio;
+    otherwise the backtest downloads its own prices. weight_schedule, if
+    given, replaces the static portfolio with time-varying targets. The job
+    result is only the result-store key, portfolio and snapshot generation,
+    which any worker can turn back into the dashboard.
+    """
+    logger.info("Starting backtest...")
+    portfolio = schedule_weights(weight_schedule) if weight_schedule is not None else BacktestConfig.PORTFOLIO
+    results = backtest_portfolio(portfolio, use_mutual_dates=True, progress=progress,
+                                 market_data=market_data, weight_schedule=weight_schedule)
+    logger.info("Backtest completed")
     
-    fig.update_layout(
-        title='Asset Correlation Heatmap',
-        height=600
-    )
+    if not results or 'mutual_range' not in results:
+        raise ValueError("No results data available")
     
-    return fig.to_json()
+    mutual_range = results['mutual_range']
+    result_key = mutual_range.get('cache_key')
+    if result_key is None:
+        # Not in the result store, so only this worker can serve it
+        logger.warning("Backtest result was not stored; other workers cannot serve it")
+        result_key = f"local-{uuid.uuid4().hex}"
+    remember_dashboard(result_key, dashboard_payload(mutual_range, portfolio, progress))
+    return {'result_key': result_key, 'portfolio': portfolio,
+            'market_data': market_data['generation'] if market_data else None}
+
+def dashboard_job(weight_schedule=None):
+    """Job key and function for the dashboard backtest.
+
+    Without a weight_schedule the configured one (BacktestConfig.WEIGHT_SCHEDULE)
+    is used if set, else the static portfolio.
+    """
+    if weight_schedule is None and BacktestConfig.WEIGHT_SCHEDULE:
+        weight_schedule = load_weight_schedule(BacktestConfig.WEIGHT_SCHEDULE)
+    portfolio = schedule_weights(weight_schedule) if weight_schedule is not None else BacktestConfig.PORTFOLIO
+    market_data = shared_market_data.for_portfolio(portfolio)
+    key = json.dumps({
+        'weights': portfolio,
+        'schedule': schedule_to_dict(weight_schedule) if weight_schedule is not None else None,
+        'date': datetime.now().strftime('%Y-%m-%d'),
+        'market_data': market_data['generation'] if market_data else None
+    }, sort_keys=True)
+    return key, lambda progress: build_dashboard(progress, market_data, weight_schedule)
+
+def submit_dashboard_job(weight_schedule=None):
+    """Queue the dashboard backtest, sharing any identical job already running"""
+    return job_runner.submit(*dashboard_job(weight_schedule))
 
 @app.route('/')
 def index():
-    """Main dashboard route"""
+    """Start (or join) the dashboard backtest and show its progress"""
+    job = submit_dashboard_job()
+    return render_template('progress.html', job_id=job.id)
+
+@app.route('/results/<job_id>')
+def results_page(job_id):
+    """Render the dashboard from a finished backtest job"""
+    job = job_runner.get(job_id)
+    if job is None:
+        return redirect(url_for('index'))
+    if not job.done:
+        return render_template('progress.html', job_id=job.id)
+    if job.status == 'failed':
+        return f"An error occurred: {job.error}"
+    dashboard = load_dashboard(job)
+    if dashboard is None:
+        return redirect(url_for('index'))
+    
+    logger.info("Rendering template...")
+    return render_template('dashboard.html', job_id=job.id, **dashboard['context'])
+
+@app.route('/api/backtest', methods=['POST'])
+def start_backtest():
+    """Queue the dashboard backtest and return its job ID immediately.
+
+    An optional JSON body {"schedule": {date: {ticker: weight}}} backtests
+    a time-varying target-weight schedule instead of the static portfolio.
+    """
+    payload = request.get_json(silent=True) or {}
+    weight_schedule = None
+    if payload.get('schedule') is not None:
+        if not isinstance(payload['schedule'], dict):
+            return jsonify({'error': "'schedule' must map dates to weight objects"}), 400
+        try:
+            weight_schedule = load_weight_schedule(payload['schedule'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    job = submit_dashboard_job(weight_schedule)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream a job's stage-by-stage progress as Server-Sent Events"""
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job: {job_id}"}), 404
+    return Response(stream_with_context(job.stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def finished_dashboard(job_id):
+    """Dashboard of a finished job run by any worker, or None"""
+    job = job_runner.get(job_id)
+    if job is None or job.status != 'finished':
+        return None
+    return load_dashboard(job)
+
+@app.route('/api/jobs/<job_id>/correlation')
+def correlation_tile(job_id):
+    """Asset-level correlation tile between two clusters of a finished job"""
+    dashboard = finished_dashboard(job_id)
+    if dashboard is None:
+        return jsonify({'error': f"No finished job: {job_id}"}), 404
+    view = dashboard['correlation_view']
     try:
-        logger.info("Starting backtest...")
-        results = backtest_portfolio(BacktestConfig.PORTFOLIO, use_mutual_dates=True)
-        logger.info("Backtest completed")
-        
-        if 'mutual_range' in results:
-            charts = {
-                'performance': create_performance_chart(results['mutual_range']),
-                'drawdown': create_drawdown_chart(results['mutual_range']),
-                'risk_metrics': create_risk_metrics_chart(results['mutual_range']),
-                'correlation': create_correlation_heatmap(results['mutual_range'])
-            }
-            
-            metrics = results['mutual_range']['metrics']
-            
-            logger.info("Rendering template...")
-            return render_template('dashboard.html', 
-                                charts=charts,
-                                metrics=metrics.to_dict())
-        else:
-            return "Error: No results data available"
-            
+        row, column = int(request.args['row']), int(request.args['column'])
+    except (KeyError, ValueError):
+        return jsonify({'error': "Request must include integer 'row' and 'column' clusters"}), 400
+    if not (0 <= row < view.n_clusters and 0 <= column < view.n_clusters):
+        return jsonify({'error': "Cluster out of range"}), 400
+    return jsonify(view.tile(row, column))
+
+@app.route('/api/jobs/<job_id>/holding-periods')
+def holding_period_slice(job_id):
+    """One series and metric of a finished job's holding-period surface"""
+    dashboard = finished_dashboard(job_id)
+    if dashboard is None:
+        return jsonify({'error': f"No finished job: {job_id}"}), 404
+    try:
+        series = int(request.args.get('series', 0))
+        payload = surface_payload(dashboard['holding_periods'], series,
+                                  request.args.get('metric', 'annualized_return'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(payload)
+
+def score_whatif(job):
+    """Re-score posted weights against a dashboard job's price panel.
+
+    While the job is still running, returns 202 with it so the client can
+    retry once the job's event stream reports 'finished'.
+    """
+    payload = request.get_json(silent=True) or {}
+    weights = payload.get('weights')
+    if not isinstance(weights, dict) or not weights:
+        return jsonify({'error': "Request must include a 'weights' object"}), 400
+    if not job.done:
+        return jsonify(job.to_dict()), 202, {'Retry-After': str(BacktestConfig.JOBS['RETRY_AFTER'])}
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 500
+    dashboard = load_dashboard(job)
+    if dashboard is None:
+        return jsonify({'error': f"Results of job {job.id} are no longer stored"}), 404
+    
+    try:
+        result = dashboard['whatif'].score(weights, payload.get('rebalance_period', 'ME'))
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error in index route: {e}")
-        return f"An error occurred: {str(e)}"
+        logger.error(f"Error in what-if route: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/whatif', methods=['POST'])
+def job_whatif(job_id):
+    """Re-score a weight vector against the prices of one dashboard job"""
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job: {job_id}"}), 404
+    return score_whatif(job)
+
+@app.route('/api/whatif', methods=['POST'])
+def whatif():
+    """Re-score a weight vector against the latest configured dashboard backtest"""
+    key, function = dashboard_job()
+    job = job_runner.latest(key)
+    if job is None or job.status == 'failed':
+        job = job_runner.submit(key, function)
+    return score_whatif(job)
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
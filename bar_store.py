@@ -0,0 +1,92 @@
+import glob
+import os
+import pandas as pd
+
+STORE_DIR = 'bar_store'
+
+def _symbol_dir(symbol, interval, store_dir=None):
+    safe_symbol = symbol.replace('=', '_').replace('^', '_').replace('/', '_')
+    return os.path.join(store_dir or STORE_DIR, interval, safe_symbol)
+
+def write_bars(symbol, interval, closes, store_dir=None):
+    """Merge close prices into the symbol's monthly partitions.
+
+    Each partition holds one calendar month of bars as a pickled Series, so
+    readers only ever load one month per symbol at a time.
+    """
+    closes = pd.Series(closes, dtype=float).dropna().sort_index()
+    if closes.index.tz is not None:
+        closes.index = closes.index.tz_localize(None)
+    symbol_dir = _symbol_dir(symbol, interval, store_dir)
+    os.makedirs(symbol_dir, exist_ok=True)
+
+    for month, bars in closes.groupby(closes.index.to_period('M')):
+        path = os.path.join(symbol_dir, f"{month}.pkl")
+        if os.path.exists(path):
+            existing = pd.read_pickle(path)
+            bars = pd.concat([existing, bars])
+            bars = bars[~bars.index.duplicated(keep='last')].sort_index()
+        tmp_path = f"{path}.tmp"
+        bars.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+
+def ingest_yfinance(symbol, interval='1h', period='730d', store_dir=None):
+    """Download intraday bars from yfinance into the store"""
+    import yfinance as yf
+
+    history = yf.download(symbol, interval=interval, period=period, progress=False)
+    if len(history) == 0:
+        print(f"No {interval} bars available for {symbol}")
+        return 0
+    close = history['Close']
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+    write_bars(symbol, interval, close, store_dir)
+    return len(close)
+
+def list_months(symbols, interval, store_dir=None):
+    """List the months stored for any of the symbols, in time order"""
+    months = set()
+    for symbol in symbols:
+        pattern = os.path.join(_symbol_dir(symbol, interval, store_dir), '*.pkl')
+        months.update(os.path.basename(path)[:-4] for path in glob.glob(pattern))
+    return sorted(months, key=pd.Period)
+
+def iter_bar_chunks(symbols, interval, start=None, end=None, chunk_rows=None, store_dir=None):
+    """Yield time-ordered DataFrames of close prices, one column per symbol.
+
+    Chunks follow the monthly partitions (optionally split further into
+    chunk_rows rows), and each is the outer join of the symbols' bars for
+    that month, so concatenating every chunk gives the full aligned panel.
+    """
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    for month in list_months(symbols, interval, store_dir):
+        period = pd.Period(month)
+        if (start is not None and period.end_time < start) or (end is not None and period.start_time > end):
+            continue
+
+        columns = {}
+        for symbol in symbols:
+            path = os.path.join(_symbol_dir(symbol, interval, store_dir), f"{month}.pkl")
+            if os.path.exists(path):
+                columns[symbol] = pd.read_pickle(path)
+        chunk = pd.DataFrame(columns).reindex(columns=list(symbols)).sort_index()
+        if start is not None:
+            chunk = chunk[chunk.index >= start]
+        if end is not None:
+            chunk = chunk[chunk.index <= end]
+        if chunk.empty:
+            continue
+
+        step = chunk_rows or len(chunk)
+        for offset in range(0, len(chunk), step):
+            yield chunk.iloc[offset:offset + step]
+
+def load_bars(symbols, interval, start=None, end=None, store_dir=None):
+    """Load the full aligned close panel into memory (for data that fits)"""
+    chunks = list(iter_bar_chunks(symbols, interval, start, end, store_dir=store_dir))
+    if not chunks:
+        return pd.DataFrame(columns=list(symbols), dtype=float)
+    return pd.concat(chunks)
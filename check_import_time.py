@@ -0,0 +1,89 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Cumulative import time budget (ms) for each entry point
+IMPORT_BUDGETS_MS = {
+    'main': 1500,
+    'app': 2500,
+    'rebalancer': 500
+}
+
+# Heavy modules that must only load on the code paths that use them
+DEFERRED_MODULES = [
+    'yfinance',
+    'matplotlib',
+    'seaborn',
+    'plotly',
+    'requests',
+    'telebot'
+]
+
+def measure_import(module, repeat=3):
+    """Measure cumulative import time of a module using python -X importtime.
+
+    Returns the fastest cumulative time in milliseconds across runs and the
+    set of top-level packages imported along the way.
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    best_us = None
+    imported = set()
+
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=repo_dir,
+            capture_output=True,
+            text=True
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{proc.stderr}")
+
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            parts = line[len('import time:'):].split('|')
+            if len(parts) != 3 or not parts[1].strip().isdigit():
+                continue  # Header line
+            cumulative_us = int(parts[1])
+            name = parts[2].strip()
+            imported.add(name.split('.')[0])
+            # The entry module itself is the only unindented line for it
+            if parts[2] == f' {module}':
+                best_us = cumulative_us if best_us is None else min(best_us, cumulative_us)
+
+    return best_us / 1000, imported
+
+def check_import_budgets(budgets=None, repeat=3):
+    """Check every entry point against its budget and deferred module list"""
+    if budgets is None:
+        budgets = IMPORT_BUDGETS_MS
+
+    failures = []
+    for module, budget_ms in budgets.items():
+        elapsed_ms, imported = measure_import(module, repeat)
+        eager = sorted(set(DEFERRED_MODULES) & imported)
+        status = 'OK' if elapsed_ms <= budget_ms and not eager else 'FAIL'
+        print(f"{module}: {elapsed_ms:.0f} ms (budget {budget_ms} ms) {status}")
+
+        if elapsed_ms > budget_ms:
+            failures.append(f"{module} import took {elapsed_ms:.0f} ms, budget is {budget_ms} ms")
+        if eager:
+            failures.append(f"{module} eagerly imports {', '.join(eager)}")
+
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Check entry point import time budgets")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Runs per module; the fastest is compared to the budget")
+    args = parser.parse_args()
+
+    failures = check_import_budgets(repeat=args.repeat)
+    for failure in failures:
+        print(f"ERROR: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import base64
+import numpy as np
+from config import BacktestConfig
+
+# Quantized correlations: codes 0-254 span -1..1, 255 marks a missing value
+QUANTIZE_LEVELS = 254
+MISSING_CODE = 255
+
+def average_linkage(distance):
+    """Agglomerative clustering with average linkage.
+
+    Returns merges as (left node, right node, distance, size) rows in merge
+    order, where nodes below n are leaves and node n + k is the k-th merge.
+    Each row's nearest neighbour is cached and only rescanned when it
+    pointed at a merged cluster, so typical cost is well under O(n^3).
+    """
+    distance = np.array(distance, dtype=float)
+    n = len(distance)
+    np.fill_diagonal(distance, np.inf)
+    sizes = np.ones(n)
+    nodes = np.arange(n)
+    row_min = distance.min(axis=1) if n else np.zeros(0)
+    row_arg = distance.argmin(axis=1) if n else np.zeros(0, dtype=int)
+    merges = []
+
+    for step in range(n - 1):
+        i = int(np.argmin(row_min))
+        j = int(row_arg[i])
+        if j < i:
+            i, j = j, i
+        merges.append((nodes[i], nodes[j], distance[i, j], sizes[i] + sizes[j]))
+
+        # Merged cluster takes row i; row j is retired
+        merged = (sizes[i] * distance[i] + sizes[j] * distance[j]) / (sizes[i] + sizes[j])
+        distance[i, :] = merged
+        distance[:, i] = merged
+        distance[j, :] = np.inf
+        distance[:, j] = np.inf
+        distance[i, i] = np.inf
+        sizes[i] += sizes[j]
+        nodes[i] = n + step
+        row_min[j] = np.inf
+
+        stale = np.flatnonzero(((row_arg == i) | (row_arg == j)) & np.isfinite(row_min))
+        stale = np.union1d(stale, [i])
+        row_min[stale] = distance[stale].min(axis=1)
+        row_arg[stale] = distance[stale].argmin(axis=1)
+        closer = distance[:, i] < row_min
+        row_min[closer] = distance[closer, i]
+        row_arg[closer] = i
+
+    return np.array(merges, dtype=float).reshape(-1, 4)
+
+def leaf_order(merges, n):
+    """Leaf order of the dendrogram, so every subtree is contiguous"""
+    if n == 0:
+        return []
+    order = []
+    stack = [n + len(merges) - 1] if len(merges) else [0]
+    while stack:
+        node = stack.pop()
+        if node < n:
+            order.append(node)
+        else:
+            left, right = merges[node - n, :2].astype(int)
+            stack.extend([right, left])
+    return order
+
+def cut_clusters(merges, n, n_clusters):
+    """Assign leaves to the n_clusters clusters left by undoing the last merges"""
+    parent = np.arange(n + len(merges))
+    def root(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+    for k, (left, right, _, _) in enumerate(merges[:max(n - n_clusters, 0)]):
+        parent[root(int(left))] = n + k
+        parent[root(int(right))] = n + k
+    return np.array([root(leaf) for leaf in range(n)])
+
+def cluster_correlation(correlation, max_clusters=None):
+    """Hierarchical-clustering order and cluster labels for a correlation matrix.
+
+    Uses the distance sqrt((1 - rho) / 2) with missing correlations treated
+    as zero. Returns the tickers in dendrogram order and, for each of them,
+    a cluster number (numbered in display order).
+    """
+    max_clusters = max_clusters or BacktestConfig.CORRELATION_VIEW['MAX_CLUSTERS']
+    tickers = list(correlation.columns)
+    n = len(tickers)
+    rho = np.nan_to_num(correlation.to_numpy(dtype=float), nan=0.0)
+    distance = np.sqrt(np.clip((1 - rho) / 2, 0, 1))
+    merges = average_linkage(distance)
+    order = leaf_order(merges, n)
+    raw_labels = cut_clusters(merges, n, min(max_clusters, n))[order]
+    _, first_seen, labels = np.unique(raw_labels, return_index=True, return_inverse=True)
+    relabel = np.argsort(np.argsort(first_seen))
+    return {
+        'order': [tickers[i] for i in order],
+        'labels': relabel[labels].tolist()
+    }
+
+def quantize(values):
+    """Encode correlations in [-1, 1] as base64 uint8 codes (255 for missing)"""
+    values = np.asarray(values, dtype=float)
+    codes = np.round((np.clip(values, -1, 1) + 1) / 2 * QUANTIZE_LEVELS)
+    codes = np.where(np.isnan(values), MISSING_CODE, codes).astype(np.uint8)
+    return base64.b64encode(codes.tobytes()).decode('ascii')
+
+def cluster_means(correlation, labels):
+    """Average correlation between every pair of clusters (diagonal excludes self-pairs)"""
+    values = correlation.to_numpy(dtype=float)
+    labels = np.asarray(labels)
+    n_clusters = labels.max() + 1 if len(labels) else 0
+    membership = (labels[:, None] == np.arange(n_clusters)[None, :]).astype(float)
+    observed = ~np.isnan(values)
+    np.fill_diagonal(observed, False)
+    totals = membership.T @ np.where(observed, values, 0) @ membership
+    counts = membership.T @ observed.astype(float) @ membership
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = totals / counts
+    # Singleton clusters correlate perfectly with themselves
+    singles = np.diag(counts) == 0
+    means[np.diag_indices(n_clusters)] = np.where(singles, 1.0, np.diag(means))
+    return means
+
+class CorrelationView:
+    """Clustered correlation matrix served as quantized tiles.
+
+    The cluster-level matrix is small enough to send up front; the asset-
+    level tile for any pair of clusters is encoded on request.
+    """
+
+    def __init__(self, correlation, clusters=None):
+        clusters = clusters or cluster_correlation(correlation)
+        self.order = clusters['order']
+        self.labels = np.asarray(clusters['labels'], dtype=int)
+        self.correlation = correlation.loc[self.order, self.order]
+        self.n_clusters = int(self.labels.max()) + 1 if len(self.labels) else 0
+
+    def members(self, cluster):
+        return [self.order[i] for i in np.flatnonzero(self.labels == cluster)]
+
+    def overview(self):
+        """Initial payload: full matrix for small universes, else the cluster matrix"""
+        if len(self.order) <= BacktestConfig.CORRELATION_VIEW['EXPAND_BELOW']:
+            return self.tile()
+        clusters = [self.members(c) for c in range(self.n_clusters)]
+        names = [f"{members[0]} +{len(members) - 1}" if len(members) > 1 else members[0]
+                 for members in clusters]
+        return {
+            'level': 'cluster',
+            'rows': names,
+            'columns': names,
+            'sizes': [len(members) for members in clusters],
+            'members': [members[:10] for members in clusters],
+            'values': quantize(cluster_means(self.correlation, self.labels))
+        }
+
+    def tile(self, row_cluster=None, column_cluster=None):
+        """Asset-level correlations between two clusters (or the whole matrix)"""
+        rows = self.order if row_cluster is None else self.members(row_cluster)
+        columns = self.order if column_cluster is None else self.members(column_cluster)
+        return {
+            'level': 'asset',
+            'rows': rows,
+            'columns': columns,
+            'values': quantize(self.correlation.loc[rows, columns].to_numpy())
+        }
@@ -13,6 +13,13 @@ class BacktestConfig:
         'SOL-USD': 0.10
     }
     
+    # Optional time-varying target weights (glide path) used instead of
+    # PORTFOLIO: {date: {ticker: weight}} or a CSV path. Each allocation
+    # applies from its date until the next, e.g.
+    # {'2020-01-01': {'VOO': 0.75, 'BTC-USD': 0.25},
+    #  '2022-01-01': {'VOO': 0.90, 'BTC-USD': 0.10}}
+    WEIGHT_SCHEDULE = None
+    
     # Backtest Parameters
     START_DATE = '2017-11-09'
     END_DATE = datetime.now().strftime('%Y-%m-%d')
@@ -42,7 +49,13 @@ class BacktestConfig:
         'Sortino Ratio',
         'Max Drawdown',
         'Calmar Ratio',
-        'Win Rate'
+        'Win Rate',
+        'VaR (Historical)',
+        'CVaR (Historical)',
+        'VaR (Parametric)',
+        'CVaR (Parametric)',
+        'VaR (Cornish-Fisher)',
+        'CVaR (Cornish-Fisher)'
     ]
     
     # Risk-Free Rate Settings
@@ -60,7 +73,37 @@ class BacktestConfig:
         'VAR_CONFIDENCE': 0.95,
         'ROLLING_WINDOW': 126,  # ~6 months of trading days
         'MIN_TRADING_DAYS': 20,
-        'ANNUALIZATION_FACTOR': 252
+        'ANNUALIZATION_FACTOR': 252,
+        'TOP_DRAWDOWNS': 5      # Drawdown episodes reported per series
+    }
+    
+    # Start x end holding-period surfaces
+    HOLDING_PERIODS = {
+        'FREQUENCY': 'ME',                # Start and end on period closes
+        'MAX_TILE_CELLS': 20_000_000      # Bounds drawdown working memory
+    }
+    
+    # Price data-quality checks run before simulation
+    DATA_QUALITY = {
+        'STALE_RUN': 5,  # Repeated closes in a row that flag the whole run as stale
+        'JUMP_Z': 10,    # Robust z-score of a log return flagged as a jump
+        'REPAIR': []     # Any of 'spikes', 'stale', 'nonpositive'
+    }
+    
+    # Covariance estimation for risk contribution and correlation
+    COVARIANCE = {
+        'ESTIMATOR': 'pairwise',  # 'pairwise', 'ledoit_wolf', 'ewma' or 'factor'
+        'MIN_PERIODS': 20,        # Minimum overlapping returns per pair
+        'EWMA_HALFLIFE': 63,      # Trading days
+        'FACTORS': 10,            # Factor model rank
+        'BLOCK_SIZE': 512,        # Assets per block of pairwise products
+        'FLOAT32_ABOVE': 500      # Use float32 for universes at least this large
+    }
+    
+    # Dashboard correlation heatmap
+    CORRELATION_VIEW = {
+        'MAX_CLUSTERS': 20,  # Clusters shown in the collapsed view
+        'EXPAND_BELOW': 40   # Show every asset when the matrix is this small
     }
     
     # Scoring Weights
@@ -81,6 +124,54 @@ class BacktestConfig:
         'Low Vol': lambda returns: returns.rolling(21).std() <= returns.std()
     }
     
+    # Persistent calculate_metrics result cache
+    RESULT_CACHE = {
+        'DIR': 'result_cache',
+        'MAX_BYTES': 512 * 1024 * 1024,
+        'MAX_ENTRIES': 200
+    }
+    
+    # Telegram drift alert daemon (drift_alerts.py)
+    DRIFT_ALERTS = {
+        'DB': 'drift_alerts.db',
+        'INTERVAL': 300,           # Seconds between price checks
+        'THRESHOLD': 5.0,          # Default alert threshold in percentage points
+        'RESET_FRACTION': 0.8,     # Re-arm once drift falls below this share of the threshold
+        'MESSAGES_PER_SECOND': 25  # Stay under Telegram's bulk send limit
+    }
+    
+    # Shared read-only market-data snapshot for multi-worker deployments (market_data.py)
+    MARKET_DATA = {
+        'DIR': 'market_data',
+        'REFRESH_INTERVAL': 6 * 60 * 60,  # Seconds between refresher downloads
+        'KEEP_GENERATIONS': 2             # Older snapshots are removed once replaced
+    }
+    
+    # Background backtest jobs run by the web app
+    JOBS = {
+        'MAX_WORKERS': 2,
+        'RESULT_TTL': 3600,
+        'RETRY_AFTER': 5,  # Seconds clients wait before asking again for a running job's results
+        'REGISTRY': 'result_cache/jobs.db',  # Job state shared by every web worker
+        'CACHED_DASHBOARDS': 4  # Dashboards each worker keeps built in memory
+    }
+    
+    # Currency all prices and portfolio values are reported in
+    # (None keeps every series in its own quote currency, e.g. 'AUD' converts)
+    BASE_CURRENCY = None
+    
+    # Quote currency by ticker suffix (checked in order)
+    CURRENCY_CLASSIFICATIONS = {
+        'AUD': lambda ticker: ticker.endswith('.AX') or ticker.endswith('-AUD'),
+        'GBP': lambda ticker: ticker.endswith('.L'),
+        'CAD': lambda ticker: ticker.endswith('.TO'),
+        'EUR': lambda ticker: ticker.endswith('-EUR'),
+        'USD': lambda ticker: True
+    }
+    
+    # Benchmark whose returns classify market regimes
+    REGIME_BENCHMARK = 'S&P500 (USD)'
+    
     # Asset Classifications
     ASSET_CLASSIFICATIONS = {
         'ASX': lambda ticker: ticker.endswith('.AX'),
@@ -128,6 +219,14 @@ class BacktestConfig:
             raise ValueError(f"Portfolio weights sum to {total_weight}, not 1.0")
         return True
     
+    @classmethod
+    def get_currency(cls, ticker):
+        """Get quote currency for a given ticker"""
+        for currency, condition in cls.CURRENCY_CLASSIFICATIONS.items():
+            if condition(ticker):
+                return currency
+        return cls.BASE_CURRENCY
+    
     @classmethod
     def get_market_type(cls, ticker):
         """Get market type for a given ticker"""
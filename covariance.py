@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+from config import BacktestConfig
+
+def _settings(options):
+    settings = dict(BacktestConfig.COVARIANCE)
+    settings.update({k: v for k, v in options.items() if v is not None})
+    return settings
+
+def _prepare(returns, settings):
+    """Centered returns with missing values as zero, plus the observation mask.
+
+    Large universes are computed in float32 to halve memory; columns are
+    centered first so the single-precision moments do not lose accuracy.
+    """
+    values = returns.to_numpy(dtype=float, copy=True)
+    values[~np.isfinite(values)] = np.nan
+    dtype = np.float32 if values.shape[1] >= settings['FLOAT32_ABOVE'] else np.float64
+    mask = ~np.isnan(values)
+    counts = mask.sum(axis=0)
+    means = np.where(counts > 0, np.where(mask, values, 0).sum(axis=0) / np.maximum(counts, 1), 0)
+    return np.where(mask, values - means, 0).astype(dtype), mask.astype(dtype)
+
+def _pairwise_moments(x, mask, row_weights=None, ddof=1, min_periods=1, block_size=512, squares=False,
+                      variances=False):
+    """Pairwise-complete covariance from masked matrix products, one column block at a time.
+
+    For each pair of assets only the rows where both have returns are used,
+    with optional row weights. Working memory is (assets x block_size) per
+    product. With squares=True the weighted mean of x_i^2 x_j^2 over each
+    overlap is also returned (for shrinkage intensity). With variances=True
+    the variance of asset i over its overlap with asset j is returned as
+    entry (i, j) in place of the counts.
+    """
+    n_assets = x.shape[1]
+    weighted_x = x if row_weights is None else x * row_weights[:, None]
+    weighted_mask = mask if row_weights is None else mask * row_weights[:, None]
+    covariance = np.empty((n_assets, n_assets), dtype=x.dtype)
+    counts = np.empty((n_assets, n_assets), dtype=x.dtype)
+    fourth = np.empty((n_assets, n_assets), dtype=x.dtype) if squares else None
+    overlap_variance = np.empty((n_assets, n_assets), dtype=x.dtype) if variances else None
+    x_squared = x * x if squares or variances else None
+    weighted_squared = ((x_squared if row_weights is None else x_squared * row_weights[:, None])
+                        if squares or variances else None)
+
+    for start in range(0, n_assets, block_size):
+        block = slice(start, start + block_size)
+        weight_sum = weighted_mask.T @ mask[:, block]
+        sum_i = weighted_x.T @ mask[:, block]
+        sum_j = weighted_mask.T @ x[:, block]
+        products = weighted_x.T @ x[:, block]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = (products - sum_i * sum_j / weight_sum) / (weight_sum - ddof)
+            if squares:
+                fourth[:, block] = (weighted_squared.T @ x_squared[:, block]) / weight_sum
+            if variances:
+                var_i = (weighted_squared.T @ mask[:, block] - sum_i * sum_i / weight_sum) / (weight_sum - ddof)
+                overlap_variance[:, block] = np.where(weight_sum >= min_periods, var_i, np.nan)
+        covariance[:, block] = np.where(weight_sum >= min_periods, cov, np.nan)
+        counts[:, block] = weight_sum
+
+    if squares:
+        return covariance, counts, fourth
+    if variances:
+        return covariance, overlap_variance
+    return covariance, counts
+
+def _pairwise_estimate(returns, settings, variances=False):
+    x, mask = _prepare(returns, settings)
+    return _pairwise_moments(x, mask, min_periods=settings['MIN_PERIODS'],
+                             block_size=settings['BLOCK_SIZE'], variances=variances)
+
+def pairwise_covariance(returns, **options):
+    """Covariance using every date both assets have returns (no zero-filling)"""
+    covariance, _ = _pairwise_estimate(returns, _settings(options))
+    return covariance
+
+def ledoit_wolf_covariance(returns, **options):
+    """Pairwise covariance shrunk toward a scaled identity (Ledoit-Wolf).
+
+    The shrinkage intensity follows Ledoit and Wolf (2004), with each
+    entry's estimation error measured over that pair's own overlap so
+    late-listing assets count their shorter history.
+    """
+    settings = _settings(options)
+    x, mask = _prepare(returns, settings)
+    covariance, counts, fourth = _pairwise_moments(
+        x, mask, min_periods=settings['MIN_PERIODS'], block_size=settings['BLOCK_SIZE'], squares=True
+    )
+    valid = np.isfinite(covariance)
+    sample = np.where(valid, covariance, 0)
+    target = np.nanmean(np.diag(covariance))
+    identity = np.eye(len(sample), dtype=sample.dtype)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error = np.where(valid, (fourth - sample ** 2) / counts, 0)
+    dispersion = np.sum((sample - target * identity) ** 2)
+    shrinkage = float(np.clip(np.sum(error) / dispersion, 0, 1)) if dispersion > 0 else 1.0
+    shrunk = shrinkage * target * identity + (1 - shrinkage) * sample
+    return np.where(valid | (identity > 0), shrunk, np.nan)
+
+def _ewma_estimate(returns, settings, variances=False):
+    x, mask = _prepare(returns, settings)
+    age = np.arange(len(x))[::-1]
+    weights = (0.5 ** (age / settings['EWMA_HALFLIFE'])).astype(x.dtype)
+    # Weighted observation counts are small for recent listings, so require
+    # the plain overlap to meet min_periods instead
+    covariance, moments = _pairwise_moments(x, mask, row_weights=weights, ddof=0,
+                                            block_size=settings['BLOCK_SIZE'], variances=variances)
+    enough = _overlap_counts(mask, settings['BLOCK_SIZE']) >= settings['MIN_PERIODS']
+    return np.where(enough, covariance, np.nan), np.where(enough, moments, np.nan)
+
+def ewma_covariance(returns, **options):
+    """Exponentially weighted covariance (RiskMetrics style) over each pair's overlap"""
+    covariance, _ = _ewma_estimate(returns, _settings(options))
+    return covariance
+
+def _overlap_counts(mask, block_size):
+    counts = np.empty((mask.shape[1], mask.shape[1]), dtype=mask.dtype)
+    for start in range(0, mask.shape[1], block_size):
+        block = slice(start, start + block_size)
+        counts[:, block] = mask.T @ mask[:, block]
+    return counts
+
+def factor_covariance(returns, **options):
+    """Low-rank statistical factor model: B F B' plus diagonal specific risk.
+
+    Factors are the leading principal components of the centered panel,
+    found with a randomized SVD. Each asset's loadings are then fitted only
+    on the dates it has returns, so short histories are not pulled toward
+    zero by the missing values.
+    """
+    settings = _settings(options)
+    x, mask = _prepare(returns, settings)
+    n_obs, n_assets = x.shape
+    n_factors = min(settings['FACTORS'], n_assets, max(n_obs - 1, 1))
+
+    # Randomized range finder with two power iterations
+    rng = np.random.default_rng(0)
+    sketch = x @ rng.standard_normal((n_assets, n_factors + 10)).astype(x.dtype)
+    for _ in range(2):
+        sketch = x @ (x.T @ np.linalg.qr(sketch)[0])
+    basis = np.linalg.qr(sketch)[0]
+    _, _, vt = np.linalg.svd(basis.T @ x, full_matrices=False)
+    factors = x @ vt[:n_factors].T
+
+    # Per-asset least squares over each asset's own dates, solved as one batch
+    outer = (factors[:, :, None] * factors[:, None, :]).reshape(n_obs, -1)
+    gram = (mask.T @ outer).reshape(n_assets, n_factors, n_factors)
+    gram += np.eye(n_factors, dtype=x.dtype) * 1e-8 * np.trace(gram, axis1=1, axis2=2)[:, None, None]
+    cross = x.T @ factors
+    loadings = np.linalg.solve(gram, cross[:, :, None])[:, :, 0]
+
+    observations = mask.sum(axis=0)
+    residual = (np.sum(x * x, axis=0) - np.einsum('ik,ik->i', loadings, cross))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        specific = np.maximum(residual, 0) / np.maximum(observations - n_factors - 1, 1)
+    factor_cov = np.cov(factors, rowvar=False, ddof=1).reshape(n_factors, n_factors)
+
+    covariance = loadings @ factor_cov @ loadings.T
+    covariance[np.diag_indices(n_assets)] += specific
+    enough = observations >= settings['MIN_PERIODS']
+    return np.where(enough[:, None] & enough[None, :], covariance, np.nan)
+
+COVARIANCE_ESTIMATORS = {
+    'pairwise': pairwise_covariance,
+    'ledoit_wolf': ledoit_wolf_covariance,
+    'ewma': ewma_covariance,
+    'factor': factor_covariance
+}
+
+# Estimators measuring each pair over its own overlap, which can also
+# return the variances over that overlap
+OVERLAP_ESTIMATORS = {
+    'pairwise': _pairwise_estimate,
+    'ewma': _ewma_estimate
+}
+
+def estimate_covariance(returns, method=None, **options):
+    """Estimate the (per-period) covariance of returns with missing values left as NaN.
+
+    method is one of COVARIANCE_ESTIMATORS, defaulting to
+    BacktestConfig.COVARIANCE['ESTIMATOR']; options override the other
+    COVARIANCE settings (BLOCK_SIZE, MIN_PERIODS, EWMA_HALFLIFE, FACTORS).
+    """
+    method = method or BacktestConfig.COVARIANCE['ESTIMATOR']
+    if method not in COVARIANCE_ESTIMATORS:
+        raise ValueError(f"Unknown covariance estimator: {method}")
+    covariance = COVARIANCE_ESTIMATORS[method](returns, **{k.upper(): v for k, v in options.items()})
+    covariance = (covariance + covariance.T) / 2
+    return pd.DataFrame(covariance.astype(float), index=returns.columns, columns=returns.columns)
+
+def covariance_to_correlation(covariance):
+    """Scale a covariance matrix to correlations"""
+    values = covariance.to_numpy(dtype=float)
+    std = np.sqrt(np.diag(values))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = np.clip(values / std[:, None] / std[None, :], -1, 1)
+    np.fill_diagonal(correlation, np.where(std > 0, 1.0, np.nan))
+    return pd.DataFrame(correlation, index=covariance.index, columns=covariance.columns)
+
+def estimate_correlation(returns, method=None, **options):
+    """Estimate the correlation of returns with the selected covariance estimator.
+
+    Overlap estimators scale each pair by the variances over that pair's
+    own overlap, matching pairwise-complete correlation; model estimators
+    (Ledoit-Wolf, factor) are scaled by their own diagonal.
+    """
+    method = method or BacktestConfig.COVARIANCE['ESTIMATOR']
+    if method not in OVERLAP_ESTIMATORS:
+        return covariance_to_correlation(estimate_covariance(returns, method, **options))
+    settings = _settings({k.upper(): v for k, v in options.items()})
+    covariance, variance = OVERLAP_ESTIMATORS[method](returns, settings, variances=True)
+    covariance = covariance.astype(float)
+    variance = variance.astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = np.clip(covariance / np.sqrt(variance * variance.T), -1, 1)
+    correlation = (correlation + correlation.T) / 2
+    np.fill_diagonal(correlation, np.where(np.diag(variance) > 0, 1.0, np.nan))
+    return pd.DataFrame(correlation, index=returns.columns, columns=returns.columns)
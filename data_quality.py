@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+from config import BacktestConfig
+
+REPAIR_POLICIES = ('spikes', 'stale', 'nonpositive')
+
+# Arrays below are laid out (tickers, days) so every scan runs along
+# contiguous memory
+
+def _runs(flags):
+    """Start index and length of each run of True in a 1-D flag array"""
+    edges = np.flatnonzero(np.diff(np.concatenate([[False], flags, [False]])))
+    return edges[::2], edges[1::2] - edges[::2]
+
+def _row_median(values):
+    """NaN-ignoring median per ticker via one sort"""
+    ordered = np.sort(values, axis=1)
+    counts = np.sum(~np.isnan(values), axis=1)
+    low = np.take_along_axis(ordered, np.maximum((counts - 1) // 2, 0)[:, None], axis=1)[:, 0]
+    high = np.take_along_axis(ordered, np.maximum(counts // 2, 0)[:, None], axis=1)[:, 0]
+    return np.where(counts > 0, (low + high) / 2, np.nan)
+
+def market_calendar(valid, dates, markets, columns):
+    """Infer each market's open days from the data.
+
+    A day is open for a market if it is a weekday (any day for crypto) and
+    at least one of that market's tickers traded, or, for markets with a
+    single ticker, any non-crypto ticker traded. valid is a (tickers, days)
+    mask of observed prices; returns a boolean mask of expected trading
+    days with the same (tickers, days) shape.
+    """
+    weekday = np.asarray(dates.dayofweek < 5)
+    market_of = np.array([markets.get(ticker, 'US') for ticker in columns])
+    stock_rows = market_of != 'Crypto'
+    any_stock = valid[stock_rows].any(axis=0) if stock_rows.any() else weekday
+    expected = np.zeros_like(valid)
+    for market in np.unique(market_of):
+        in_market = market_of == market
+        if market == 'Crypto':
+            open_days = np.ones(len(dates), dtype=bool)
+        elif in_market.sum() > 1:
+            open_days = weekday & valid[in_market].any(axis=0)
+        else:
+            open_days = weekday & any_stock
+        expected[in_market] = open_days
+    return expected
+
+class DataQualityReport:
+    """Per-ticker data-quality summary plus cell-level flags on the price index"""
+
+    def __init__(self, summary, flags):
+        self.summary = summary
+        self.flags = flags
+
+    def flagged(self, policies):
+        """Cells flagged by any of the given repair policies"""
+        mask = None
+        for policy in policies:
+            if policy not in REPAIR_POLICIES:
+                raise ValueError(f"Unknown repair policy: {policy}")
+            mask = self.flags[policy] if mask is None else mask | self.flags[policy]
+        return mask
+
+def assess_price_data(price_data, markets=None, min_days=None, settings=None):
+    """Run every data-quality check over the aligned price array at once.
+
+    Reports per ticker: inception and last dates, observations, missing
+    trading days relative to the inferred market calendar and the longest
+    such gap, stale runs of repeated closes, jump outliers by robust
+    z-score of log returns (and spikes that immediately reverse), and
+    zero or negative prices. Observation checks run over one flattened
+    array of every ticker's observations in date order.
+    """
+    settings = settings or BacktestConfig.DATA_QUALITY
+    min_days = min_days or BacktestConfig.RISK_SETTINGS['MIN_TRADING_DAYS']
+    markets = markets or {}
+    columns = list(price_data.columns)
+    if price_data.empty:
+        return DataQualityReport(pd.DataFrame(index=columns), {})
+
+    # The index is padded to every weekday (every day if crypto is present)
+    # so the calendar can mark days no ticker reported. A day only counts as
+    # a gap when the inferred calendar has the ticker's market open, so days
+    # missing for every ticker of a market are taken as holidays, not gaps
+    has_crypto = any(markets.get(ticker) == 'Crypto' for ticker in columns)
+    calendar = pd.date_range(price_data.index.min(), price_data.index.max(), freq='D')
+    if not has_crypto:
+        calendar = calendar[calendar.dayofweek < 5]
+    daily = price_data.reindex(calendar.union(price_data.index))
+    values = np.ascontiguousarray(daily.to_numpy(dtype=float).T)
+    n_tickers, n_days = values.shape
+    valid = ~np.isnan(values)
+    observations = valid.sum(axis=1)
+
+    # Inception to last observation
+    first_day = np.argmax(valid, axis=1)
+    last_day = n_days - 1 - np.argmax(valid[:, ::-1], axis=1)
+    days = np.arange(n_days)
+    active = (days >= first_day[:, None]) & (days <= last_day[:, None])
+
+    # Gaps lie strictly inside each ticker's active span, so runs over the
+    # flattened expected-or-observed days never join two tickers
+    expected = market_calendar(valid, daily.index, markets, columns)
+    gaps = expected & active & ~valid
+    counted = np.flatnonzero(expected | valid)
+    gap_starts, gap_lengths = _runs(gaps.ravel()[counted])
+    longest_gap = np.zeros(n_tickers, dtype=int)
+    np.maximum.at(longest_gap, counted[gap_starts] // n_days, gap_lengths)
+
+    # Every observation in (ticker, day) order: the previous observation of
+    # a ticker is the entry before it unless that belongs to another ticker
+    positions = np.flatnonzero(valid)
+    ticker = positions // n_days
+    prices = values.ravel()[positions]
+    previous = np.empty_like(prices)
+    previous[1:] = prices[:-1]
+    first_observation = np.searchsorted(ticker, np.arange(n_tickers))
+    previous[first_observation[observations > 0]] = np.nan
+
+    # Stale runs: consecutive observations repeating the previous close.
+    # Once a run reaches STALE_RUN every repeat in it is flagged
+    repeated = prices == previous
+    run_starts, run_lengths = _runs(repeated)
+    stale = np.zeros(len(prices), dtype=bool)
+    stale[repeated] = np.repeat(run_lengths >= settings['STALE_RUN'], run_lengths)
+    longest_stale_run = np.zeros(n_tickers, dtype=int)
+    np.maximum.at(longest_stale_run, ticker[run_starts], run_lengths)
+
+    # Jumps: robust z-score of log returns between consecutive observations
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_prices = np.log(prices)
+    log_returns = np.full(len(prices), np.nan)
+    log_returns[1:] = log_prices[1:] - log_prices[:-1]
+    log_returns[~((prices > 0) & (previous > 0))] = np.nan
+    padded = np.full(values.shape, np.nan)
+    padded.reshape(-1)[positions] = log_returns
+    median = _row_median(padded)
+    deviation = np.abs(padded - median[:, None])
+    mad = _row_median(deviation)
+    scale = np.where(mad > 0, 1.4826 * mad, np.nan)
+    with np.errstate(invalid='ignore'):
+        jumps = (deviation > settings['JUMP_Z'] * scale[:, None]).reshape(-1)[positions]
+
+    def z_scores(at):
+        return (log_returns[at] - median[ticker[at]]) / scale[ticker[at]]
+
+    # A spike is a jump that the ticker's next scored observation reverses
+    scored = np.flatnonzero(~np.isnan(log_returns))
+    jump_at = np.flatnonzero(jumps)
+    following_at = scored[np.minimum(np.searchsorted(scored, jump_at, side='right'), len(scored) - 1)]
+    with np.errstate(invalid='ignore'):
+        following = np.where((following_at > jump_at) & (ticker[following_at] == ticker[jump_at]),
+                             z_scores(following_at), np.nan)
+        reversed_jump = (np.abs(following) > settings['JUMP_Z']) & (np.sign(following) == -np.sign(z_scores(jump_at)))
+    spikes = np.zeros(len(prices), dtype=bool)
+    spikes[jump_at[reversed_jump]] = True
+    nonpositive = prices <= 0
+
+    def per_ticker(mask):
+        return np.bincount(ticker[mask], minlength=n_tickers)
+
+    summary = pd.DataFrame({
+        'data_points': observations,
+        'inception': daily.index[first_day].where(observations > 0),
+        'last_date': daily.index[last_day].where(observations > 0),
+        'missing_values': gaps.sum(axis=1),
+        'longest_gap': longest_gap,
+        'stale_values': per_ticker(stale),
+        'longest_stale_run': longest_stale_run,
+        'jump_outliers': per_ticker(jumps),
+        'spikes': per_ticker(spikes),
+        'zero_values': per_ticker(prices == 0),
+        'negative_values': per_ticker(prices < 0),
+        'has_sufficient_data': observations >= min_days
+    }, index=columns)
+
+    # Observations only exist on the original rows, so flags are scattered
+    # straight into a (days, tickers) mask on the price index
+    price_row = np.full(n_days, -1)
+    price_row[daily.index.get_indexer(price_data.index)] = np.arange(len(price_data))
+    flags = {}
+    for name, mask in (('spikes', spikes), ('stale', stale), ('nonpositive', nonpositive)):
+        flagged = np.zeros((len(price_data), n_tickers), dtype=bool)
+        flagged[price_row[positions[mask] % n_days], ticker[mask]] = True
+        flags[name] = pd.DataFrame(flagged, index=price_data.index, columns=columns)
+    return DataQualityReport(summary, flags)
+
+def repair_price_data(price_data, report, policies=None):
+    """Replace flagged prices by log-linear interpolation between good neighbours.
+
+    policies is a list from REPAIR_POLICIES (default
+    BacktestConfig.DATA_QUALITY['REPAIR']). Missing days stay missing and
+    flagged prices with no later good price carry the last good one forward.
+    """
+    policies = BacktestConfig.DATA_QUALITY['REPAIR'] if policies is None else policies
+    if not policies or price_data.empty:
+        return price_data
+    flagged = report.flagged(policies).to_numpy()
+    if not flagged.any():
+        return price_data
+
+    good = price_data.where(~flagged & (price_data > 0))
+    log_prices = np.log(good).interpolate(method='time', limit_area='inside').ffill()
+    repaired = np.where(flagged, np.exp(log_prices.to_numpy()), price_data.to_numpy())
+    return pd.DataFrame(repaired, index=price_data.index, columns=price_data.columns)
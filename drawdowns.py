@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+from config import BacktestConfig
+
+def drawdown_episodes(returns, top_n=None):
+    """Top-N drawdown episodes and time-under-water statistics for every series.
+
+    returns is a (days, series) DataFrame of daily returns. Wealth paths and
+    their running maxima are built for all series at once, laid out
+    (series, days) so every series' underwater runs are contiguous in the
+    flattened array; each run is one episode and its depth, trough and
+    recovery come from segment reductions over those runs rather than a
+    scan per series. An episode runs from the last peak to the first day
+    back at that peak (recovery is NaT while still under water).
+    """
+    top_n = top_n or BacktestConfig.RISK_SETTINGS['TOP_DRAWDOWNS']
+    values = np.ascontiguousarray(returns.to_numpy(dtype=float).T)
+    n_series, n_days = values.shape
+    dates = returns.index
+    wealth = np.exp(np.cumsum(np.log1p(np.nan_to_num(values)), axis=1))
+    drawdown = wealth / np.maximum.accumulate(wealth, axis=1) - 1
+    underwater = drawdown < -1e-12
+
+    # Episode boundaries: first and last underwater day of each run
+    before = np.zeros_like(underwater)
+    before[:, 1:] = underwater[:, :-1]
+    after = np.zeros_like(underwater)
+    after[:, :-1] = underwater[:, 1:]
+    flat_underwater = underwater.ravel()
+    start_flags = (underwater & ~before).ravel()
+    starts = np.flatnonzero(start_flags)
+    ends = np.flatnonzero((underwater & ~after).ravel())
+    series = starts // n_days
+    start_day = starts % n_days
+    end_day = ends % n_days
+
+    # Depth and trough per episode by reducing over each run's segment
+    flat_drawdown = drawdown.ravel()
+    if len(starts):
+        depth = np.minimum.reduceat(flat_drawdown, starts)
+        episode_of = np.cumsum(start_flags) - 1
+        at_trough = flat_underwater & (flat_drawdown == depth[np.maximum(episode_of, 0)])
+        trough_positions = np.flatnonzero(at_trough)
+        _, first = np.unique(episode_of[trough_positions], return_index=True)
+        trough_day = trough_positions[first] % n_days
+    else:
+        depth = trough_day = np.zeros(0, dtype=int)
+
+    # Peak is the day before the run; recovery the day after it, if any
+    peak_day = start_day - 1
+    recovered = end_day + 1 < n_days
+    recovery_day = np.where(recovered, end_day + 1, n_days - 1)
+    day_numbers = (dates.values - dates.values[0]) / np.timedelta64(1, 'D') if n_days else np.zeros(0)
+    decline_days = day_numbers[trough_day] - day_numbers[peak_day]
+    duration_days = day_numbers[recovery_day] - day_numbers[peak_day]
+    recovery_days = np.where(recovered, day_numbers[recovery_day] - day_numbers[trough_day], np.nan)
+
+    # Rank episodes by depth within each series and keep the top N
+    order = np.lexsort((depth, series))
+    first_of_series = np.searchsorted(series[order], series[order], side='left')
+    rank = np.arange(len(order)) - first_of_series
+    keep = order[rank < top_n]
+    names = np.asarray(returns.columns, dtype=object)
+    episodes = pd.DataFrame({
+        'Strategy': names[series[keep]],
+        'Rank': rank[rank < top_n] + 1,
+        'Peak': dates[peak_day[keep]],
+        'Trough': dates[trough_day[keep]],
+        'Recovery': pd.DatetimeIndex(np.where(recovered[keep], dates.values[recovery_day[keep]],
+                                              np.datetime64('NaT'))),
+        'Depth': np.round(depth[keep], 4),
+        'Decline Days': decline_days[keep],
+        'Recovery Days': recovery_days[keep],
+        'Duration Days': duration_days[keep]
+    })
+
+    # Time under water per series (from each series' first return) from the
+    # same episode arrays
+    active = np.logical_or.accumulate(~np.isnan(values), axis=1).sum(axis=1)
+    counts = np.bincount(series, minlength=n_series)
+    longest = np.zeros(n_series)
+    np.maximum.at(longest, series, duration_days)
+    total_duration = np.bincount(series, weights=duration_days, minlength=n_series)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        underwater_stats = pd.DataFrame({
+            'Time Under Water': underwater.sum(axis=1) / active,
+            'Drawdown Episodes': counts,
+            'Longest Drawdown Days': np.where(counts > 0, longest, 0),
+            'Average Drawdown Days': np.where(counts > 0, total_duration / counts, 0),
+            'Current Drawdown': drawdown[:, -1] if n_days else np.full(n_series, np.nan)
+        }, index=returns.columns)
+    return episodes, underwater_stats.round(4)
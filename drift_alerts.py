@@ -0,0 +1,373 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from config import BacktestConfig
+from journal import open_journal
+from quote_cache import QuoteCache
+from rebalance_engine import compute_rebalance, CASH_FLOW_SYMBOLS
+import quotes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscribers (
+    chat_id INTEGER PRIMARY KEY,
+    threshold REAL NOT NULL,
+    breached INTEGER NOT NULL DEFAULT 0,
+    last_alert TEXT
+);
+
+CREATE TABLE IF NOT EXISTS holdings (
+    chat_id INTEGER NOT NULL REFERENCES subscribers (chat_id) ON DELETE CASCADE,
+    symbol TEXT NOT NULL,
+    units REAL NOT NULL,
+    target REAL NOT NULL,
+    PRIMARY KEY (chat_id, symbol)
+);
+"""
+
+HELP_TEXT = (
+    "Portfolio drift alerts\n"
+    "/hold SYMBOL UNITS TARGET% - set a holding\n"
+    "/remove SYMBOL - remove a holding\n"
+    "/threshold PERCENT - alert when any weight drifts this far from target\n"
+    "/status - show current drift\n"
+    "/stop - unsubscribe"
+)
+
+class SubscriberStore:
+    """SQLite store of alert subscribers, their holdings and alert state"""
+
+    def __init__(self, path=None):
+        self.path = path or BacktestConfig.DRIFT_ALERTS['DB']
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SCHEMA)
+
+    def subscribe(self, chat_id, threshold=None):
+        """Add a subscriber, or update their threshold if one is given"""
+        with self.lock, self.conn:
+            if threshold is None:
+                self.conn.execute('INSERT OR IGNORE INTO subscribers (chat_id, threshold) VALUES (?, ?)',
+                                  (chat_id, BacktestConfig.DRIFT_ALERTS['THRESHOLD']))
+            else:
+                self.conn.execute(
+                    """INSERT INTO subscribers (chat_id, threshold) VALUES (?, ?)
+                       ON CONFLICT (chat_id) DO UPDATE SET threshold = excluded.threshold""",
+                    (chat_id, threshold)
+                )
+
+    def unsubscribe(self, chat_id):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM subscribers WHERE chat_id = ?', (chat_id,))
+
+    def set_holding(self, chat_id, symbol, units, target):
+        with self.lock, self.conn:
+            self.conn.execute(
+                """INSERT INTO holdings (chat_id, symbol, units, target) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (chat_id, symbol) DO UPDATE
+                   SET units = excluded.units, target = excluded.target""",
+                (chat_id, symbol, units, target)
+            )
+
+    def remove_holding(self, chat_id, symbol):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM holdings WHERE chat_id = ? AND symbol = ?', (chat_id, symbol))
+
+    def import_portfolio(self, chat_id, portfolio, threshold=None):
+        """Subscribe a chat with the holdings of a rebalancer portfolio dict"""
+        self.subscribe(chat_id, threshold)
+        rows = [(chat_id, symbol, data['units'], data['target'])
+                for symbol, data in portfolio.items() if symbol not in CASH_FLOW_SYMBOLS]
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM holdings WHERE chat_id = ?', (chat_id,))
+            self.conn.executemany('INSERT INTO holdings (chat_id, symbol, units, target) VALUES (?, ?, ?, ?)', rows)
+
+    def load_arrays(self):
+        """Load every subscriber as rows of dense (subscribers, symbols) arrays.
+
+        Symbols are the union across all subscribers; a subscriber's
+        missing symbols have zero units and zero target.
+        """
+        with self.lock:
+            subscribers = self.conn.execute(
+                'SELECT chat_id, threshold, breached FROM subscribers ORDER BY chat_id'
+            ).fetchall()
+            holdings = self.conn.execute('SELECT chat_id, symbol, units, target FROM holdings').fetchall()
+
+        chat_ids = np.array([row[0] for row in subscribers], dtype=np.int64)
+        thresholds = np.array([row[1] for row in subscribers], dtype=float)
+        breached = np.array([bool(row[2]) for row in subscribers], dtype=bool)
+        symbols = sorted({row[1] for row in holdings})
+
+        units = np.zeros((len(chat_ids), len(symbols)))
+        targets = np.zeros((len(chat_ids), len(symbols)))
+        if holdings:
+            rows = np.searchsorted(chat_ids, np.array([row[0] for row in holdings], dtype=np.int64))
+            columns = np.searchsorted(symbols, [row[1] for row in holdings])
+            units[rows, columns] = [row[2] for row in holdings]
+            targets[rows, columns] = [row[3] for row in holdings]
+        return chat_ids, symbols, units, targets, thresholds, breached
+
+    def set_breached(self, chat_ids, breached, alerted=()):
+        """Save alert state, stamping last_alert for the chats that were alerted"""
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.conn:
+            self.conn.executemany('UPDATE subscribers SET breached = ? WHERE chat_id = ?',
+                                  zip(map(int, breached), map(int, chat_ids)))
+            self.conn.executemany('UPDATE subscribers SET last_alert = ? WHERE chat_id = ?',
+                                  [(now, int(chat_id)) for chat_id in alerted])
+
+def compute_drift(units, prices, targets):
+    """Weight drift from target for every subscriber in one pass.
+
+    units and targets are (subscribers, symbols) arrays and prices is one
+    row of base-currency prices shared by everyone (NaN where unknown).
+    Subscribers holding a symbol with no price are marked not 'valued' so
+    their alert state is left unchanged.
+    """
+    missing = np.isnan(prices)
+    valued = ~((units != 0) & missing[None, :]).any(axis=1)
+    rebalance = compute_rebalance(units, np.where(missing, 0.0, prices)[None, :], targets)
+    drift = rebalance['current_percent'] - targets
+    valued &= rebalance['total_value'] > 0
+    return {
+        'drift': drift,
+        'max_drift': np.abs(drift).max(axis=1, initial=0.0),
+        'current_percent': rebalance['current_percent'],
+        'total_value': rebalance['total_value'],
+        'valued': valued
+    }
+
+def format_alert(symbols, current_percent, targets, drift, threshold):
+    """Alert text listing one subscriber's holdings that are past the threshold"""
+    order = np.argsort(-np.abs(drift))
+    lines = [f"Portfolio drift above {threshold:g}%:"]
+    for i in order:
+        if abs(drift[i]) < threshold:
+            break
+        lines.append(f"{symbols[i]}: {current_percent[i]:.1f}% (target {targets[i]:g}%, {drift[i]:+.1f}%)")
+    return '\n'.join(lines)
+
+class StubBot:
+    """Offline stand-in for telebot.TeleBot that records sent messages"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+        print(f"[to {chat_id}] {text}")
+
+def make_bot(token=None):
+    """Create a Telegram bot from the token or TELEGRAM_BOT_TOKEN"""
+    import telebot
+
+    token = token or os.environ.get('TELEGRAM_BOT_TOKEN')
+    if not token:
+        raise ValueError("Set TELEGRAM_BOT_TOKEN or use --stub")
+    return telebot.TeleBot(token)
+
+class DriftAlertDaemon:
+    """Fetches quotes once per cycle and alerts every subscriber past their threshold.
+
+    Prices are fetched for the union of all subscribers' symbols through
+    the shared quote cache, so the number of quote requests depends on the
+    symbols watched, not the number of subscribers.
+    """
+
+    def __init__(self, store, bot, fetcher=None, quote_cache=None):
+        settings = BacktestConfig.DRIFT_ALERTS
+        self.store = store
+        self.bot = bot
+        self.fetcher = fetcher or quotes.fetch_quotes
+        self.quote_cache = quote_cache or QuoteCache(quotes.market_for)
+        self.reset_fraction = settings['RESET_FRACTION']
+        self.send_interval = 1 / settings['MESSAGES_PER_SECOND']
+        self.stop_event = threading.Event()
+
+    def current_prices(self, symbols):
+        """Refresh expired quotes and return base-currency prices aligned to symbols"""
+        self.quote_cache.refresh_stale(quotes.quoted_symbols(symbols), self.fetcher)
+        cached = self.quote_cache.prices(quotes.quoted_symbols(symbols))
+        base_prices = quotes.to_base_prices(cached, symbols)
+        return np.array([base_prices.get(symbol, np.nan) for symbol in symbols], dtype=float)
+
+    def evaluate(self):
+        """Compute drift for every subscriber against current prices"""
+        chat_ids, symbols, units, targets, thresholds, breached = self.store.load_arrays()
+        prices = self.current_prices(symbols) if symbols else np.zeros(0)
+        drift = compute_drift(units, prices, targets)
+        return chat_ids, symbols, targets, thresholds, breached, drift
+
+    def run_cycle(self):
+        """Run one fetch-and-alert cycle, returning the number of alerts sent.
+
+        A subscriber is alerted when their largest drift first crosses their
+        threshold, and re-armed once it falls back below reset_fraction of it.
+        """
+        chat_ids, symbols, targets, thresholds, breached, drift = self.evaluate()
+        if len(chat_ids) == 0:
+            return 0
+
+        valued = drift['valued']
+        over = drift['max_drift'] > thresholds
+        cleared = drift['max_drift'] < thresholds * self.reset_fraction
+        now_breached = np.where(valued, over | (breached & ~cleared), breached)
+        newly = np.flatnonzero(now_breached & ~breached)
+
+        alerted = []
+        for i in newly:
+            text = format_alert(symbols, drift['current_percent'][i], targets[i],
+                                drift['drift'][i], thresholds[i])
+            if self.send(int(chat_ids[i]), text):
+                alerted.append(chat_ids[i])
+            else:
+                # Try again next cycle
+                now_breached[i] = False
+        self.store.set_breached(chat_ids, now_breached, alerted)
+        return len(alerted)
+
+    def send(self, chat_id, text):
+        """Send one message, pacing sends under the Telegram rate limit"""
+        try:
+            self.bot.send_message(chat_id, text)
+            return True
+        except Exception as e:
+            # 403: the user blocked the bot, so stop alerting them
+            if getattr(e, 'error_code', None) == 403:
+                print(f"Unsubscribing {chat_id}: bot was blocked")
+                self.store.unsubscribe(chat_id)
+            else:
+                print(f"Error sending alert to {chat_id}: {e}")
+            return False
+        finally:
+            time.sleep(self.send_interval)
+
+    def status_text(self, chat_id):
+        """Current drift summary for one subscriber"""
+        chat_ids, symbols, targets, thresholds, breached, drift = self.evaluate()
+        matches = np.flatnonzero(chat_ids == chat_id)
+        if len(matches) == 0:
+            return "Not subscribed. Send /start to subscribe."
+        i = matches[0]
+        if not drift['valued'][i]:
+            return "No holdings with current prices yet."
+        held = np.flatnonzero((drift['current_percent'][i] > 0) | (targets[i] > 0))
+        lines = [f"Value: ${drift['total_value'][i]:,.2f}  (alert at {thresholds[i]:g}%)"]
+        for j in held:
+            lines.append(f"{symbols[j]}: {drift['current_percent'][i, j]:.1f}% "
+                         f"(target {targets[i, j]:g}%, {drift['drift'][i, j]:+.1f}%)")
+        return '\n'.join(lines)
+
+    def run(self, interval=None):
+        """Run alert cycles until stop() is called"""
+        interval = interval or BacktestConfig.DRIFT_ALERTS['INTERVAL']
+        while not self.stop_event.is_set():
+            try:
+                sent = self.run_cycle()
+                if sent:
+                    print(f"{datetime.now():%H:%M:%S} sent {sent} drift alerts")
+            except Exception as e:
+                print(f"Error in drift alert cycle: {e}")
+            self.stop_event.wait(interval)
+
+    def stop(self):
+        self.stop_event.set()
+
+def register_commands(bot, daemon):
+    """Attach subscriber commands to a telebot.TeleBot"""
+    store = daemon.store
+
+    def reply(message, text):
+        bot.send_message(message.chat.id, text)
+
+    @bot.message_handler(commands=['start', 'help'])
+    def start(message):
+        store.subscribe(message.chat.id)
+        reply(message, HELP_TEXT)
+
+    @bot.message_handler(commands=['stop'])
+    def stop(message):
+        store.unsubscribe(message.chat.id)
+        reply(message, "Unsubscribed from drift alerts.")
+
+    @bot.message_handler(commands=['threshold'])
+    def threshold(message):
+        try:
+            value = float(message.text.split()[1])
+            if value <= 0:
+                raise ValueError
+            store.subscribe(message.chat.id, value)
+            reply(message, f"Alerting when a weight drifts {value:g}% from target.")
+        except (IndexError, ValueError):
+            reply(message, "Usage: /threshold PERCENT")
+
+    @bot.message_handler(commands=['hold'])
+    def hold(message):
+        try:
+            _, symbol, units, target = message.text.split()
+            store.subscribe(message.chat.id)
+            store.set_holding(message.chat.id, symbol.upper(), float(units), float(target.rstrip('%')))
+            reply(message, f"Set {symbol.upper()}: {float(units):g} units, target {target.rstrip('%')}%.")
+        except ValueError:
+            reply(message, "Usage: /hold SYMBOL UNITS TARGET%")
+
+    @bot.message_handler(commands=['remove'])
+    def remove(message):
+        try:
+            symbol = message.text.split()[1].upper()
+            store.remove_holding(message.chat.id, symbol)
+            reply(message, f"Removed {symbol}.")
+        except IndexError:
+            reply(message, "Usage: /remove SYMBOL")
+
+    @bot.message_handler(commands=['status'])
+    def status(message):
+        reply(message, daemon.status_text(message.chat.id))
+
+def main():
+    parser = argparse.ArgumentParser(description="Send Telegram alerts when portfolio weights drift from target")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help="Run the alert daemon")
+    run.add_argument('--stub', action='store_true', help="Print alerts instead of sending them to Telegram")
+    run.add_argument('--once', action='store_true', help="Run a single cycle and exit")
+    run.add_argument('--interval', type=float, help="Seconds between cycles")
+    subscribe = subparsers.add_parser('subscribe', help="Subscribe a chat to the local journal's holdings")
+    subscribe.add_argument('chat_id', type=int)
+    subscribe.add_argument('--journal', default='portfolio.db', help="Portfolio journal to import")
+    subscribe.add_argument('--threshold', type=float, help="Drift threshold in percent")
+    parser.add_argument('--db', help="Subscriber database")
+    args = parser.parse_args()
+
+    store = SubscriberStore(args.db)
+
+    if args.command == 'subscribe':
+        portfolio = open_journal(args.journal).load_snapshot()
+        if not portfolio:
+            print(f"No holdings found in {args.journal}")
+            return
+        store.import_portfolio(args.chat_id, portfolio, args.threshold)
+        print(f"Subscribed {args.chat_id} with {len(portfolio)} holdings")
+        return
+
+    bot = StubBot() if args.stub else make_bot()
+    daemon = DriftAlertDaemon(store, bot)
+    if args.once:
+        print(f"Sent {daemon.run_cycle()} drift alerts")
+        return
+
+    if not args.stub:
+        register_commands(bot, daemon)
+        threading.Thread(target=bot.infinity_polling, daemon=True).start()
+    try:
+        daemon.run(args.interval)
+    except KeyboardInterrupt:
+        daemon.stop()
+
+if __name__ == "__main__":
+    main()
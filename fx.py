@@ -0,0 +1,47 @@
+import pandas as pd
+from price_cache import download_history, adjusted_close
+
+def fx_ticker(currency, base):
+    """Yahoo Finance ticker quoting base currency units per unit of currency"""
+    return f"{currency}{base}=X"
+
+def load_fx_rate(currency, base, end_date):
+    """Load daily base-per-currency rates, inverting the reverse pair if needed"""
+    history = download_history(fx_ticker(currency, base), end_date)
+    if len(history) > 0:
+        return adjusted_close(history)
+
+    history = download_history(fx_ticker(base, currency), end_date)
+    if len(history) > 0:
+        return 1 / adjusted_close(history)
+
+    raise ValueError(f"No FX data available for {currency}/{base}")
+
+def build_fx_panel(currencies, base, index, end_date):
+    """Build a date-aligned panel of base-per-currency rates.
+
+    Columns are currencies (the base currency is a column of ones). Rates
+    are forward-filled onto the price index so weekend crypto prices use
+    the last FX fix, and back-filled before the first available rate.
+    """
+    panel = pd.DataFrame(index=index)
+    for currency in sorted(set(currencies)):
+        if currency == base:
+            panel[currency] = 1.0
+            continue
+        rate = load_fx_rate(currency, base, end_date)
+        panel[currency] = rate.reindex(index.union(rate.index)).ffill().reindex(index)
+    return panel.bfill()
+
+def convert_to_base(price_data, currencies, fx_panel):
+    """Convert every price column to the base currency in one broadcast multiply.
+
+    currencies maps each column to its quote currency; the FX panel must
+    share the price index.
+    """
+    if price_data.empty:
+        return price_data
+    rates = fx_panel.reindex(price_data.index).to_numpy(dtype=float)
+    columns = [fx_panel.columns.get_loc(currencies[col]) for col in price_data.columns]
+    converted = price_data.to_numpy(dtype=float) * rates[:, columns]
+    return pd.DataFrame(converted, index=price_data.index, columns=price_data.columns)
@@ -0,0 +1,91 @@
+import base64
+import numpy as np
+import pandas as pd
+from config import BacktestConfig
+
+SURFACE_METRICS = {
+    'annualized_return': 'Annualized Return',
+    'total_return': 'Total Return',
+    'max_drawdown': 'Max Drawdown'
+}
+
+def period_end_positions(index, frequency):
+    """Row positions of the last observation in each resample period"""
+    positions = pd.Series(np.arange(len(index)), index=index).resample(frequency).last().dropna()
+    return positions.to_numpy(dtype=int)
+
+def holding_period_surface(returns, frequency=None, max_cells=None):
+    """Return and drawdown for every start/end period pair of every series.
+
+    returns is a (days, series) DataFrame of daily returns. Each start is
+    the close of a period and each later period close is an end. Returns
+    come from differences of log-cumulative sums broadcast over all pairs;
+    drawdowns from a running maximum taken forward from each start, with
+    starts processed in tiles of at most max_cells (starts x days x series)
+    values. Surfaces are (series, starts, ends) arrays, NaN where the end is
+    not after the start or the series had no data yet at the start.
+    """
+    settings = BacktestConfig.HOLDING_PERIODS
+    frequency = frequency or settings['FREQUENCY']
+    max_cells = max_cells or settings['MAX_TILE_CELLS']
+    values = returns.to_numpy(dtype=float)
+    n_days, n_series = values.shape
+    log_growth = np.cumsum(np.log1p(np.nan_to_num(values)), axis=0)
+    ends = period_end_positions(returns.index, frequency)
+    n_periods = len(ends)
+    dates = returns.index[ends]
+
+    # Series count as started from the close before their first non-zero return
+    active = values != 0
+    first_day = np.where(active.any(axis=0), np.argmax(active, axis=0) - 1, n_days)
+    valid_start = ends[:, None] >= first_day[None, :]
+    later = np.arange(n_periods)[None, :] > np.arange(n_periods)[:, None]
+    valid = later[:, :, None] & valid_start[:, None, :]
+
+    # Returns from log-growth differences broadcast over (starts, ends, series)
+    period_growth = log_growth[ends]
+    log_return = period_growth[None, :, :] - period_growth[:, None, :]
+    years = (dates.values[None, :] - dates.values[:, None]) / np.timedelta64(1, 'D') / 365.25
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_return = np.where(valid, np.expm1(log_return), np.nan)
+        # Periods under a year are not annualized
+        annualized = np.where(valid & (years[:, :, None] >= 1),
+                              np.expm1(log_return / years[:, :, None]), np.nan)
+
+    # Drawdowns: running peak from each start, in tiles of starts
+    max_drawdown = np.full((n_periods, n_periods, n_series), np.nan)
+    tile = max(1, max_cells // max(n_days * n_series, 1))
+    for first in range(0, n_periods, tile):
+        starts = np.arange(first, min(first + tile, n_periods))
+        offset = ends[starts[0]]
+        segment = log_growth[offset:]
+        before = np.arange(offset, n_days)[None, :] < ends[starts][:, None]
+        peaks = np.maximum.accumulate(np.where(before[:, :, None], -np.inf, segment[None]), axis=1)
+        drawdown = np.where(before[:, :, None], 0.0, segment[None] - peaks)
+        worst = np.minimum.accumulate(drawdown, axis=1)
+        max_drawdown[starts, first:] = np.expm1(worst[:, ends[first:] - offset])
+    max_drawdown = np.where(valid, max_drawdown, np.nan)
+
+    return {
+        'dates': dates,
+        'series': list(returns.columns),
+        'total_return': np.moveaxis(total_return, 2, 0).astype(np.float32),
+        'annualized_return': np.moveaxis(annualized, 2, 0).astype(np.float32),
+        'max_drawdown': np.moveaxis(max_drawdown, 2, 0).astype(np.float32)
+    }
+
+def encode_float32(values):
+    """Base64 of little-endian float32 values (NaN kept) for typed-array decoding"""
+    return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+def surface_payload(surface, series=0, metric='annualized_return'):
+    """One series/metric slice of a holding-period surface for the dashboard"""
+    if metric not in SURFACE_METRICS:
+        raise ValueError(f"Unknown surface metric: {metric}")
+    if not 0 <= series < len(surface['series']):
+        raise ValueError(f"Unknown series: {series}")
+    return {
+        'series': surface['series'][series],
+        'metric': metric,
+        'values': encode_float32(surface[metric][series])
+    }
@@ -0,0 +1,275 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from config import BacktestConfig
+
+class JobRegistry:
+    """Job status, progress and results shared by every worker process.
+
+    Each worker's jobs are mirrored into a small SQLite file, so a request
+    for a job can be answered by any worker, not only the one running it.
+    Results must be JSON-serializable.
+    """
+
+    def __init__(self, path=None):
+        path = path or BacktestConfig.JOBS['REGISTRY']
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                   id TEXT PRIMARY KEY,
+                   key TEXT NOT NULL,
+                   status TEXT NOT NULL,
+                   events TEXT NOT NULL,
+                   result TEXT,
+                   error TEXT,
+                   created REAL NOT NULL,
+                   updated REAL NOT NULL,
+                   finished_at REAL
+               )"""
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, created)')
+        self.conn.commit()
+
+    def save(self, job):
+        """Write a job's current state"""
+        with job.condition:
+            events = json.dumps(job.events)
+        try:
+            result = json.dumps(job.result) if job.result is not None else None
+        except TypeError as e:
+            print(f"Job {job.id[:8]} result is not shareable: {e}")
+            result = None
+        with self.lock, self.conn:
+            self.conn.execute(
+                """INSERT OR REPLACE INTO jobs
+                   (id, key, status, events, result, error, created, updated, finished_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (job.id, job.key, job.status, events, result, job.error,
+                 job.created, time.time(), job.finished_at)
+            )
+
+    def load(self, job_id):
+        """A job saved by any worker as a SharedJob, or None"""
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return SharedJob(row, self) if row else None
+
+    def latest(self, key):
+        """The most recently created job with this key, or None"""
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM jobs WHERE key = ? ORDER BY created DESC LIMIT 1',
+                                    (key,)).fetchone()
+        return SharedJob(row, self) if row else None
+
+    def prune(self, cutoff):
+        """Forget jobs that finished before cutoff"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM jobs WHERE finished_at < ?', (cutoff,))
+
+class Job:
+    """A queued computation with an append-only log of progress events"""
+
+    def __init__(self, key, registry=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.registry = registry
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished_at = None
+        self.events = [{'stage': 'queued', 'done': 0, 'total': 0}]
+        self.condition = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'failed')
+
+    def publish(self, stage, done=0, total=0, **extra):
+        with self.condition:
+            self.events.append({'stage': stage, 'done': done, 'total': total, **extra})
+            self.condition.notify_all()
+        if self.registry is not None:
+            self.registry.save(self)
+
+    def progress(self, stage, done, total):
+        """Progress callback handed to the job function"""
+        self.publish(stage, done, total)
+
+    def wait_events(self, start, timeout=None):
+        """Block until there are events past index start (or the timeout passes)"""
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.events) > start, timeout)
+            return self.events[start:]
+
+    def wait(self, timeout=None):
+        """Block until the job has finished or failed"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.done, timeout)
+
+    def stream(self, heartbeat=15):
+        """Yield progress as Server-Sent Events until the job completes.
+
+        Each subscriber replays the log from the start, so viewers that
+        join a running job still see every completed stage.
+        """
+        position = 0
+        while True:
+            events = self.wait_events(position, heartbeat)
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+                if event['stage'] in ('finished', 'failed'):
+                    return
+            position += len(events)
+
+    def to_dict(self):
+        with self.condition:
+            latest = self.events[-1]
+        return {'id': self.id, 'status': self.status, 'progress': latest, 'error': self.error}
+
+class SharedJob(Job):
+    """Read-only view of a job saved in the registry, possibly by another worker.
+
+    Progress is followed by polling the registry. A job that has not
+    reported progress for JOBS['RESULT_TTL'] seconds is taken to have died
+    with its worker and reported as failed.
+    """
+
+    def __init__(self, row, registry):
+        super().__init__(row['key'])
+        self.id = row['id']
+        self.source = registry
+        self._update(row)
+
+    def _update(self, row):
+        with self.condition:
+            self.status = row['status']
+            self.events = json.loads(row['events'])
+            self.result = json.loads(row['result']) if row['result'] else None
+            self.error = row['error']
+            self.created = row['created']
+            self.finished_at = row['finished_at']
+            if not self.done and time.time() - row['updated'] > BacktestConfig.JOBS['RESULT_TTL']:
+                self.status = 'failed'
+                self.error = "The worker running this job stopped"
+                self.events.append({'stage': 'failed', 'done': 0, 'total': 0, 'error': self.error})
+
+    def publish(self, stage, done=0, total=0, **extra):
+        raise RuntimeError("Shared jobs are read-only")
+
+    def wait_events(self, start, timeout=None, poll=0.5):
+        """Poll the registry until there are events past index start (or the timeout passes)"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self.condition:
+                if len(self.events) > start or self.done:
+                    return self.events[start:]
+            if deadline is not None and time.time() >= deadline:
+                return []
+            time.sleep(poll)
+            with self.source.lock:
+                row = self.source.conn.execute('SELECT * FROM jobs WHERE id = ?', (self.id,)).fetchone()
+            if row is None:
+                return []
+            self._update(row)
+
+    def wait(self, timeout=None):
+        self.wait_events(len(self.events), timeout)
+        return self.done
+
+class JobRunner:
+    """Bounded worker pool that deduplicates identical in-flight jobs.
+
+    submit() returns immediately with a Job; jobs with the same key share
+    one computation while it is queued or running. Completed jobs are kept
+    for result_ttl seconds so their results can still be fetched. With a
+    registry, every job is also saved there and get() and latest() find
+    jobs run by other worker processes.
+    """
+
+    def __init__(self, max_workers=None, result_ttl=None, registry=None):
+        settings = BacktestConfig.JOBS
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or settings['MAX_WORKERS'],
+                                           thread_name_prefix='backtest-job')
+        self.result_ttl = result_ttl or settings['RESULT_TTL']
+        self.registry = registry
+        self.jobs = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, function):
+        """Queue function(progress) unless an identical job is already in flight"""
+        with self.lock:
+            self.prune()
+            job_id = self.in_flight.get(key)
+            if job_id is not None:
+                return self.jobs[job_id]
+            job = Job(key, self.registry)
+            self.jobs[job.id] = job
+            self.in_flight[key] = job.id
+        if self.registry is not None:
+            self.registry.save(job)
+        self.executor.submit(self._run, job, function)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None and self.registry is not None:
+            job = self.registry.load(job_id)
+        return job
+
+    def latest(self, key):
+        """The most recently submitted job with this key that is still kept, or None"""
+        with self.lock:
+            self.prune()
+            matches = [job for job in self.jobs.values() if job.key == key]
+        job = matches[-1] if matches else None
+        if self.registry is not None:
+            shared = self.registry.latest(key)
+            if shared is not None and (job is None or shared.created > job.created):
+                job = shared
+        return job
+
+    def _run(self, job, function):
+        job.status = 'running'
+        try:
+            job.result = function(job.progress)
+            job.status = 'finished'
+        except Exception as e:
+            print(f"Job {job.id[:8]} failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self.lock:
+                self.in_flight.pop(job.key, None)
+            if job.status == 'finished':
+                job.publish('finished')
+            else:
+                job.publish('failed', error=job.error)
+
+    def prune(self):
+        """Forget completed jobs older than the result TTL (caller holds the lock)"""
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+        if self.registry is not None:
+            self.registry.prune(cutoff)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
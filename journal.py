@@ -0,0 +1,307 @@
+import json
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+CASH_FLOW_KINDS = ('DEPOSIT', 'WITHDRAW')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    units REAL NOT NULL,
+    price REAL NOT NULL,
+    realized_pnl REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_symbol_time ON transactions (symbol, timestamp);
+CREATE INDEX IF NOT EXISTS idx_transactions_time ON transactions (timestamp);
+
+CREATE TABLE IF NOT EXISTS cash_flows (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    amount REAL NOT NULL,
+    value_before REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cash_flows_time ON cash_flows (timestamp);
+
+CREATE TABLE IF NOT EXISTS lots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    symbol TEXT NOT NULL,
+    acquired_at TEXT NOT NULL,
+    units REAL NOT NULL,
+    price REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lots_symbol ON lots (symbol, acquired_at);
+
+CREATE TABLE IF NOT EXISTS holdings (
+    symbol TEXT PRIMARY KEY,
+    units REAL NOT NULL,
+    price REAL NOT NULL,
+    target REAL NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+def _range_clause(start=None, end=None):
+    """SQL condition and parameters for an ISO date range.
+
+    A bare-date end covers the whole day, so it is bounded by the start of
+    the next day rather than compared as text against full timestamps.
+    """
+    if end and len(end) == 10:
+        next_day = (date.fromisoformat(end) + timedelta(days=1)).isoformat()
+        return 'timestamp >= ? AND timestamp < ?', [start or '', next_day]
+    return 'timestamp >= ? AND timestamp <= ?', [start or '', end or '9999']
+
+class PortfolioJournal:
+    """Append-only SQLite journal of trades and cash flows with a holdings snapshot.
+
+    Every write updates the journal, the FIFO lot table and the materialized
+    holdings snapshot in one SQLite transaction, so a crash never leaves
+    them out of step. Loading the portfolio reads only the snapshot.
+    """
+
+    def __init__(self, path='portfolio.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def is_empty(self):
+        """Check whether the snapshot has any holdings yet"""
+        return self.conn.execute('SELECT COUNT(*) FROM holdings').fetchone()[0] == 0
+
+    def load_snapshot(self):
+        """Load current holdings in the rebalancer portfolio format"""
+        rows = self.conn.execute('SELECT symbol, units, price, target FROM holdings')
+        return {
+            row['symbol']: {'target': row['target'], 'units': row['units'], 'price': row['price']}
+            for row in rows
+        }
+
+    def _upsert_holding(self, symbol, units, price, target, timestamp):
+        self.conn.execute(
+            """INSERT INTO holdings (symbol, units, price, target, updated_at)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(symbol) DO UPDATE SET
+                   units = excluded.units, price = excluded.price,
+                   target = excluded.target, updated_at = excluded.updated_at""",
+            (symbol, units, price, target, timestamp)
+        )
+
+    def _apply_trade(self, symbol, units, price, timestamp, kind):
+        """Journal a trade and consume or open FIFO lots (caller holds the transaction)"""
+        realized_pnl = 0.0
+        if units > 0:
+            self.conn.execute(
+                'INSERT INTO lots (symbol, acquired_at, units, price) VALUES (?, ?, ?, ?)',
+                (symbol, timestamp, units, price)
+            )
+        else:
+            remaining = -units
+            lots = self.conn.execute(
+                'SELECT id, units, price FROM lots WHERE symbol = ? ORDER BY acquired_at, id',
+                (symbol,)
+            ).fetchall()
+            for lot in lots:
+                if remaining <= 1e-12:
+                    break
+                used = min(lot['units'], remaining)
+                realized_pnl += used * (price - lot['price'])
+                remaining -= used
+                if lot['units'] - used <= 1e-12:
+                    self.conn.execute('DELETE FROM lots WHERE id = ?', (lot['id'],))
+                else:
+                    self.conn.execute('UPDATE lots SET units = ? WHERE id = ?',
+                                      (lot['units'] - used, lot['id']))
+
+        self.conn.execute(
+            """INSERT INTO transactions (timestamp, symbol, kind, units, price, realized_pnl)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (timestamp, symbol, kind or ('BUY' if units > 0 else 'SELL'), units, price, realized_pnl)
+        )
+        return realized_pnl
+
+    def _record_trade(self, symbol, units, price, target, timestamp, kind):
+        """Journal a trade and update its snapshot row (caller holds the transaction)"""
+        row = self.conn.execute('SELECT units, target FROM holdings WHERE symbol = ?',
+                                (symbol,)).fetchone()
+        held = row['units'] if row else 0.0
+        if target is None:
+            target = row['target'] if row else 0.0
+        realized_pnl = self._apply_trade(symbol, units, price, timestamp, kind)
+        self._upsert_holding(symbol, held + units, price, target, timestamp)
+        return realized_pnl
+
+    def _record_cash_flow(self, kind, amount, value_before, timestamp):
+        if kind not in CASH_FLOW_KINDS:
+            raise ValueError(f"Unknown cash flow kind: {kind}")
+        self.conn.execute(
+            'INSERT INTO cash_flows (timestamp, kind, amount, value_before) VALUES (?, ?, ?, ?)',
+            (timestamp, kind, amount, value_before)
+        )
+
+    def _sync_portfolio(self, portfolio, timestamp):
+        snapshot = self.load_snapshot()
+        for symbol, data in portfolio.items():
+            held = snapshot.get(symbol, {}).get('units', 0.0)
+            delta = data['units'] - held
+            if symbol not in CASH_FLOW_KINDS and abs(delta) > 1e-12:
+                self._apply_trade(symbol, delta, data['price'], timestamp, None)
+            self._upsert_holding(symbol, data['units'], data['price'], data['target'], timestamp)
+
+    def record_trade(self, symbol, units, price, target=None, timestamp=None, kind=None):
+        """Record a signed trade in units and update the holdings snapshot"""
+        with self.conn:
+            return self._record_trade(symbol, units, price, target, timestamp or _now(), kind)
+
+    def record_cash_flow(self, kind, amount, value_before, timestamp=None):
+        """Record a deposit or withdrawal with the portfolio value just before it"""
+        with self.conn:
+            self._record_cash_flow(kind, amount, value_before, timestamp or _now())
+
+    def sync_portfolio(self, portfolio, timestamp=None):
+        """Journal unit changes in a rebalancer portfolio dict and refresh the snapshot.
+
+        Unit differences from the snapshot are recorded as trades at the
+        current price. DEPOSIT/WITHDRAW rows are pending amounts and are only
+        stored in the snapshot.
+        """
+        with self.conn:
+            self._sync_portfolio(portfolio, timestamp or _now())
+
+    def record_orders(self, cash_flows, trades, portfolio, timestamp=None):
+        """Journal executed orders, their cash flows and the new snapshot in one transaction.
+
+        cash_flows are (kind, amount, value_before) and trades are
+        (symbol, units, price, target) tuples; portfolio is the rebalancer
+        portfolio after the orders. Nothing is written if any step fails.
+        """
+        timestamp = timestamp or _now()
+        with self.conn:
+            for kind, amount, value_before in cash_flows:
+                self._record_cash_flow(kind, amount, value_before, timestamp)
+            for symbol, units, price, target in trades:
+                self._record_trade(symbol, units, price, target, timestamp, None)
+            self._sync_portfolio(portfolio, timestamp)
+
+    def import_json(self, path):
+        """Seed an empty journal from a legacy portfolio_data.json file"""
+        with open(path, 'r') as f:
+            portfolio = json.load(f)
+        timestamp = _now()
+        with self.conn:
+            for symbol, data in portfolio.items():
+                if symbol not in CASH_FLOW_KINDS and data['units'] > 0:
+                    self._apply_trade(symbol, data['units'], data['price'], timestamp, 'OPENING')
+                self._upsert_holding(symbol, data['units'], data['price'], data['target'], timestamp)
+        return portfolio
+
+    def transactions(self, symbol=None, start=None, end=None):
+        """Query journal entries, optionally for one symbol and an ISO date range"""
+        condition, params = _range_clause(start, end)
+        query = 'SELECT * FROM transactions WHERE ' + condition
+        if symbol is not None:
+            query += ' AND symbol = ?'
+            params.append(symbol)
+        return [dict(row) for row in self.conn.execute(query + ' ORDER BY timestamp, id', params)]
+
+    def cost_basis(self, symbol=None):
+        """Calculate open units, total cost and average cost from FIFO lots"""
+        query = """SELECT symbol, SUM(units) AS units, SUM(units * price) AS cost
+                   FROM lots {} GROUP BY symbol"""
+        if symbol is None:
+            rows = self.conn.execute(query.format(''))
+        else:
+            rows = self.conn.execute(query.format('WHERE symbol = ?'), (symbol,))
+        return {
+            row['symbol']: {
+                'units': row['units'],
+                'cost': row['cost'],
+                'average_cost': row['cost'] / row['units'] if row['units'] else 0.0
+            }
+            for row in rows
+        }
+
+    def realized_pnl(self, symbol=None, start=None, end=None):
+        """Sum realized gains from sells in an ISO date range"""
+        return sum(t['realized_pnl'] for t in self.transactions(symbol, start, end))
+
+    def _holdings_value(self, timestamp):
+        """Value of the positions held at a timestamp, at each symbol's last traded price"""
+        rows = self.conn.execute(
+            """SELECT t.symbol, SUM(t.units) AS units,
+                      (SELECT p.price FROM transactions p
+                       WHERE p.symbol = t.symbol AND p.timestamp <= ?
+                       ORDER BY p.timestamp DESC, p.id DESC LIMIT 1) AS price
+               FROM transactions t WHERE t.timestamp <= ? GROUP BY t.symbol""",
+            (timestamp, timestamp)
+        )
+        return sum(row['units'] * row['price'] for row in rows)
+
+    def _opening_value(self, start, end, first_flow):
+        """Portfolio value where the return chain starts, or None if it starts at the first flow.
+
+        The chain opens at the start of the range if positions were already
+        held, else at the first transaction in it; with no transactions at
+        all it opens from the holdings snapshot.
+        """
+        if start and self._holdings_value(start) > 0:
+            opening = start
+        else:
+            condition, params = _range_clause(start, end)
+            opening = self.conn.execute(
+                'SELECT MIN(timestamp) FROM transactions WHERE ' + condition, params
+            ).fetchone()[0]
+        if opening is None:
+            if first_flow is not None:
+                return None
+            rows = self.conn.execute('SELECT symbol, units, price FROM holdings')
+            return sum(row['units'] * row['price'] for row in rows if row['symbol'] not in CASH_FLOW_KINDS)
+        # Positions bought with a flow at the same moment belong to the period after it
+        if first_flow is not None and opening >= first_flow:
+            return None
+        return self._holdings_value(opening)
+
+    def time_weighted_return(self, current_value, start=None, end=None):
+        """Calculate time-weighted return between cash flows up to the current value.
+
+        The chain starts from the value of the positions at the first
+        transaction (or the start of the range). Each cash flow stores the
+        portfolio value just before it, which closes one sub-period; the
+        next sub-period starts from that value plus the flow.
+        """
+        condition, params = _range_clause(start, end)
+        rows = self.conn.execute(
+            """SELECT timestamp, kind, amount, value_before FROM cash_flows
+               WHERE {} ORDER BY timestamp, id""".format(condition),
+            params
+        ).fetchall()
+
+        growth = 1.0
+        period_start = self._opening_value(start, end, rows[0]['timestamp'] if rows else None)
+        for row in rows:
+            flow = row['amount'] if row['kind'] == 'DEPOSIT' else -row['amount']
+            if period_start:
+                growth *= row['value_before'] / period_start
+            period_start = row['value_before'] + flow
+        if period_start:
+            growth *= current_value / period_start
+        return growth - 1
+
+def open_journal(path='portfolio.db', legacy_json='portfolio_data.json'):
+    """Open the journal, migrating a legacy JSON portfolio on first use"""
+    journal = PortfolioJournal(path)
+    if journal.is_empty() and legacy_json and os.path.exists(legacy_json):
+        journal.import_json(legacy_json)
+    return journal
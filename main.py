@@ -1,43 +1,201 @@
-import matplotlib
-# matplotlib.use('TkAgg')  # Commented out as requested
-import yfinance as yf
+import argparse
 import pandas as pd
 import numpy as np
 from datetime import datetime
-import matplotlib.pyplot as plt
-from dateutil.relativedelta import relativedelta
-import seaborn as sns
 import logging.config
+import warnings
+from statistics import NormalDist
 from config import BacktestConfig
+from drawdowns import drawdown_episodes
+from data_quality import assess_price_data, repair_price_data
+from fx import build_fx_panel, convert_to_base
+from holding_periods import holding_period_surface
+from price_cache import download_history
+from clustering import cluster_correlation
+from covariance import estimate_covariance, estimate_correlation
+from result_store import ResultStore, result_key
+from weight_schedule import align_weight_schedule, load_weight_schedule, schedule_to_dict, schedule_weights
 
-def calculate_risk_metrics(returns):
-    """Calculate advanced risk-adjusted performance metrics with proper error handling"""
-    daily_rf = 0.02/252  # Assuming 2% risk-free rate
+VAR_METRICS = [
+    'VaR (Historical)',
+    'CVaR (Historical)',
+    'VaR (Parametric)',
+    'CVaR (Parametric)',
+    'VaR (Cornish-Fisher)',
+    'CVaR (Cornish-Fisher)'
+]
+
+def _cornish_fisher_z(z, skew, kurt):
+    """Adjust a normal quantile for skew and excess kurtosis"""
+    return (z + (z ** 2 - 1) * skew / 6
+            + (z ** 3 - 3 * z) * kurt / 24
+            - (2 * z ** 3 - 5 * z) * skew ** 2 / 36)
+
+def _cornish_fisher_es(z, alpha, skew, kurt):
+    """Standardized expected shortfall of the Cornish-Fisher quantile function.
+
+    Averages the adjusted quantile over the tail below z in closed form,
+    using the truncated normal moments E[Z^k | Z < z] for k = 1..3.
+    """
+    tail = NormalDist().pdf(z) / alpha
+    m1 = -tail
+    m2 = 1 - z * tail
+    m3 = -(z ** 2 + 2) * tail
+    return (m1 + (m2 - 1) * skew / 6
+            + (m3 - 3 * m1) * kurt / 24
+            - (2 * m3 - 5 * m1) * skew ** 2 / 36)
+
+def calculate_var_metrics(returns, confidence=None):
+    """Calculate historical, parametric and Cornish-Fisher VaR/CVaR of daily returns.
+
+    Values are reported as daily return quantiles (negative numbers are losses),
+    matching the sign convention of Max Drawdown.
+    """
+    if confidence is None:
+        confidence = BacktestConfig.RISK_SETTINGS['VAR_CONFIDENCE']
+    alpha = 1 - confidence
+    
+    values = np.asarray(returns, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return {k: np.nan for k in VAR_METRICS}
+    
+    # Historical VaR uses the same 'lower' order statistic as the rolling version
+    hist_var = np.quantile(values, alpha, method='lower')
+    hist_cvar = values[values <= hist_var].mean()
+    
+    mu = values.mean()
+    sigma = values.std(ddof=1)
+    normal = NormalDist()
+    z = normal.inv_cdf(alpha)
+    param_var = mu + z * sigma
+    param_cvar = mu - sigma * normal.pdf(z) / alpha
+    
+    # Cornish-Fisher expansion adjusts the normal quantile for skew and excess kurtosis
+    if sigma > 0:
+        standardized = (values - mu) / sigma
+        skew = np.mean(standardized ** 3)
+        kurt = np.mean(standardized ** 4) - 3
+        cf_var = mu + _cornish_fisher_z(z, skew, kurt) * sigma
+        cf_cvar = mu + _cornish_fisher_es(z, alpha, skew, kurt) * sigma
+    else:
+        cf_var = cf_cvar = mu
+    
+    return {
+        'VaR (Historical)': hist_var,
+        'CVaR (Historical)': hist_cvar,
+        'VaR (Parametric)': param_var,
+        'CVaR (Parametric)': param_cvar,
+        'VaR (Cornish-Fisher)': cf_var,
+        'CVaR (Cornish-Fisher)': cf_cvar
+    }
+
+def _fenwick_update(tree, idx, cols, delta):
+    """Add delta at rank idx for every column at once (idx == 0 means no-op)"""
+    # Row 0 of the tree is a scratch row, so finished columns can keep
+    # writing there instead of being masked out on every level
+    size = tree.shape[0] - 1
+    for _ in range(size.bit_length()):
+        tree[idx, cols] += delta
+        idx = idx + (idx & -idx)
+        idx[idx > size] = 0
+
+def _fenwick_kth(tree, k, cols):
+    """Find the rank of the k-th smallest inserted value in every column"""
+    size = tree.shape[0] - 1
+    pos = np.zeros(len(cols), dtype=np.int64)
+    remaining = k.astype(np.int64)
+    step = 1 << (size.bit_length() - 1)
+    while step:
+        nxt = pos + step
+        counts = tree[np.minimum(nxt, size), cols]
+        take = (nxt <= size) & (counts < remaining)
+        pos = np.where(take, nxt, pos)
+        remaining = np.where(take, remaining - counts, remaining)
+        step >>= 1
+    return pos + 1
+
+def rolling_historical_var(returns_data, window=None, confidence=None, min_periods=None):
+    """Calculate rolling historical VaR for every column of a returns DataFrame.
+
+    Each column is ranked once, then a Fenwick tree over ranks holds the
+    current window so each step is a log-time insert, delete and order
+    statistic lookup rather than a sort. All columns advance together.
+    """
+    if window is None:
+        window = BacktestConfig.RISK_SETTINGS['ROLLING_WINDOW']
+    if confidence is None:
+        confidence = BacktestConfig.RISK_SETTINGS['VAR_CONFIDENCE']
+    if min_periods is None:
+        min_periods = window
+    alpha = 1 - confidence
+    
+    values = returns_data.to_numpy(dtype=float)
+    n, m = values.shape
+    result = np.full((n, m), np.nan)
+    if n == 0 or m == 0:
+        return pd.DataFrame(result, index=returns_data.index, columns=returns_data.columns)
+    
+    # Rank each column once; NaNs sort last and are never inserted
+    valid = ~np.isnan(values)
+    order = np.argsort(values, axis=0, kind='stable')
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    cols = np.arange(m)
+    ranks = np.empty((n, m), dtype=np.int64)
+    ranks[order, cols] = np.arange(1, n + 1)[:, None]
+    
+    tree = np.zeros((n + 1, m), dtype=np.int64)
+    counts = np.zeros(m, dtype=np.int64)
+    
+    for t in range(n):
+        _fenwick_update(tree, np.where(valid[t], ranks[t], 0), cols, 1)
+        counts += valid[t]
+        if t >= window:
+            _fenwick_update(tree, np.where(valid[t - window], ranks[t - window], 0), cols, -1)
+            counts -= valid[t - window]
+        
+        ready = counts >= max(min_periods, 1)
+        if t + 1 < window or not ready.any():
+            continue
+        k = np.floor(alpha * (counts - 1)).astype(np.int64) + 1
+        k = np.where(ready, k, 1)
+        kth = _fenwick_kth(tree, k, cols)
+        result[t, ready] = sorted_values[kth[ready] - 1, cols[ready]]
+    
+    return pd.DataFrame(result, index=returns_data.index, columns=returns_data.columns)
+
+def calculate_risk_metrics(returns, periods_per_year=252):
+    """Calculate advanced risk-adjusted performance metrics with proper error handling.
+
+    periods_per_year annualizes returns sampled more often than daily, such as
+    intraday bars.
+    """
+    daily_rf = 0.02/periods_per_year  # Assuming 2% risk-free rate
     
     try:
         total_return = (1 + returns).cumprod().iloc[-1] - 1
         
         # Handle annualization safely
         if len(returns) > 0:
-            ann_factor = 252/len(returns)
+            ann_factor = periods_per_year/len(returns)
             annual_return = (1 + total_return) ** ann_factor - 1
         else:
             annual_return = np.nan
         
         # Handle volatility and ratios safely
-        volatility = returns.std() * np.sqrt(252) if len(returns) > 0 else np.nan
+        volatility = returns.std() * np.sqrt(periods_per_year) if len(returns) > 0 else np.nan
         
         # Sharpe Ratio with error handling
         if volatility > 0 and not np.isnan(volatility):
-            sharpe = ((returns.mean() - daily_rf) * np.sqrt(252)) / volatility
+            sharpe = ((returns.mean() - daily_rf) * np.sqrt(periods_per_year)) / volatility
         else:
             sharpe = np.nan
         
         # Sortino Ratio with error handling
         downside_returns = returns[returns < 0]
-        downside_std = downside_returns.std() * np.sqrt(252)
+        downside_std = downside_returns.std() * np.sqrt(periods_per_year)
         if downside_std > 0 and not np.isnan(downside_std):
-            sortino = ((returns.mean() - daily_rf) * np.sqrt(252)) / downside_std
+            sortino = ((returns.mean() - daily_rf) * np.sqrt(periods_per_year)) / downside_std
         else:
             sortino = np.nan
         
@@ -72,6 +230,7 @@ def calculate_risk_metrics(returns):
             'Calmar Ratio': calmar,
             'Win Rate': win_rate
         }
+        metrics.update(calculate_var_metrics(returns))
         
         # Replace infinite values with nan
         metrics = {k: np.nan if np.isinf(v) else v 
@@ -89,9 +248,176 @@ def calculate_risk_metrics(returns):
             'Sortino Ratio': np.nan,
             'Max Drawdown': np.nan,
             'Calmar Ratio': np.nan,
-            'Win Rate': np.nan
+            'Win Rate': np.nan,
+            **{k: np.nan for k in VAR_METRICS}
         }
 
+def classify_market_regimes(benchmark_returns, conditions=None):
+    """Evaluate market condition classifiers once on a benchmark return series"""
+    if conditions is None:
+        conditions = BacktestConfig.MARKET_CONDITIONS
+    
+    masks = pd.DataFrame(index=benchmark_returns.index)
+    for regime, condition in conditions.items():
+        masks[regime] = pd.Series(condition(benchmark_returns),
+                                  index=benchmark_returns.index).fillna(False).astype(bool)
+    return masks
+
+def calculate_regime_metrics(returns_data, regime_masks, confidence=None):
+    """Calculate every calculate_risk_metrics figure per regime for all columns at once.
+
+    Returns are broadcast against the regime masks into a (days, regimes, series)
+    array with out-of-regime days set to NaN, and each metric is a single
+    nan-aware reduction over the time axis.
+    """
+    if confidence is None:
+        confidence = BacktestConfig.RISK_SETTINGS['VAR_CONFIDENCE']
+    ann = BacktestConfig.RISK_SETTINGS['ANNUALIZATION_FACTOR']
+    daily_rf = BacktestConfig.RISK_FREE_RATE / ann
+    alpha = 1 - confidence
+    
+    masks = regime_masks.reindex(returns_data.index).fillna(False).astype(bool)
+    values = returns_data.to_numpy(dtype=float)
+    x = np.where(masks.to_numpy()[:, :, None], values[:, None, :], np.nan)
+    
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        count = np.sum(~np.isnan(x), axis=0)
+        log_growth = np.log1p(x)
+        total_return = np.expm1(np.nansum(log_growth, axis=0))
+        annual_return = np.where(count > 0, (1 + total_return) ** (ann / count) - 1, np.nan)
+        
+        mean = np.nanmean(x, axis=0)
+        std = np.nanstd(x, axis=0, ddof=1)
+        volatility = std * np.sqrt(ann)
+        sharpe = np.where(volatility > 0, (mean - daily_rf) * np.sqrt(ann) / volatility, np.nan)
+        
+        downside = np.where(x < 0, x, np.nan)
+        downside_std = np.nanstd(downside, axis=0, ddof=1) * np.sqrt(ann)
+        sortino = np.where(downside_std > 0, (mean - daily_rf) * np.sqrt(ann) / downside_std, np.nan)
+        
+        # Growth path over regime days only; fmax skips the NaN gaps so the
+        # running peak matches a path built from the sliced returns
+        cum = np.exp(np.cumsum(np.nan_to_num(log_growth), axis=0))
+        cum[np.isnan(x)] = np.nan
+        drawdowns = cum / np.fmax.accumulate(cum, axis=0) - 1
+        max_drawdown = np.nanmin(drawdowns, axis=0)
+        calmar = np.where(max_drawdown < 0, annual_return / np.abs(max_drawdown), np.nan)
+        
+        win_rate = np.where(count > 0, np.sum(x > 0, axis=0) / count, np.nan)
+        
+        hist_var = np.nanquantile(x, alpha, axis=0, method='lower')
+        hist_cvar = np.nanmean(np.where(x <= hist_var, x, np.nan), axis=0)
+        
+        normal = NormalDist()
+        z = normal.inv_cdf(alpha)
+        param_var = mean + z * std
+        param_cvar = mean - std * normal.pdf(z) / alpha
+        
+        standardized = (x - mean) / std
+        skew = np.nanmean(standardized ** 3, axis=0)
+        kurt = np.nanmean(standardized ** 4, axis=0) - 3
+        cf_var = np.where(std > 0, mean + _cornish_fisher_z(z, skew, kurt) * std, mean)
+        cf_cvar = np.where(std > 0, mean + _cornish_fisher_es(z, alpha, skew, kurt) * std, mean)
+    
+    figures = {
+        'Total Return': np.where(count > 0, total_return, np.nan),
+        'Annual Return': annual_return,
+        'Volatility': volatility,
+        'Sharpe Ratio': sharpe,
+        'Sortino Ratio': sortino,
+        'Max Drawdown': max_drawdown,
+        'Calmar Ratio': calmar,
+        'Win Rate': win_rate,
+        'VaR (Historical)': hist_var,
+        'CVaR (Historical)': hist_cvar,
+        'VaR (Parametric)': param_var,
+        'CVaR (Parametric)': param_cvar,
+        'VaR (Cornish-Fisher)': cf_var,
+        'CVaR (Cornish-Fisher)': cf_cvar
+    }
+    
+    # Series with fewer than two regime days have no meaningful dispersion
+    regime_metrics = {}
+    for g, regime in enumerate(masks.columns):
+        for j, name in enumerate(returns_data.columns):
+            metrics = {}
+            for k, v in figures.items():
+                value = v[g, j] if count[g, j] >= 2 else np.nan
+                metrics[k] = np.nan if np.isinf(value) else value
+            metrics['Strategy Score'] = calculate_composite_score(metrics)
+            regime_metrics[(regime, name)] = metrics
+    
+    regime_df = pd.DataFrame(regime_metrics)
+    regime_df.columns.names = ['Regime', 'Strategy']
+    return regime_df.round(4)
+
+BENCHMARK_STATISTICS = ['Beta', 'Alpha', 'Tracking Error', 'Information Ratio']
+
+def calculate_benchmark_statistics(strategy_returns, benchmark_returns, window=None, min_periods=None):
+    """Beta, alpha, tracking error and information ratio of every strategy against every benchmark.
+
+    All strategy/benchmark pairs share one set of normal equations: the
+    per-day sums (count, x, y, x^2, y^2, xy) of excess returns over the
+    dates both series have are accumulated as (days, strategies,
+    benchmarks) cumulative sums. The full-sample fit reads the final row
+    and each rolling window is a difference of two rows. Returns the
+    full-sample figures (columns Benchmark, Strategy) and the rolling
+    figures (columns Statistic, Benchmark, Strategy).
+    """
+    if window is None:
+        window = BacktestConfig.RISK_SETTINGS['ROLLING_WINDOW']
+    if min_periods is None:
+        min_periods = window // 2
+    ann = BacktestConfig.RISK_SETTINGS['ANNUALIZATION_FACTOR']
+    daily_rf = BacktestConfig.RISK_FREE_RATE / ann
+    
+    y = strategy_returns.to_numpy(dtype=float) - daily_rf
+    x = benchmark_returns.reindex(strategy_returns.index).to_numpy(dtype=float) - daily_rf
+    both = ~np.isnan(y)[:, :, None] & ~np.isnan(x)[:, None, :]
+    y = np.where(both, np.nan_to_num(y)[:, :, None], 0)
+    x = np.where(both, np.nan_to_num(x)[:, None, :], 0)
+    
+    # Cumulative normal-equation sums, with a leading zero row for window differences
+    sums = np.zeros((6, len(y) + 1) + y.shape[1:])
+    for k, term in enumerate((both, x, y, x * x, y * y, x * y)):
+        np.cumsum(term, axis=0, out=sums[k, 1:])
+    
+    def statistics(n, sx, sy, sxx, syy, sxy, required):
+        with np.errstate(all='ignore'):
+            beta = (sxy - sx * sy / n) / (sxx - sx * sx / n)
+            alpha = (sy - beta * sx) / n * ann
+            active_mean = (sy - sx) / n
+            active_var = (syy - 2 * sxy + sxx - n * active_mean ** 2) / (n - 1)
+            tracking_error = np.sqrt(np.maximum(active_var, 0) * ann)
+            information_ratio = np.where(tracking_error > 0, active_mean * ann / tracking_error, np.nan)
+        enough = n >= max(required, 2)
+        return {name: np.where(enough & np.isfinite(value), value, np.nan)
+                for name, value in zip(BENCHMARK_STATISTICS,
+                                       (beta, alpha, tracking_error, information_ratio))}
+    
+    full = statistics(*sums[:, -1], BacktestConfig.RISK_SETTINGS['MIN_TRADING_DAYS'])
+    rolling = statistics(*(sums[:, 1:] - sums[:, np.maximum(np.arange(1, len(y) + 1) - window, 0)]),
+                         min_periods)
+    
+    strategies = list(strategy_returns.columns)
+    benchmarks = list(benchmark_returns.columns)
+    full_df = pd.DataFrame({
+        (benchmark, strategy): {name: full[name][i, j] for name in BENCHMARK_STATISTICS}
+        for j, benchmark in enumerate(benchmarks) for i, strategy in enumerate(strategies)
+    }, index=BENCHMARK_STATISTICS)
+    full_df.columns.names = ['Benchmark', 'Strategy']
+    
+    # Rolling figures flattened to (Statistic, Benchmark, Strategy) columns
+    rolling_values = np.stack([rolling[name] for name in BENCHMARK_STATISTICS], axis=1)
+    rolling_df = pd.DataFrame(
+        rolling_values.transpose(0, 1, 3, 2).reshape(len(y), -1),
+        index=strategy_returns.index,
+        columns=pd.MultiIndex.from_product([BENCHMARK_STATISTICS, benchmarks, strategies],
+                                           names=['Statistic', 'Benchmark', 'Strategy'])
+    )
+    return full_df.round(4), rolling_df
+
 def calculate_composite_score(metrics):
     """Calculate composite score with error handling"""
     weights = {
@@ -124,9 +450,13 @@ def calculate_composite_score(metrics):
         print(f"Error calculating composite score: {e}")
         return np.nan
 
-def calculate_risk_contribution(returns_data, weights):
-    """Calculate risk contribution of each asset"""
-    cov_matrix = returns_data.cov() * 252  # Annualized covariance
+def calculate_risk_contribution(returns_data, weights, estimator=None):
+    """Calculate risk contribution of each asset.
+
+    returns_data should keep missing returns as NaN; the covariance comes
+    from the selected estimator (BacktestConfig.COVARIANCE by default).
+    """
+    cov_matrix = estimate_covariance(returns_data, estimator).fillna(0) * 252  # Annualized covariance
     portfolio_vol = np.sqrt(np.dot(weights, np.dot(cov_matrix, weights)))
     
     # Calculate marginal risk contribution
@@ -140,17 +470,17 @@ def calculate_risk_contribution(returns_data, weights):
     
     return pd.Series(prc, index=returns_data.columns)
 
-def calculate_correlation_analysis(returns_data, benchmark_returns):
+def calculate_correlation_analysis(returns_data, benchmark_returns, estimator=None):
     """Calculate correlation analysis between assets and benchmarks"""
     # Handle empty benchmark returns
     if benchmark_returns.empty:
-        return returns_data.corr(), {}
+        return estimate_correlation(returns_data, estimator), {}
     
     # Combine asset and benchmark returns
     all_returns = pd.concat([returns_data, benchmark_returns], axis=1)
     
-    # Calculate correlation matrix
-    correlation_matrix = all_returns.corr()
+    # Calculate correlation matrix from the selected covariance estimator
+    correlation_matrix = estimate_correlation(all_returns, estimator)
     
     # Calculate rolling correlations with benchmarks (6-month window)
     rolling_correlations = {}
@@ -164,49 +494,71 @@ def calculate_correlation_analysis(returns_data, benchmark_returns):
     
     return correlation_matrix, rolling_correlations
 
-def rebalance_portfolio(portfolio_weights, price_data, rebalance_period):
-    """Simulate portfolio performance with periodic rebalancing"""
+def rebalance_portfolio(portfolio_weights, price_data, rebalance_period, weight_schedule=None):
+    """Simulate portfolio performance with periodic rebalancing.
+
+    Target weights are an aligned (dates, tickers) array: portfolio_weights
+    broadcast over every date, or weight_schedule (see weight_schedule.py)
+    forward-filled so each rebalance uses the targets in force on its date.
+    Holdings are valued with one matrix product per rebalance segment.
+    """
     try:
-        # Initial portfolio setup
-        portfolio_value = 1.0
-        portfolio_values = pd.Series(index=price_data.index)
+        tickers = list(portfolio_weights if weight_schedule is None else weight_schedule.columns)
+        prices = price_data[tickers].to_numpy(dtype=float)
+        if len(prices) == 0:
+            return pd.Series(index=price_data.index, dtype=float)
+        if weight_schedule is None:
+            targets = np.broadcast_to(np.array(list(portfolio_weights.values()), dtype=float), prices.shape)
+        else:
+            targets = align_weight_schedule(weight_schedule, price_data.index, tickers)
+        valid = ~np.isnan(prices)
+        filled = np.where(valid, prices, 0.0)
         
-        # Initialize positions based on initial prices
-        positions = {}
-        for ticker, weight in portfolio_weights.items():
-            if not np.isnan(price_data[ticker].iloc[0]):
-                positions[ticker] = portfolio_value * weight / price_data[ticker].iloc[0]
+        # Initialize positions based on initial prices (portfolio value 1.0)
+        positions = np.where(valid[0], targets[0] / np.where(valid[0], prices[0], 1.0), 0.0)
         
-        # Get rebalancing dates
+        # Rebalance on period-end dates that are trading days
         rebalance_dates = price_data.resample(rebalance_period).last().index
-        last_rebalance_date = price_data.index[0]
-        
-        # Calculate daily values
-        for date in price_data.index:
-            current_value = 0
-            for ticker, position in positions.items():
-                if not np.isnan(price_data[ticker][date]):
-                    current_value += position * price_data[ticker][date]
-            
-            portfolio_values[date] = current_value
-            
-            # Rebalance if needed
-            if date in rebalance_dates and date > last_rebalance_date:
-                for ticker, target_weight in portfolio_weights.items():
-                    if not np.isnan(price_data[ticker][date]):
-                        positions[ticker] = (current_value * target_weight / 
-                                          price_data[ticker][date])
-                last_rebalance_date = date
+        rows = np.flatnonzero(price_data.index.isin(rebalance_dates) &
+                              (price_data.index > price_data.index[0]))
+        
+        values = np.empty(len(prices))
+        start = 0
+        for row in rows:
+            values[start:row + 1] = filled[start:row + 1] @ positions
+            traded = valid[row]
+            positions[traded] = values[row] * targets[row, traded] / prices[row, traded]
+            start = row + 1
+        values[start:] = filled[start:] @ positions
         
-        return portfolio_values
+        return pd.Series(values, index=price_data.index)
         
     except Exception as e:
         print(f"Error in rebalancing calculation: {e}")
         return pd.Series(index=price_data.index)
 
+# Keys of the calculate_metrics result
+RESULT_KEYS = (
+    'metrics', 'correlation', 'correlation_clusters', 'risk_contribution',
+    'returns_data', 'strategy_returns', 'price_data', 'rolling_var', 'regime_metrics',
+    'benchmark_metrics', 'rolling_benchmark_metrics', 'drawdown_episodes', 'underwater',
+    'holding_periods', 'start_dates'
+)
+
+# Bump when the calculation behind an existing figure changes
+METRICS_REVISION = 8
+
+# The result store's cache version is derived from this, so adding a result
+# key, a VaR measure or a benchmark statistic invalidates stored results
+RESULT_SCHEMA = (METRICS_REVISION, RESULT_KEYS, tuple(VAR_METRICS), tuple(BENCHMARK_STATISTICS))
+
 def calculate_metrics(price_data, benchmark_data, portfolio_weights, 
-                     asset_markets, asset_start_dates, use_mutual_dates=False):
-    """Calculate metrics with improved error handling"""
+                     asset_markets, asset_start_dates, use_mutual_dates=False, weight_schedule=None):
+    """Calculate metrics with improved error handling.
+
+    weight_schedule, if given, replaces the static portfolio_weights as the
+    rebalancing targets; portfolio_weights are then the current weights.
+    """
     timeframe_type = "Mutual" if use_mutual_dates else "Maximum"
     print(f"\n{timeframe_type} Date Range Analysis")
     print("=" * 50)
@@ -231,24 +583,26 @@ def calculate_metrics(price_data, benchmark_data, portfolio_weights,
             print(f"Total Return: {returns:.2%}")
             print(f"Annualized Return: {(((1 + returns) ** (1/duration)) - 1):.2%}")
     
-    # Calculate returns with proper handling of missing values
-    returns_data = price_data.pct_change(fill_method=None)
-    returns_data = returns_data.replace([np.inf, -np.inf], np.nan)
-    returns_data = returns_data.fillna(0)
+    # Calculate returns with proper handling of missing values; covariance
+    # estimators use the returns before missing days are zero-filled
+    raw_returns = price_data.pct_change(fill_method=None)
+    raw_returns = raw_returns.replace([np.inf, -np.inf], np.nan)
+    returns_data = raw_returns.fillna(0)
     
     if not benchmark_data.empty:
-        benchmark_returns = benchmark_data.pct_change(fill_method=None)
-        benchmark_returns = benchmark_returns.replace([np.inf, -np.inf], np.nan)
-        benchmark_returns = benchmark_returns.fillna(0)
+        raw_benchmark_returns = benchmark_data.pct_change(fill_method=None)
+        raw_benchmark_returns = raw_benchmark_returns.replace([np.inf, -np.inf], np.nan)
+        benchmark_returns = raw_benchmark_returns.fillna(0)
     else:
-        benchmark_returns = pd.DataFrame()
+        raw_benchmark_returns = benchmark_returns = pd.DataFrame()
     
     # Recalculate rebalancing returns with fixed function
     rebalancing_metrics = {}
+    strategy_returns = {}
     period_names = {'ME': 'Monthly', 'QE': 'Quarterly', 'YE': 'Yearly'}
     
     for period, period_name in period_names.items():
-        portfolio_values = rebalance_portfolio(portfolio_weights, price_data, period)
+        portfolio_values = rebalance_portfolio(portfolio_weights, price_data, period, weight_schedule)
         portfolio_returns = portfolio_values.pct_change(fill_method=None)
         portfolio_returns = portfolio_returns.replace([np.inf, -np.inf], np.nan)
         portfolio_returns = portfolio_returns.fillna(0)
@@ -256,6 +610,7 @@ def calculate_metrics(price_data, benchmark_data, portfolio_weights,
         metrics = calculate_risk_metrics(portfolio_returns)
         metrics['Strategy Score'] = calculate_composite_score(metrics)
         rebalancing_metrics[f'Portfolio ({period_name} Rebalancing)'] = metrics
+        strategy_returns[f'Portfolio ({period_name} Rebalancing)'] = portfolio_returns
     
     # Add benchmark metrics
     if not benchmark_returns.empty:
@@ -263,19 +618,109 @@ def calculate_metrics(price_data, benchmark_data, portfolio_weights,
             metrics = calculate_risk_metrics(returns)
             metrics['Strategy Score'] = calculate_composite_score(metrics)
             rebalancing_metrics[f'Benchmark ({name})'] = metrics
+            strategy_returns[f'Benchmark ({name})'] = returns
+    
+    # Rolling historical VaR for every strategy and benchmark
+    strategy_returns = pd.DataFrame(strategy_returns)
+    rolling_var = rolling_historical_var(strategy_returns)
+    
+    # Regime breakdown, classified once on the regime benchmark
+    if not benchmark_returns.empty:
+        regime_benchmark = BacktestConfig.REGIME_BENCHMARK
+        if regime_benchmark not in benchmark_returns.columns:
+            regime_benchmark = converted_benchmark_name(regime_benchmark, BacktestConfig.BASE_CURRENCY)
+        if regime_benchmark not in benchmark_returns.columns:
+            regime_benchmark = benchmark_returns.columns[0]
+        regime_masks = classify_market_regimes(benchmark_returns[regime_benchmark])
+        regime_metrics = calculate_regime_metrics(strategy_returns, regime_masks)
+    else:
+        regime_metrics = pd.DataFrame()
+    
+    # Strategy-vs-benchmark regressions, full sample and rolling
+    if not benchmark_returns.empty:
+        benchmark_metrics, rolling_benchmark_metrics = calculate_benchmark_statistics(
+            strategy_returns, benchmark_returns
+        )
+    else:
+        benchmark_metrics = rolling_benchmark_metrics = pd.DataFrame()
+    
+    # Top drawdown episodes and time under water for every series at once
+    episodes, underwater = drawdown_episodes(strategy_returns)
     
     # Create metrics DataFrame
     metrics_df = pd.DataFrame(rebalancing_metrics).round(4)
     metrics_df = metrics_df.reindex()  # Ensure consistent order
     
+    correlation = calculate_correlation_analysis(raw_returns, raw_benchmark_returns)[0]
+    
     return {
         'metrics': metrics_df,
-        'correlation': calculate_correlation_analysis(returns_data, benchmark_returns)[0],
-        'risk_contribution': calculate_risk_contribution(returns_data, list(portfolio_weights.values())),
+        'correlation': correlation,
+        'correlation_clusters': cluster_correlation(correlation),
+        'risk_contribution': calculate_risk_contribution(
+            raw_returns, [portfolio_weights.get(ticker, 0) for ticker in raw_returns.columns]
+        ),
         'returns_data': returns_data,
+        'strategy_returns': strategy_returns,
+        'price_data': price_data,
+        'rolling_var': rolling_var,
+        'regime_metrics': regime_metrics,
+        'benchmark_metrics': benchmark_metrics,
+        'rolling_benchmark_metrics': rolling_benchmark_metrics,
+        'drawdown_episodes': episodes,
+        'underwater': underwater,
+        'holding_periods': holding_period_surface(strategy_returns),
         'start_dates': asset_start_dates
     }
 
+_result_store = None
+
+def get_result_store():
+    """Get the shared result store, opening it on first use"""
+    global _result_store
+    if _result_store is None:
+        _result_store = ResultStore()
+    return _result_store
+
+def calculate_metrics_cached(price_data, benchmark_data, portfolio_weights,
+                             asset_markets, asset_start_dates, use_mutual_dates=False, store=None,
+                             weight_schedule=None):
+    """calculate_metrics memoized in the result store by a hash of its inputs"""
+    store = store or get_result_store()
+    start_dates = {ticker: str(date) for ticker, date in asset_start_dates.items()}
+    extra = {'start_dates': start_dates}
+    if weight_schedule is not None:
+        extra['weight_schedule'] = schedule_to_dict(weight_schedule)
+    key = result_key(price_data, benchmark_data, portfolio_weights, RESULT_SCHEMA, extra=extra)
+    
+    result = store.get(key)
+    if result is not None:
+        if set(result) - {'cache_key'} == set(RESULT_KEYS):
+            print(f"\nUsing cached results {key[:12]}")
+            # The key hashes the panel, so the caller's (possibly memory-mapped)
+            # prices replace the unpickled private copy
+            result['price_data'] = price_data
+            return result
+        print(f"\nDiscarding cached results {key[:12]} that do not match RESULT_KEYS")
+        store.delete(key)
+    
+    result = calculate_metrics(price_data, benchmark_data, portfolio_weights,
+                               asset_markets, asset_start_dates, use_mutual_dates,
+                               weight_schedule=weight_schedule)
+    if set(result) != set(RESULT_KEYS):
+        print(f"Not caching results: calculate_metrics keys {sorted(set(result) ^ set(RESULT_KEYS))} "
+              f"differ from RESULT_KEYS")
+        return result
+    result['cache_key'] = key
+    timeframe_type = "Mutual" if use_mutual_dates else "Maximum"
+    label = (f"{timeframe_type} range {price_data.index[0]:%Y-%m-%d} to "
+             f"{price_data.index[-1]:%Y-%m-%d}, {len(portfolio_weights)} assets")
+    try:
+        store.put(key, result, label)
+    except Exception as e:
+        print(f"Failed to cache results: {e}")
+    return result
+
 def calculate_rebalancing_metrics(price_data, portfolio_weights, benchmark_returns):
     """Calculate metrics for different rebalancing periods"""
     all_metrics = {}
@@ -314,7 +759,8 @@ def calculate_rebalancing_metrics(price_data, portfolio_weights, benchmark_retur
         'Sortino Ratio',
         'Max Drawdown',
         'Calmar Ratio',
-        'Win Rate'
+        'Win Rate',
+        *VAR_METRICS
     ]
     metrics_df = metrics_df.reindex(display_order)
     
@@ -334,30 +780,28 @@ def calculate_rebalancing_metrics(price_data, portfolio_weights, benchmark_retur
     
     return display_df
 
-def validate_price_data(price_data, min_days=20):
-    """Validate price data quality"""
-    validation_results = {}
-    
-    for ticker in price_data.columns:
-        data = price_data[ticker].dropna()
-        validation_results[ticker] = {
-            'data_points': len(data),
-            'missing_values': data.isnull().sum(),
-            'zero_values': (data == 0).sum(),
-            'negative_values': (data < 0).sum(),
-            'has_sufficient_data': len(data) >= min_days
-        }
-    
-    return validation_results
+def validate_price_data(price_data, min_days=20, markets=None):
+    """Validate price data quality (see data_quality.assess_price_data)"""
+    return assess_price_data(price_data, markets, min_days).summary.to_dict(orient='index')
 
-def backtest_portfolio(portfolio_weights, use_mutual_dates=False):
-    """Backtest portfolio with maximum and mutual date ranges"""
-    benchmarks = {
-        'VOO': 'S&P500 (USD)',
-        'IVV.AX': 'S&P500 (AUD)',
-        'IWLD.AX': 'World Index (AUD)'
-    }
-    
+BENCHMARKS = {
+    'VOO': 'S&P500 (USD)',
+    'IVV.AX': 'S&P500 (AUD)',
+    'IWLD.AX': 'World Index (AUD)'
+}
+
+def converted_benchmark_name(name, base_currency):
+    """Label for a benchmark converted into the base currency"""
+    return f"{name} in {base_currency}"
+
+def load_market_data(tickers, progress=None):
+    """Download, check and convert the aligned asset and benchmark price panels.
+
+    Returns price_data and benchmark_data in the base currency along with
+    each asset's market and first valid date, or None if no asset could be
+    downloaded. progress is called as progress('download', done, total).
+    """
+    report = progress or (lambda stage, done, total: None)
     end_date = pd.to_datetime(datetime.now().strftime('%Y-%m-%d')).tz_localize(None)
     
     # Download and process data
@@ -366,10 +810,12 @@ def backtest_portfolio(portfolio_weights, use_mutual_dates=False):
     asset_markets = {}
     
     print("Downloading asset data...")
-    for ticker in portfolio_weights.keys():
+    downloads = len(tickers) + len(BENCHMARKS)
+    for i, ticker in enumerate(tickers):
+        report('download', i, downloads)
         try:
             print(f"Downloading {ticker}...")
-            asset = yf.download(ticker, start=None, end=end_date, progress=False)
+            asset = download_history(ticker, end_date)
             
             if len(asset) < 20:
                 print(f"Warning: Insufficient data for {ticker}")
@@ -387,7 +833,8 @@ def backtest_portfolio(portfolio_weights, use_mutual_dates=False):
         except Exception as e:
             print(f"Error downloading {ticker}: {e}")
     
-    validation_results = validate_price_data(price_data)
+    quality = assess_price_data(price_data, asset_markets)
+    validation_results = quality.summary.to_dict(orient='index')
     print("\nData Quality Check:")
     for ticker, results in validation_results.items():
         print(f"\n{ticker}:")
@@ -397,51 +844,125 @@ def backtest_portfolio(portfolio_weights, use_mutual_dates=False):
         if not results['has_sufficient_data']:
             print(f"  WARNING: Insufficient data for {ticker}")
     
+    repair_policies = BacktestConfig.DATA_QUALITY['REPAIR']
+    if repair_policies:
+        repaired = quality.flagged(repair_policies).to_numpy().sum()
+        print(f"\nRepairing {repaired} flagged prices ({', '.join(repair_policies)})")
+        price_data = repair_price_data(price_data, quality, repair_policies)
+    
     # Download benchmark data
     print("\nDownloading benchmark data...")
     benchmark_data = pd.DataFrame()
-    for ticker, name in benchmarks.items():
+    for i, (ticker, name) in enumerate(BENCHMARKS.items()):
+        report('download', len(tickers) + i, downloads)
         try:
-            benchmark = yf.download(ticker, start=None, end=end_date, progress=False)
+            benchmark = download_history(ticker, end_date)
             if len(benchmark) > 0:
                 benchmark.index = benchmark.index.tz_localize(None)
                 benchmark_data[name] = benchmark['Adj Close']
         except Exception as e:
             print(f"Error downloading benchmark {name}: {e}")
     
+    report('download', downloads, downloads)
+    
     if len(price_data.columns) == 0:
         print("No valid data downloaded for any assets.")
         return None
     
-    # Calculate metrics for both timeframes
+    # Convert every series to the base currency through one aligned FX panel
+    base_currency = BacktestConfig.BASE_CURRENCY
+    if base_currency:
+        benchmark_tickers = {name: ticker for ticker, name in BENCHMARKS.items()}
+        asset_currencies = {ticker: BacktestConfig.get_currency(ticker) for ticker in price_data.columns}
+        benchmark_currencies = {name: BacktestConfig.get_currency(benchmark_tickers[name])
+                                for name in benchmark_data.columns}
+        print(f"\nConverting prices to {base_currency}...")
+        fx_panel = build_fx_panel(
+            list(asset_currencies.values()) + list(benchmark_currencies.values()),
+            base_currency,
+            price_data.index.union(benchmark_data.index),
+            end_date
+        )
+        price_data = convert_to_base(price_data, asset_currencies, fx_panel)
+        benchmark_data = convert_to_base(benchmark_data, benchmark_currencies, fx_panel)
+        # Converted benchmarks are labelled with the currency they are now in
+        benchmark_data = benchmark_data.rename(columns={
+            name: converted_benchmark_name(name, base_currency)
+            for name, currency in benchmark_currencies.items() if currency != base_currency
+        })
+    
+    return {
+        'price_data': price_data,
+        'benchmark_data': benchmark_data,
+        'asset_markets': asset_markets,
+        'asset_start_dates': asset_start_dates,
+        'end_date': end_date
+    }
+
+def backtest_portfolio(portfolio_weights, use_mutual_dates=False, use_cache=True, progress=None,
+                       market_data=None, weight_schedule=None):
+    """Backtest portfolio with maximum and mutual date ranges.
+
+    progress, if given, is called as progress(stage, done, total) as each
+    download and analysis stage completes. market_data, if given, is a
+    load_market_data result (such as an attached shared snapshot) used
+    instead of downloading. weight_schedule, if given, is a date-indexed
+    target-weight DataFrame (weight_schedule.load_weight_schedule) that
+    replaces the static weights; portfolio_weights are then taken from its
+    latest row.
+    """
+    if weight_schedule is not None:
+        portfolio_weights = schedule_weights(weight_schedule)
+    report = progress or (lambda stage, done, total: None)
+    if market_data is None:
+        market_data = load_market_data(list(portfolio_weights), report)
+        if market_data is None:
+            return None
+    else:
+        report('download', 1, 1)
+    price_data = market_data['price_data']
+    benchmark_data = market_data['benchmark_data']
+    asset_markets = market_data['asset_markets']
+    asset_start_dates = market_data['asset_start_dates']
+    
+    # Calculate metrics for both timeframes, reusing stored results for unchanged inputs
     results = {}
+    metrics_function = calculate_metrics_cached if use_cache else calculate_metrics
+    timeframes = 2 if use_mutual_dates else 1
+    report('simulating', 0, timeframes)
     
     # Maximum date range analysis
     print("\n=== Analysis using maximum date range for each asset ===")
-    results['max_range'] = calculate_metrics(
-        price_data.copy(),
-        benchmark_data.copy(),
+    # Panels are passed through uncopied: an attached snapshot stays shared
+    # read-only pages (copy-on-write copies only if something writes)
+    results['max_range'] = metrics_function(
+        price_data,
+        benchmark_data,
         portfolio_weights,
         asset_markets,
         asset_start_dates,
-        use_mutual_dates=False
+        use_mutual_dates=False,
+        weight_schedule=weight_schedule
     )
     
     # Mutual date range analysis
+    report('simulating', 1, timeframes)
     if use_mutual_dates:
         print("\n=== Analysis using mutual date range across all assets ===")
         mutual_start_date = max(asset_start_dates.values())
         mutual_price_data = price_data[mutual_start_date:]
         mutual_benchmark_data = benchmark_data[mutual_start_date:]
         
-        results['mutual_range'] = calculate_metrics(
+        results['mutual_range'] = metrics_function(
             mutual_price_data,
             mutual_benchmark_data,
             portfolio_weights,
             asset_markets,
             asset_start_dates,
-            use_mutual_dates=True
+            use_mutual_dates=True,
+            weight_schedule=weight_schedule
         )
+        report('simulating', 2, timeframes)
     
     return results
 
@@ -456,24 +977,54 @@ def setup_environment():
 
 def main():
     """Main execution function"""
+    parser = argparse.ArgumentParser(description="Backtest the configured portfolio")
+    parser.add_argument('--schedule', help="CSV of target weights by date (date column, then one column "
+                                           "per ticker) to backtest instead of the static portfolio")
+    args = parser.parse_args()
     setup_environment()
     logger = logging.getLogger(__name__)
     
     try:
-        BacktestConfig.validate_portfolio()
+        schedule_source = args.schedule or BacktestConfig.WEIGHT_SCHEDULE
+        if schedule_source:
+            weight_schedule = load_weight_schedule(schedule_source)
+            logger.info(f"Using weight schedule with {len(weight_schedule)} allocation changes")
+        else:
+            BacktestConfig.validate_portfolio()
+            weight_schedule = None
         
         logger.info("Starting dual timeframe portfolio backtest...")
         results = backtest_portfolio(
             portfolio_weights=BacktestConfig.PORTFOLIO,
-            use_mutual_dates=True
+            use_mutual_dates=True,
+            weight_schedule=weight_schedule
         )
         
         if results:
             for timeframe, result in results.items():
                 print(f"\n=== Results for {timeframe.replace('_', ' ').title()} ===")
+                if 'cache_key' in result:
+                    print(f"Result key: {result['cache_key'][:12]}")
                 print("\nPerformance Comparison:")
                 print(result['metrics'])
                 
+                if not result['regime_metrics'].empty:
+                    print("\nPerformance by Market Regime:")
+                    for regime in result['regime_metrics'].columns.get_level_values('Regime').unique():
+                        print(f"\n{regime}:")
+                        print(result['regime_metrics'][regime])
+                
+                if not result['benchmark_metrics'].empty:
+                    print("\nRelative to Benchmarks:")
+                    for benchmark in result['benchmark_metrics'].columns.get_level_values('Benchmark').unique():
+                        print(f"\n{benchmark}:")
+                        print(result['benchmark_metrics'][benchmark])
+                
+                print("\nLargest Drawdowns:")
+                print(result['drawdown_episodes'].to_string(index=False))
+                print("\nTime Under Water:")
+                print(result['underwater'])
+                
                 print("\nCorrelation Matrix:")
                 print(result['correlation'].round(3))
                 
@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+from config import BacktestConfig
+
+# Each snapshot is a generation directory of .npy panels plus a manifest;
+# CURRENT names the generation workers should attach to
+POINTER = 'CURRENT'
+PANELS = ('price_data', 'benchmark_data')
+
+def _read_pointer(path):
+    try:
+        with open(os.path.join(path, POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def publish_market_data(market_data, requested, path=None, keep=None):
+    """Write a market-data snapshot and make it current.
+
+    Each panel is stored (columns, days) in its own .npy file so it can be
+    memory-mapped and each column is contiguous. The generation directory
+    is completed before CURRENT is atomically replaced, so readers only
+    ever see whole snapshots. Returns the new generation name.
+    """
+    settings = BacktestConfig.MARKET_DATA
+    path = path or settings['DIR']
+    keep = keep or settings['KEEP_GENERATIONS']
+    generation = pd.Timestamp.now().strftime('%Y%m%d-%H%M%S-%f')
+    staging = os.path.join(path, f".{generation}")
+    os.makedirs(staging)
+
+    manifest = {
+        'generation': generation,
+        'created': pd.Timestamp.now().isoformat(),
+        'end_date': pd.Timestamp(market_data['end_date']).isoformat(),
+        'requested': list(requested),
+        'asset_markets': market_data['asset_markets'],
+        'asset_start_dates': {ticker: pd.Timestamp(date).isoformat()
+                              for ticker, date in market_data['asset_start_dates'].items()}
+    }
+    for name in PANELS:
+        frame = market_data[name]
+        np.save(os.path.join(staging, f"{name}.npy"),
+                np.ascontiguousarray(frame.to_numpy(dtype=float).T))
+        np.save(os.path.join(staging, f"{name}_dates.npy"),
+                frame.index.to_numpy(dtype='datetime64[ns]'))
+        manifest[f"{name}_columns"] = [str(column) for column in frame.columns]
+    with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(staging, os.path.join(path, generation))
+
+    pointer = os.path.join(path, f".{POINTER}.{os.getpid()}")
+    with open(pointer, 'w') as f:
+        f.write(generation)
+    os.replace(pointer, os.path.join(path, POINTER))
+
+    # Workers still mapping an old generation keep their pages after it is
+    # unlinked (POSIX); platforms that refuse just leave it for next time
+    generations = sorted(name for name in os.listdir(path)
+                         if not name.startswith('.') and name != POINTER)
+    for old in generations[:-keep]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return generation
+
+def attach_market_data(path=None, generation=None):
+    """Map a snapshot read-only and wrap it in DataFrames without copying.
+
+    Returns a dict shaped like main.load_market_data's result plus the
+    generation and the tickers it was built for, or None if nothing has
+    been published yet.
+    """
+    path = path or BacktestConfig.MARKET_DATA['DIR']
+    generation = generation or _read_pointer(path)
+    if generation is None:
+        return None
+    directory = os.path.join(path, generation)
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    market_data = {
+        'generation': generation,
+        'requested': manifest['requested'],
+        'end_date': pd.Timestamp(manifest['end_date']),
+        'asset_markets': manifest['asset_markets'],
+        'asset_start_dates': {ticker: pd.Timestamp(date)
+                              for ticker, date in manifest['asset_start_dates'].items()}
+    }
+    for name in PANELS:
+        values = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+        dates = np.load(os.path.join(directory, f"{name}_dates.npy"))
+        # The transpose is pandas' own (columns, rows) block layout, so the
+        # frame wraps the mapped pages directly
+        market_data[name] = pd.DataFrame(values.T, index=pd.DatetimeIndex(dates),
+                                         columns=manifest[f"{name}_columns"], copy=False)
+    return market_data
+
+def select_portfolio(market_data, tickers):
+    """Restrict a snapshot to the given tickers.
+
+    Tickers forming a contiguous run of snapshot columns (refresh publishes
+    the configured portfolio first) are sliced by position, which stays a
+    view of the mapped pages; any other selection is a copy.
+    """
+    frame = market_data['price_data']
+    columns = [ticker for ticker in tickers if ticker in frame.columns]
+    selected = dict(market_data)
+    positions = [frame.columns.get_loc(ticker) for ticker in columns]
+    if positions and positions == list(range(positions[0], positions[0] + len(positions))):
+        selected['price_data'] = frame.iloc[:, positions[0]:positions[0] + len(positions)]
+    else:
+        selected['price_data'] = frame[columns]
+    selected['asset_markets'] = {t: market_data['asset_markets'][t] for t in columns}
+    selected['asset_start_dates'] = {t: market_data['asset_start_dates'][t] for t in columns}
+    return selected
+
+class SharedMarketData:
+    """A process's handle on the published snapshot.
+
+    Reads the CURRENT pointer on each call and re-attaches only when a new
+    generation has been published, so workers pick up refreshes without
+    restarting and never download themselves.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or BacktestConfig.MARKET_DATA['DIR']
+        self.lock = threading.Lock()
+        self.generation = None
+        self.market_data = None
+
+    def current(self):
+        generation = _read_pointer(self.path)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                try:
+                    self.market_data = attach_market_data(self.path, generation)
+                    self.generation = generation
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Could not attach market data {generation}: {e}")
+            return self.market_data
+
+    def for_portfolio(self, portfolio_weights):
+        """The current snapshot restricted to a portfolio, or None if it does not cover it"""
+        market_data = self.current()
+        if market_data is None or not set(portfolio_weights) <= set(market_data['requested']):
+            return None
+        return select_portfolio(market_data, list(portfolio_weights))
+
+def refresh(tickers, path=None):
+    """Download the panels for tickers and publish them as a new snapshot"""
+    from main import load_market_data
+
+    market_data = load_market_data(tickers)
+    if market_data is None:
+        print("No market data downloaded; keeping the current snapshot")
+        return None
+    generation = publish_market_data(market_data, tickers, path)
+    print(f"Published market data {generation}")
+    return generation
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the shared market-data snapshot used by web workers")
+    parser.add_argument('--dir', help="Snapshot directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('refresh', help="Download and publish a new snapshot")
+    run.add_argument('--once', action='store_true', help="Publish once and exit")
+    run.add_argument('--interval', type=float, help="Seconds between refreshes")
+    run.add_argument('--tickers', nargs='*', default=[], help="Tickers to include besides the configured portfolio")
+    subparsers.add_parser('status', help="Show the current snapshot")
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        market_data = attach_market_data(args.dir)
+        if market_data is None:
+            print("No market data published")
+            return
+        price_data = market_data['price_data']
+        print(f"Generation: {market_data['generation']}")
+        print(f"Tickers: {', '.join(price_data.columns)}")
+        print(f"Dates: {price_data.index[0]:%Y-%m-%d} to {price_data.index[-1]:%Y-%m-%d}")
+        return
+
+    tickers = list(dict.fromkeys(list(BacktestConfig.PORTFOLIO) + args.tickers))
+    interval = args.interval or BacktestConfig.MARKET_DATA['REFRESH_INTERVAL']
+    while True:
+        try:
+            refresh(tickers, args.dir)
+        except Exception as e:
+            print(f"Error refreshing market data: {e}")
+        if args.once:
+            break
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import glob
+import os
+import pandas as pd
+
+CACHE_DIR = 'price_cache'
+
+def _cache_path(ticker, end_date):
+    safe_ticker = ticker.replace('=', '_').replace('^', '_').replace('/', '_')
+    return os.path.join(CACHE_DIR, f"{safe_ticker}_{pd.Timestamp(end_date):%Y-%m-%d}.pkl")
+
+def download_history(ticker, end_date):
+    """Download a ticker's daily history, reusing today's cached copy if present.
+
+    Each ticker keeps one pickle per end date; older copies are removed
+    when a newer one is written.
+    """
+    path = _cache_path(ticker, end_date)
+    if os.path.exists(path):
+        try:
+            return pd.read_pickle(path)
+        except Exception as e:
+            print(f"Ignoring unreadable cache for {ticker}: {e}")
+
+    # yfinance is slow to import, so only load it on a cache miss
+    import yfinance as yf
+
+    history = yf.download(ticker, start=None, end=end_date, progress=False)
+    if len(history) > 0:
+        history.index = history.index.tz_localize(None)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        prefix = os.path.basename(path).rsplit('_', 1)[0]
+        for old_path in glob.glob(os.path.join(CACHE_DIR, f"{glob.escape(prefix)}_*.pkl")):
+            os.remove(old_path)
+        history.to_pickle(path)
+    return history
+
+def adjusted_close(history):
+    """Extract the adjusted close as a Series from a downloaded history"""
+    close = history['Adj Close'] if 'Adj Close' in history else history['Close']
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+    return close
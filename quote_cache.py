@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, time as dtime, timedelta
+from zoneinfo import ZoneInfo
+
+# Trading sessions per market: (timezone, open, close), Monday to Friday.
+# Exchange holidays are not modelled; a holiday just costs one extra fetch per TTL.
+MARKET_SESSIONS = {
+    'ASX': ('Australia/Sydney', dtime(10, 0), dtime(16, 0)),
+    'US': ('America/New_York', dtime(9, 30), dtime(16, 0))
+}
+
+# Seconds a quote stays fresh while its market is trading
+OPEN_MARKET_TTL = 60
+CRYPTO_TTL = 30
+
+def next_session_open(market, now):
+    """Return the next session open for a market as a UTC timestamp"""
+    tz_name, open_time, _ = MARKET_SESSIONS[market]
+    local = datetime.fromtimestamp(now, ZoneInfo(tz_name))
+    candidate = local.replace(hour=open_time.hour, minute=open_time.minute,
+                              second=0, microsecond=0)
+    if candidate <= local:
+        candidate += timedelta(days=1)
+    while candidate.weekday() >= 5:
+        candidate += timedelta(days=1)
+    return candidate.timestamp()
+
+def is_market_open(market, now):
+    """Check whether a market's regular session is trading at a UTC timestamp"""
+    if market not in MARKET_SESSIONS:
+        return True  # Crypto and unknown markets trade continuously
+    tz_name, open_time, close_time = MARKET_SESSIONS[market]
+    local = datetime.fromtimestamp(now, ZoneInfo(tz_name))
+    return local.weekday() < 5 and open_time <= local.time() < close_time
+
+def quote_expiry(market, fetched_at):
+    """Calculate when a quote fetched at a given time goes stale.
+
+    Quotes fetched while a market is closed stay fresh until the next open,
+    since the price cannot move before then.
+    """
+    if market not in MARKET_SESSIONS:
+        return fetched_at + CRYPTO_TTL
+    if is_market_open(market, fetched_at):
+        return fetched_at + OPEN_MARKET_TTL
+    return next_session_open(market, fetched_at)
+
+class QuoteCache:
+    """Thread-safe per-symbol price cache with TTLs, request coalescing and persistence.
+
+    Reads never block on the network: a stale quote is returned as-is and
+    the background scheduler re-fetches it (stale-while-revalidate).
+    """
+
+    def __init__(self, market_for, path='quote_cache.json'):
+        self.market_for = market_for
+        self.path = path
+        self.entries = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.scheduler = None
+        self.load()
+
+    def load(self):
+        """Load last-known quotes from disk"""
+        try:
+            if self.path and os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+        except Exception as e:
+            print(f"Failed to load quote cache: {e}")
+            self.entries = {}
+
+    def save(self):
+        """Persist quotes atomically so a crash never leaves a partial file"""
+        if not self.path:
+            return
+        try:
+            with self.lock:
+                data = json.dumps(self.entries)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Failed to save quote cache: {e}")
+
+    def get(self, symbol):
+        """Return the cached price for a symbol, or None if never fetched"""
+        with self.lock:
+            entry = self.entries.get(symbol)
+        return entry['price'] if entry else None
+
+    def prices(self, symbols):
+        """Return cached prices for the symbols that have one"""
+        with self.lock:
+            return {s: self.entries[s]['price'] for s in symbols if s in self.entries}
+
+    def is_stale(self, symbol, now=None):
+        """Check whether a symbol's quote is missing or past its expiry"""
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.entries.get(symbol)
+        return entry is None or now >= entry['expires_at']
+
+    def stale_symbols(self, symbols, now=None):
+        """Return the symbols whose quotes need re-fetching"""
+        now = time.time() if now is None else now
+        return [s for s in symbols if self.is_stale(s, now)]
+
+    def update(self, prices, fetched_at=None):
+        """Store freshly fetched prices"""
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self.lock:
+            for symbol, price in prices.items():
+                market = self.market_for(symbol)
+                self.entries[symbol] = {
+                    'price': float(price),
+                    'fetched_at': fetched_at,
+                    'expires_at': quote_expiry(market, fetched_at)
+                }
+
+    def refresh(self, symbols, fetcher, batch_size=20, wait=True):
+        """Fetch the given symbols in batches, coalescing duplicate requests.
+
+        Symbols already being fetched by another caller are not requested
+        again; with wait=True this call blocks until those fetches finish.
+        Returns the symbols whose prices were updated by this call.
+        """
+        owned = []
+        pending = []
+        with self.lock:
+            for symbol in dict.fromkeys(symbols):
+                if symbol in self.in_flight:
+                    pending.append(self.in_flight[symbol])
+                else:
+                    self.in_flight[symbol] = threading.Event()
+                    owned.append(symbol)
+
+        updated = []
+        try:
+            for start in range(0, len(owned), batch_size):
+                batch = owned[start:start + batch_size]
+                try:
+                    prices = fetcher(batch)
+                except Exception as e:
+                    print(f"Error fetching quotes for {batch}: {e}")
+                    continue
+                prices = {s: p for s, p in prices.items() if p is not None}
+                self.update(prices)
+                updated.extend(prices)
+        finally:
+            with self.lock:
+                for symbol in owned:
+                    self.in_flight.pop(symbol).set()
+
+        if updated:
+            self.save()
+        if wait:
+            for event in pending:
+                event.wait()
+        return updated
+
+    def refresh_stale(self, symbols, fetcher, batch_size=20, wait=True):
+        """Re-fetch only the symbols whose quotes have expired"""
+        return self.refresh(self.stale_symbols(symbols), fetcher, batch_size, wait)
+
+    def start_auto_refresh(self, symbols_provider, fetcher, on_update=None,
+                           interval=15, batch_size=20):
+        """Start a daemon thread that periodically re-fetches expired quotes.
+
+        symbols_provider is called each cycle so newly added holdings are
+        picked up; on_update receives the list of symbols that changed.
+        """
+        if self.scheduler and self.scheduler.is_alive():
+            return
+        self.stop_event.clear()
+
+        def run():
+            while not self.stop_event.is_set():
+                try:
+                    updated = self.refresh_stale(symbols_provider(), fetcher,
+                                                 batch_size, wait=False)
+                    if updated and on_update:
+                        on_update(updated)
+                except Exception as e:
+                    print(f"Error in quote auto-refresh: {e}")
+                self.stop_event.wait(interval)
+
+        self.scheduler = threading.Thread(target=run, daemon=True)
+        self.scheduler.start()
+
+    def stop_auto_refresh(self):
+        """Stop the auto-refresh thread"""
+        self.stop_event.set()
@@ -0,0 +1,138 @@
+from config import BacktestConfig
+
+# Quote sources
+CRYPTO_SYMBOLS = ['BTC', 'SOL']  # Priced from CoinSpot
+CRYPTO_QUOTE_CURRENCY = 'AUD'
+NASDAQ_SYMBOLS = ['DTCR']  # Fetched individually
+
+def market_for(symbol):
+    """Get the quote market for a rebalancer symbol"""
+    if symbol in CRYPTO_SYMBOLS:
+        return 'Crypto'
+    if symbol.endswith('=X'):
+        return 'FX'
+    if symbol.endswith('.AX'):
+        return 'ASX'
+    return 'US'
+
+def quote_currency(symbol):
+    """Get the currency a symbol's quote is denominated in"""
+    if symbol in CRYPTO_SYMBOLS:
+        return CRYPTO_QUOTE_CURRENCY
+    return BacktestConfig.get_currency(symbol)
+
+def fx_symbol(currency):
+    """Yahoo Finance pair quoting base currency units per unit of currency"""
+    return f"{currency}{BacktestConfig.BASE_CURRENCY}=X"
+
+def quoted_symbols(assets):
+    """Asset symbols plus the FX pairs needed to convert them to the base currency"""
+    assets = list(assets)
+    if not BacktestConfig.BASE_CURRENCY:
+        return assets
+    fx_pairs = {fx_symbol(quote_currency(s)) for s in assets
+                if quote_currency(s) != BacktestConfig.BASE_CURRENCY}
+    return assets + sorted(fx_pairs)
+
+def to_base_prices(quotes, assets):
+    """Convert quotes for the assets to the base currency.
+
+    Assets without a quote, or whose FX rate is not yet known, are left out.
+    With no base currency every quote is kept as quoted.
+    """
+    prices = {}
+    for symbol in assets:
+        if symbol not in quotes:
+            continue
+        currency = quote_currency(symbol)
+        if not BacktestConfig.BASE_CURRENCY or currency == BacktestConfig.BASE_CURRENCY:
+            rate = 1.0
+        else:
+            rate = quotes.get(fx_symbol(currency))
+        if rate:
+            prices[symbol] = quotes[symbol] * rate
+    return prices
+
+def fetch_individual_ticker(symbol, on_error=None):
+    """Fetch price for a single ticker"""
+    import yfinance as yf
+
+    try:
+        ticker = yf.Ticker(symbol)
+        info = ticker.info
+        price = info.get('regularMarketPrice')
+        if price:
+            return price
+        # Try to get price from history if info doesn't work
+        history = ticker.history(period="1d")
+        if not history.empty:
+            return history['Close'].iloc[-1]
+        print(f"No price data available for {symbol}")
+        if on_error:
+            on_error(f"No price data for {symbol}")
+    except Exception as e:
+        print(f"Error fetching individual ticker {symbol}: {e}")
+        if on_error:
+            on_error(f"Failed to fetch {symbol}")
+    return None
+
+def fetch_quotes(symbols, on_error=None):
+    """Fetch prices for a batch of symbols from yfinance and CoinSpot.
+
+    on_error, if given, is called with a short message for each symbol or
+    source that could not be priced.
+    """
+    # Network libraries load on first fetch so importers start quickly
+    import yfinance as yf
+    import requests
+    import pandas as pd
+
+    prices = {}
+    stock_symbols = [s for s in symbols if s not in CRYPTO_SYMBOLS]
+    crypto_symbols = [s for s in symbols if s in CRYPTO_SYMBOLS]
+
+    # Split symbols into groups based on exchange
+    nasdaq_symbols = [s for s in stock_symbols if s in NASDAQ_SYMBOLS]
+    other_symbols = [s for s in stock_symbols if s not in NASDAQ_SYMBOLS]
+
+    # Download non-NASDAQ symbols in batch
+    if other_symbols:
+        try:
+            stock_data = yf.download(other_symbols, period="1d", group_by='ticker')
+
+            for symbol in other_symbols:
+                try:
+                    if len(other_symbols) == 1:
+                        price = stock_data['Close'].iloc[-1]
+                    else:
+                        price = stock_data[symbol]['Close'].iloc[-1]
+                    if pd.notna(price):
+                        prices[symbol] = price
+                    else:
+                        prices[symbol] = fetch_individual_ticker(symbol, on_error)
+                except Exception as e:
+                    print(f"Error in batch download for {symbol}: {e}")
+                    prices[symbol] = fetch_individual_ticker(symbol, on_error)
+        except Exception as e:
+            print(f"Batch download failed: {e}")
+            for symbol in other_symbols:
+                prices[symbol] = fetch_individual_ticker(symbol, on_error)
+
+    # Handle NASDAQ symbols individually
+    for symbol in nasdaq_symbols:
+        prices[symbol] = fetch_individual_ticker(symbol, on_error)
+
+    # Fetch crypto prices from CoinSpot (one call covers every coin)
+    if crypto_symbols:
+        try:
+            coinspot_response = requests.get('https://www.coinspot.com.au/pubapi/v2/latest')
+            if coinspot_response.status_code == 200:
+                crypto_data = coinspot_response.json()
+                for symbol in crypto_symbols:
+                    prices[symbol] = float(crypto_data['prices'][symbol.lower()]['last'])
+        except Exception as e:
+            print(f"Error fetching crypto prices: {e}")
+            if on_error:
+                on_error("Failed to fetch crypto prices")
+
+    return prices
@@ -0,0 +1,321 @@
+import argparse
+import os
+import numpy as np
+
+# Rows that carry cash flows rather than holdings
+CASH_FLOW_SYMBOLS = ('DEPOSIT', 'WITHDRAW')
+
+def compute_rebalance(units, prices, targets, deposits=None, withdrawals=None):
+    """Calculate rebalancing trades for many accounts at once.
+
+    units, prices and targets are (accounts, assets) arrays, with targets in
+    percent as in the rebalancer GUI. deposits and withdrawals are per-account
+    cash amounts. Withdrawals larger than an account's value are capped at
+    that value and flagged in 'withdrawal_capped'.
+    """
+    units = np.atleast_2d(np.asarray(units, dtype=float))
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+    targets = np.atleast_2d(np.asarray(targets, dtype=float))
+    n_accounts = units.shape[0]
+    deposits = np.zeros(n_accounts) if deposits is None else np.asarray(deposits, dtype=float).reshape(n_accounts)
+    withdrawals = np.zeros(n_accounts) if withdrawals is None else np.asarray(withdrawals, dtype=float).reshape(n_accounts)
+
+    current_value = units * prices
+    total_value = current_value.sum(axis=1)
+
+    # Cap withdrawals at the account value
+    withdrawal_capped = (withdrawals - deposits) > total_value
+    withdrawals = np.where(withdrawal_capped, total_value, withdrawals)
+    net_change = np.where(withdrawal_capped, -total_value, deposits - withdrawals)
+    total_with_changes = total_value + net_change
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        current_percent = np.where(total_value[:, None] > 0,
+                                   current_value / total_value[:, None] * 100, 0.0)
+        target_value = total_with_changes[:, None] * targets / 100
+        units_to_trade = np.where(prices != 0, (target_value - current_value) / prices, 0.0)
+
+    return {
+        'current_value': current_value,
+        'current_percent': current_percent,
+        'target_value': target_value,
+        'units_to_trade': units_to_trade,
+        'total_value': total_value,
+        'net_change': net_change,
+        'withdrawals': withdrawals,
+        'withdrawal_capped': withdrawal_capped
+    }
+
+def _weight_deltas(errors, cash_error, total, change_a, change_b, idx_a, idx_b):
+    """Objective change for moving value out of cash into assets a and b"""
+    a = change_a / total
+    b = change_b / total
+    cash_move = a + b
+    return (2 * errors[idx_a] * a + a ** 2
+            + 2 * errors[idx_b] * b + b ** 2
+            - 2 * cash_error * cash_move + cash_move ** 2)
+
+def _lots_valid(new_lots, idx, lot_value, max_sell, min_trade_value):
+    """Check holding and minimum trade size limits for candidate lot counts"""
+    value = np.abs(new_lots) * lot_value[idx]
+    return (new_lots >= -max_sell[idx]) & ((new_lots == 0) | (value >= min_trade_value[idx] - 1e-9))
+
+def solve_whole_unit_trades(units, prices, targets, deposit=0, withdrawal=0,
+                            lot_sizes=None, min_trade_value=0, max_iterations=None):
+    """Find tradeable whole-lot trades for one account that track target weights.
+
+    Starts from the fractional rebalance rounded to lots, repairs cash
+    feasibility greedily, then runs a local search over single-asset and
+    sell-to-fund-buy pair moves that minimises the squared deviation of
+    post-trade weights (including idle cash) from target. Trades never short,
+    never spend more than the holdings, deposit and sale proceeds provide,
+    and are either zero or at least min_trade_value.
+    """
+    units = np.asarray(units, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    targets = np.asarray(targets, dtype=float) / 100
+    n = len(units)
+    lot_sizes = np.ones(n) if lot_sizes is None else np.asarray(lot_sizes, dtype=float)
+    min_trade_value = np.broadcast_to(np.asarray(min_trade_value, dtype=float), (n,))
+    if max_iterations is None:
+        max_iterations = 10 * n + 100
+
+    rebalance = compute_rebalance(units, prices, targets * 100, deposit, withdrawal)
+    total = rebalance['total_value'][0] + rebalance['net_change'][0]
+    cash_target = max(0.0, 1 - targets.sum())
+    tradeable = (prices > 0) & (lot_sizes > 0)
+    lot_value = np.where(tradeable, prices * lot_sizes, 0.0)
+    # Lots that can be sold before the holding goes negative
+    max_sell = np.where(tradeable, np.floor(units / np.where(tradeable, lot_sizes, 1) + 1e-9), 0)
+
+    # Greedy start: round the fractional trade to lots and drop undersized trades
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lots = np.where(tradeable, np.round(rebalance['units_to_trade'][0] / lot_sizes), 0)
+    lots = np.maximum(lots, -max_sell)
+    lots[~_lots_valid(lots, np.arange(n), lot_value, max_sell, min_trade_value)] = 0
+
+    def cash_after(lots):
+        return rebalance['net_change'][0] - np.dot(lots, lot_value)
+
+    if total <= 0:
+        return _whole_unit_result(lots * 0, lot_sizes, prices, units, targets, cash_after(lots * 0), total, False)
+
+    def errors_for(lots):
+        holdings = (units + lots * lot_sizes) * prices
+        return holdings / total - targets, cash_after(lots) / total - cash_target
+
+    # Repair: release cash with the cheapest decrease until the account is funded
+    cash = cash_after(lots)
+    while cash < -1e-9:
+        errors, cash_error = errors_for(lots)
+        best = None
+        for i in np.flatnonzero(tradeable):
+            floor_lots = -max_sell[i]
+            step = min(np.ceil(-cash / lot_value[i] - 1e-9), lots[i] - floor_lots)
+            if step <= 0:
+                continue
+            new = lots[i] - step
+            if new > 0 and new * lot_value[i] < min_trade_value[i]:
+                new = 0
+            elif new < 0 and -new * lot_value[i] < min_trade_value[i]:
+                new = -np.ceil(min_trade_value[i] / lot_value[i] - 1e-9)
+                if new < floor_lots:
+                    continue
+            change = (new - lots[i]) * lot_value[i]
+            delta = _weight_deltas(errors, cash_error, total, np.array([change]), np.array([0.0]),
+                                   np.array([i]), np.array([i]))[0]
+            if best is None or delta < best[0]:
+                best = (delta, i, new)
+        if best is None:
+            break
+        lots[best[1]] = best[2]
+        cash = cash_after(lots)
+
+    feasible = cash >= -1e-9
+    if not feasible:
+        return _whole_unit_result(lots, lot_sizes, prices, units, targets, cash, total, False)
+
+    # Local search over single-asset and funded pair moves
+    assets = np.flatnonzero(tradeable)
+    if len(assets):
+        buy_idx, sell_idx = np.meshgrid(assets, assets, indexing='ij')
+        buy_idx, sell_idx = buy_idx.ravel(), sell_idx.ravel()
+        pairs = buy_idx != sell_idx
+        buy_idx, sell_idx = buy_idx[pairs], sell_idx[pairs]
+
+    for _ in range(max_iterations if len(assets) else 0):
+        errors, cash_error = errors_for(lots)
+        cash = cash_after(lots)
+        candidates = []
+
+        # Single-asset moves against cash, around the continuous optimum
+        optimum = total * (cash_error - errors[assets]) / 2 / lot_value[assets]
+        for k in (np.floor(optimum), np.ceil(optimum)):
+            new = lots[assets] + k
+            candidates.append((assets, new, assets, lots[assets]))
+
+        # Pair moves: buy j, selling just enough of i to fund what cash cannot
+        if len(buy_idx):
+            transfer = total * (errors[sell_idx] - errors[buy_idx]) / 2
+            for k in (np.floor(transfer / lot_value[buy_idx]), np.ceil(transfer / lot_value[buy_idx])):
+                k = np.maximum(k, 1)
+                shortfall = np.maximum(0, k * lot_value[buy_idx] - cash)
+                sell = np.ceil(shortfall / lot_value[sell_idx] - 1e-9)
+                candidates.append((buy_idx, lots[buy_idx] + k, sell_idx, lots[sell_idx] - sell))
+
+        best = None
+        for idx_a, new_a, idx_b, new_b in candidates:
+            change_a = (new_a - lots[idx_a]) * lot_value[idx_a]
+            change_b = (new_b - lots[idx_b]) * lot_value[idx_b]
+            same = idx_a == idx_b
+            change_b = np.where(same, 0.0, change_b)
+            ok = ((cash - change_a - change_b >= -1e-9)
+                  & _lots_valid(new_a, idx_a, lot_value, max_sell, min_trade_value)
+                  & (same | _lots_valid(new_b, idx_b, lot_value, max_sell, min_trade_value))
+                  & ((change_a != 0) | (change_b != 0)))
+            if not ok.any():
+                continue
+            delta = _weight_deltas(errors, cash_error, total, change_a, change_b, idx_a, idx_b)
+            delta = np.where(ok, delta, np.inf)
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-12 and (best is None or delta[k] < best[0]):
+                best = (delta[k], idx_a[k], new_a[k], idx_b[k], new_b[k], same[k])
+        if best is None:
+            break
+        _, a, new_a, b, new_b, same = best
+        lots[a] = new_a
+        if not same:
+            lots[b] = new_b
+
+    return _whole_unit_result(lots, lot_sizes, prices, units, targets, cash_after(lots), total, True)
+
+def _whole_unit_result(lots, lot_sizes, prices, units, targets, cash, total, feasible):
+    """Package solver output; tracking error is the root sum of squared weight
+    deviations from target, in percentage points"""
+    units_to_trade = lots * lot_sizes
+    holdings = (units + units_to_trade) * prices
+    if total > 0:
+        weights = holdings / total * 100
+    else:
+        weights = np.zeros_like(holdings)
+    return {
+        'units_to_trade': units_to_trade,
+        'trade_value': units_to_trade * prices,
+        'cash_remaining': cash,
+        'post_trade_percent': weights,
+        'tracking_error': np.sqrt(np.sum((weights - targets * 100) ** 2)),
+        'feasible': feasible
+    }
+
+def arrays_from_portfolio(portfolio):
+    """Split a rebalancer portfolio dict into asset symbols, arrays and cash flows"""
+    symbols = [s for s in portfolio if s not in CASH_FLOW_SYMBOLS]
+    units = np.array([portfolio[s]['units'] for s in symbols], dtype=float)
+    prices = np.array([portfolio[s]['price'] for s in symbols], dtype=float)
+    targets = np.array([portfolio[s]['target'] for s in symbols], dtype=float)
+    deposit = portfolio.get('DEPOSIT', {}).get('units', 0)
+    withdrawal = portfolio.get('WITHDRAW', {}).get('units', 0)
+    return symbols, units, prices, targets, deposit, withdrawal
+
+def read_table(path):
+    """Read a CSV or Parquet file into a DataFrame"""
+    import pandas as pd
+
+    if os.path.splitext(path)[1].lower() in ('.parquet', '.pq'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def write_table(df, path):
+    """Write a DataFrame to CSV or Parquet based on the file extension"""
+    if os.path.splitext(path)[1].lower() in ('.parquet', '.pq'):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+def load_accounts(holdings):
+    """Pivot long-format holdings rows into per-account arrays.
+
+    Expects columns account, symbol, units, price and target. DEPOSIT and
+    WITHDRAW rows carry cash amounts in 'units', as in the GUI. Repeated
+    (account, symbol) rows are lots of one holding: their units are summed
+    and they must agree on price and target.
+    """
+    import pandas as pd
+
+    holdings = holdings.copy()
+    holdings['symbol'] = holdings['symbol'].astype(str)
+    is_flow = holdings['symbol'].isin(CASH_FLOW_SYMBOLS)
+    assets = holdings[~is_flow]
+    flows = holdings[is_flow]
+
+    accounts = pd.Index(holdings['account'].unique(), name='account')
+    symbols = pd.Index(assets['symbol'].unique(), name='symbol')
+
+    conflicts = assets.groupby(['account', 'symbol'])[['price', 'target']].nunique()
+    conflicts = conflicts[(conflicts > 1).any(axis=1)]
+    if len(conflicts) > 0:
+        pairs = ', '.join(f"{account}/{symbol}" for account, symbol in conflicts.index)
+        raise ValueError(f"Repeated holdings disagree on price or target: {pairs}")
+
+    def pivot(column, aggfunc):
+        table = assets.pivot_table(index='account', columns='symbol', values=column, aggfunc=aggfunc)
+        return table.reindex(index=accounts, columns=symbols).fillna(0).to_numpy(dtype=float)
+
+    flow_table = (flows.pivot_table(index='account', columns='symbol', values='units', aggfunc='sum')
+                  .reindex(index=accounts, columns=list(CASH_FLOW_SYMBOLS)).fillna(0))
+
+    return {
+        'accounts': accounts,
+        'symbols': symbols,
+        'units': pivot('units', 'sum'),
+        'prices': pivot('price', 'first'),
+        'targets': pivot('target', 'first'),
+        'deposits': flow_table['DEPOSIT'].to_numpy(dtype=float),
+        'withdrawals': flow_table['WITHDRAW'].to_numpy(dtype=float)
+    }
+
+def trades_to_frame(accounts, symbols, units, prices, targets, results):
+    """Flatten per-account trade arrays back into long-format rows"""
+    import pandas as pd
+
+    n_accounts, n_assets = units.shape
+    trades = pd.DataFrame({
+        'account': np.repeat(np.asarray(accounts), n_assets),
+        'symbol': np.tile(np.asarray(symbols), n_accounts),
+        'units': units.ravel(),
+        'price': prices.ravel(),
+        'current_value': results['current_value'].ravel(),
+        'current_percent': results['current_percent'].ravel(),
+        'target_percent': targets.ravel(),
+        'units_to_trade': results['units_to_trade'].ravel()
+    })
+    trades['trade_value'] = trades['units_to_trade'] * trades['price']
+    return trades
+
+def run_batch(input_path, output_path):
+    """Compute trades for every account in a holdings file and write them out"""
+    accounts = load_accounts(read_table(input_path))
+    results = compute_rebalance(accounts['units'], accounts['prices'], accounts['targets'],
+                                accounts['deposits'], accounts['withdrawals'])
+
+    capped = np.asarray(accounts['accounts'])[results['withdrawal_capped']]
+    for account in capped:
+        print(f"Warning: withdrawal for account {account} exceeds portfolio value, capped")
+
+    trades = trades_to_frame(accounts['accounts'], accounts['symbols'], accounts['units'],
+                             accounts['prices'], accounts['targets'], results)
+    # Drop symbols an account neither holds nor targets
+    trades = trades[(trades['units'] != 0) | (trades['target_percent'] != 0)]
+    write_table(trades, output_path)
+    print(f"Wrote {len(trades)} trade rows for {len(accounts['accounts'])} accounts to {output_path}")
+    return trades
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch portfolio rebalancing")
+    parser.add_argument('input', help="Holdings CSV/Parquet with account, symbol, units, price, target columns")
+    parser.add_argument('output', help="Output CSV/Parquet path for the trade list")
+    args = parser.parse_args()
+    run_batch(args.input, args.output)
+
+if __name__ == "__main__":
+    main()
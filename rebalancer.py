@@ -1,15 +1,19 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import yfinance as yf
-import requests
-import json
 from datetime import datetime
 import threading
-from decimal import Decimal
-import pandas as pd
-import os
+from journal import open_journal
+from quote_cache import QuoteCache
+import quotes
+from rebalance_engine import (compute_rebalance, solve_whole_unit_trades,
+                              arrays_from_portfolio, CASH_FLOW_SYMBOLS)
 
 class PortfolioRebalancer:
+    # Order sizing: ETFs trade in whole units, crypto in exchange increments
+    LOT_SIZES = {'BTC': 0.0001, 'SOL': 0.01}
+    DEFAULT_LOT_SIZE = 1
+    MIN_TRADE_VALUE = 50  # Broker minimum order value
+    
     def __init__(self, root):
         self.root = root
         self.root.title("Portfolio Rebalancer")
@@ -35,33 +39,77 @@ class PortfolioRebalancer:
         # Load saved data or use defaults
         self.portfolio = self.load_portfolio()
         
+        # Last-known quotes are shown immediately, then refreshed as they expire
+        self.quote_cache = QuoteCache(quotes.market_for)
+        self.apply_cached_prices()
+        
         self.create_gui()
         # Fetch prices automatically on startup
         self.root.after(1000, self.fetch_prices_threaded)
+        self.quote_cache.start_auto_refresh(
+            self.quoted_symbols,
+            self.fetch_quotes,
+            on_update=lambda symbols: self.root.after(0, self.on_prices_updated)
+        )
         
     def save_portfolio(self):
-        """Save portfolio data to JSON file"""
+        """Journal unit changes and save the holdings snapshot"""
         try:
-            with open('portfolio_data.json', 'w') as f:
-                json.dump(self.portfolio, f)
+            self.journal.sync_portfolio(self.portfolio)
             self.status_label.config(text="Portfolio saved successfully")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save portfolio: {e}")
 
     def load_portfolio(self):
-        """Load portfolio data from JSON file"""
+        """Load holdings from the journal snapshot"""
         try:
-            if os.path.exists('portfolio_data.json'):
-                with open('portfolio_data.json', 'r') as f:
-                    data = json.load(f)
+            self.journal = open_journal()
+            data = self.journal.load_snapshot()
+            if data:
                 # Ensure all expected keys exist
                 for key in self.default_portfolio:
                     if key not in data:
-                        data[key] = self.default_portfolio[key]
+                        data[key] = dict(self.default_portfolio[key])
                 return data
         except Exception as e:
             messagebox.showwarning("Warning", f"Failed to load portfolio: {e}\nUsing defaults.")
-        return self.default_portfolio.copy()
+        return {symbol: dict(data) for symbol, data in self.default_portfolio.items()}
+
+    def record_orders(self):
+        """Record the current orders and cash flows as executed"""
+        rebalancing = self.calculate_rebalancing()
+        if self.cash_after_orders is None:
+            messagebox.showerror("Error", "Orders cannot be funded with the available cash")
+            return
+        if not messagebox.askyesno("Record Trades", "Record the current orders as executed?"):
+            return
+        
+        try:
+            # Build the whole order on a copy so a failed write changes nothing
+            portfolio = {symbol: dict(data) for symbol, data in self.portfolio.items()}
+            value_before = sum(data['current_value'] for data in rebalancing
+                               if data['symbol'] not in CASH_FLOW_SYMBOLS)
+            cash_flows = []
+            for kind in CASH_FLOW_SYMBOLS:
+                amount = portfolio[kind]['units']
+                if amount > 0:
+                    cash_flows.append((kind, amount, value_before))
+                    value_before += amount if kind == 'DEPOSIT' else -amount
+                    portfolio[kind]['units'] = 0
+            
+            trades = []
+            for data in rebalancing:
+                if data['order_units'] != 0:
+                    symbol = data['symbol']
+                    trades.append((symbol, data['order_units'], data['price'], data['target_percent']))
+                    portfolio[symbol]['units'] += data['order_units']
+            
+            self.journal.record_orders(cash_flows, trades, portfolio)
+            self.portfolio = portfolio
+            self.update_table()
+            self.status_label.config(text="Trades recorded")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to record trades: {e}")
         
     def create_gui(self):
         # Top frame for buttons and status
@@ -88,6 +136,14 @@ class PortfolioRebalancer:
         )
         save_button.pack(side=tk.LEFT, padx=5)
         
+        # Record executed orders button
+        record_button = ttk.Button(
+            buttons_frame,
+            text="Record Trades",
+            command=self.record_orders
+        )
+        record_button.pack(side=tk.LEFT, padx=5)
+        
         # Status label
         self.status_label = ttk.Label(top_frame, text="")
         self.status_label.pack(side=tk.LEFT, padx=5)
@@ -100,8 +156,12 @@ class PortfolioRebalancer:
         )
         self.progress.pack(side=tk.LEFT, padx=5)
         
+        # Cash left over after whole-unit orders
+        self.cash_label = ttk.Label(top_frame, text="")
+        self.cash_label.pack(side=tk.LEFT, padx=5)
+        
         # Create table
-        columns = ('Asset', 'Units', 'Price', 'Value', 'Current %', 'Target %', 'To Trade')
+        columns = ('Asset', 'Units', 'Price', 'Value', 'Current %', 'Target %', 'To Trade', 'Order')
         self.tree = ttk.Treeview(
             self.root,
             columns=columns,
@@ -183,6 +243,26 @@ class PortfolioRebalancer:
         entry.bind('<Return>', on_enter)
         entry.bind('<FocusOut>', lambda e: entry.destroy())
 
+    def asset_symbols(self):
+        """Symbols held or targeted in the portfolio"""
+        return [symbol for symbol in self.portfolio if symbol not in CASH_FLOW_SYMBOLS]
+
+    def quoted_symbols(self):
+        """Asset symbols plus the FX pairs needed to convert them to the base currency"""
+        return quotes.quoted_symbols(self.asset_symbols())
+
+    def apply_cached_prices(self):
+        """Copy cached quotes into the portfolio, converted to the base currency"""
+        cached = self.quote_cache.prices(self.quoted_symbols())
+        # Symbols without a quote or FX rate keep their previous price
+        for symbol, price in quotes.to_base_prices(cached, self.asset_symbols()).items():
+            self.portfolio[symbol]['price'] = price
+
+    def on_prices_updated(self, symbols=None):
+        """Apply cached quotes and redraw (main thread)"""
+        self.apply_cached_prices()
+        self.update_table()
+
     def fetch_prices_threaded(self):
         """Start price fetching in a separate thread"""
         self.progress.start()
@@ -191,84 +271,22 @@ class PortfolioRebalancer:
         thread.daemon = True
         thread.start()
 
-    def fetch_individual_ticker(self, symbol):
-        """Fetch price for a single ticker"""
-        try:
-            ticker = yf.Ticker(symbol)
-            info = ticker.info
-            price = info.get('regularMarketPrice')
-            if price:
-                self.portfolio[symbol]['price'] = price
-            else:
-                # Try to get price from history if info doesn't work
-                history = ticker.history(period="1d")
-                if not history.empty:
-                    price = history['Close'].iloc[-1]
-                    self.portfolio[symbol]['price'] = price
-                else:
-                    print(f"No price data available for {symbol}")
-                    self.root.after(0, lambda s=symbol: self.status_label.config(
-                        text=f"No price data for {s}"
-                    ))
-        except Exception as e:
-            print(f"Error fetching individual ticker {symbol}: {e}")
-            self.root.after(0, lambda s=symbol: self.status_label.config(
-                text=f"Failed to fetch {s}"
-            ))
+    def fetch_quotes(self, symbols):
+        """Fetch prices for a batch of symbols, reporting failures in the status bar"""
+        return quotes.fetch_quotes(
+            symbols,
+            on_error=lambda message: self.root.after(0, lambda: self.status_label.config(text=message))
+        )
 
     def fetch_prices(self):
-        """Fetch prices from APIs"""
+        """Fetch expired prices through the quote cache"""
         try:
-            # Fetch stock prices using yfinance
-            stock_symbols = [symbol for symbol in self.portfolio.keys() 
-                           if symbol not in ['BTC', 'SOL', 'DEPOSIT', 'WITHDRAW']]
-            
-            # Split symbols into groups based on exchange
-            nasdaq_symbols = ['DTCR']  # NASDAQ symbols
-            other_symbols = [s for s in stock_symbols if s not in nasdaq_symbols]
-            
-            # Download non-NASDAQ symbols in batch
-            if other_symbols:
-                try:
-                    stock_data = yf.download(other_symbols, period="1d", group_by='ticker')
-                    
-                    for symbol in other_symbols:
-                        try:
-                            if len(other_symbols) == 1:
-                                price = stock_data['Close'].iloc[-1]
-                            else:
-                                price = stock_data[symbol]['Close'].iloc[-1]
-                            if pd.notna(price):
-                                self.portfolio[symbol]['price'] = price
-                            else:
-                                self.fetch_individual_ticker(symbol)
-                        except Exception as e:
-                            print(f"Error in batch download for {symbol}: {e}")
-                            self.fetch_individual_ticker(symbol)
-                except Exception as e:
-                    print(f"Batch download failed: {e}")
-                    for symbol in other_symbols:
-                        self.fetch_individual_ticker(symbol)
-            
-            # Handle NASDAQ symbols individually
-            for symbol in nasdaq_symbols:
-                self.fetch_individual_ticker(symbol)
-            
-            # Fetch crypto prices from CoinSpot
-            try:
-                coinspot_response = requests.get('https://www.coinspot.com.au/pubapi/v2/latest')
-                if coinspot_response.status_code == 200:
-                    crypto_data = coinspot_response.json()
-                    self.portfolio['BTC']['price'] = float(crypto_data['prices']['btc']['last'])
-                    self.portfolio['SOL']['price'] = float(crypto_data['prices']['sol']['last'])
-            except Exception as e:
-                print(f"Error fetching crypto prices: {e}")
-                self.root.after(0, lambda: self.status_label.config(
-                    text="Failed to fetch crypto prices"
-                ))
+            # Fresh quotes are kept; symbols already being fetched by the
+            # auto-refresh thread are waited on rather than requested again
+            self.quote_cache.refresh_stale(self.quoted_symbols(), self.fetch_quotes)
             
             # Update UI in main thread
-            self.root.after(0, self.update_table)
+            self.root.after(0, self.on_prices_updated)
             self.root.after(0, self.progress.stop)
             self.root.after(0, lambda: self.status_label.config(
                 text=f"Last updated: {datetime.now().strftime('%H:%M:%S')}"
@@ -281,37 +299,37 @@ class PortfolioRebalancer:
 
     def calculate_rebalancing(self):
         """Calculate rebalancing requirements"""
-        # Calculate total portfolio value excluding deposit and withdraw
-        total_value = sum(data['units'] * data['price'] 
-                         for symbol, data in self.portfolio.items() 
-                         if symbol not in ['DEPOSIT', 'WITHDRAW'])
-        
-        # Calculate net deposit/withdrawal
-        deposit = self.portfolio['DEPOSIT']['units']
-        withdrawal = self.portfolio['WITHDRAW']['units']
-        net_change = deposit - withdrawal
+        symbols, units, prices, targets, deposit, withdrawal = arrays_from_portfolio(self.portfolio)
+        rebalance = compute_rebalance(units, prices, targets, deposit, withdrawal)
         
-        if net_change < 0 and abs(net_change) > total_value:
+        if rebalance['withdrawal_capped'][0]:
             messagebox.showerror("Error", "Withdrawal amount exceeds portfolio value!")
-            self.portfolio['WITHDRAW']['units'] = total_value  # Cap withdrawal at total value
-            net_change = -total_value
+            self.portfolio['WITHDRAW']['units'] = rebalance['withdrawals'][0]  # Cap withdrawal at total value
         
-        total_with_changes = total_value + net_change
+        # Executable orders in whole lots, funded from deposits and sales
+        lot_sizes = [self.LOT_SIZES.get(symbol, self.DEFAULT_LOT_SIZE) for symbol in symbols]
+        orders = solve_whole_unit_trades(units, prices, targets,
+                                         deposit, rebalance['withdrawals'][0],
+                                         lot_sizes=lot_sizes,
+                                         min_trade_value=self.MIN_TRADE_VALUE)
+        self.cash_after_orders = orders['cash_remaining'] if orders['feasible'] else None
+        
+        asset_rows = {symbol: i for i, symbol in enumerate(symbols)}
         
         results = []
         for symbol, data in self.portfolio.items():
-            current_value = data['units'] * data['price']
-            
             # Handle special rows differently
-            if symbol in ['DEPOSIT', 'WITHDRAW']:
+            if symbol in CASH_FLOW_SYMBOLS:
+                current_value = data['units'] * data['price']
                 current_percent = 0
-                target_value = 0
                 units_to_trade = 0
+                order_units = 0
             else:
-                current_percent = (current_value / total_value * 100) if total_value > 0 else 0
-                target_value = total_with_changes * (data['target'] / 100)
-                difference = target_value - current_value
-                units_to_trade = difference / data['price'] if data['price'] else 0
+                i = asset_rows[symbol]
+                current_value = rebalance['current_value'][0, i]
+                current_percent = rebalance['current_percent'][0, i]
+                units_to_trade = rebalance['units_to_trade'][0, i]
+                order_units = orders['units_to_trade'][i]
             
             results.append({
                 'symbol': symbol,
@@ -320,7 +338,8 @@ class PortfolioRebalancer:
                 'current_value': current_value,
                 'current_percent': current_percent,
                 'target_percent': data['target'],
-                'units_to_trade': units_to_trade
+                'units_to_trade': units_to_trade,
+                'order_units': order_units
             })
         
         return results
@@ -338,10 +357,17 @@ class PortfolioRebalancer:
         for data in rebalancing:
             if data['symbol'] in ['DEPOSIT', 'WITHDRAW']:
                 trade_text = '-'
+                order_text = '-'
             else:
                 trade_text = (f"Buy {abs(data['units_to_trade']):.4f}" 
                             if data['units_to_trade'] > 0
                             else f"Sell {abs(data['units_to_trade']):.4f}")
+                if data['order_units'] > 0:
+                    order_text = f"Buy {abs(data['order_units']):g}"
+                elif data['order_units'] < 0:
+                    order_text = f"Sell {abs(data['order_units']):g}"
+                else:
+                    order_text = "Hold"
             
             values = (
                 data['symbol'],
@@ -350,20 +376,26 @@ class PortfolioRebalancer:
                 f"${data['current_value']:.2f}",
                 f"{data['current_percent']:.1f}%",
                 f"{data['target_percent']}%",
-                trade_text
+                trade_text,
+                order_text
             )
             
             # Add row with appropriate tags for coloring
             tags = ()
-            if data['units_to_trade'] > 0 and data['symbol'] not in ['DEPOSIT', 'WITHDRAW']:
+            if data['order_units'] > 0 and data['symbol'] not in ['DEPOSIT', 'WITHDRAW']:
                 tags = ('buy',)
-            elif data['units_to_trade'] < 0 and data['symbol'] not in ['DEPOSIT', 'WITHDRAW']:
+            elif data['order_units'] < 0 and data['symbol'] not in ['DEPOSIT', 'WITHDRAW']:
                 tags = ('sell',)
             elif data['symbol'] == 'WITHDRAW':
                 tags = ('withdraw',)
             
             self.tree.insert('', tk.END, values=values, tags=tags)
         
+        if self.cash_after_orders is None:
+            self.cash_label.config(text="Orders cannot be funded")
+        else:
+            self.cash_label.config(text=f"Cash after orders: ${self.cash_after_orders:.2f}")
+        
         # Configure tag colors
         self.tree.tag_configure('buy', foreground='green')
         self.tree.tag_configure('sell', foreground='red')
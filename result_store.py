@@ -0,0 +1,213 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+from config import BacktestConfig
+
+def _hash_frame(hasher, df):
+    """Feed a DataFrame's index, columns and values into a hash"""
+    hasher.update(json.dumps([str(c) for c in df.columns]).encode())
+    if len(df) > 0:
+        hasher.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+
+def _describe_setting(value):
+    """Stable text for a config value; lambdas are described by their source"""
+    if callable(value):
+        try:
+            return inspect.getsource(value).strip()
+        except (OSError, TypeError):
+            return value.__code__.co_code.hex()
+    if isinstance(value, dict):
+        return {str(k): _describe_setting(v) for k, v in value.items()}
+    return value
+
+def result_version(schema):
+    """Short hash of a result schema (see main.RESULT_SCHEMA) used as the cache version"""
+    return hashlib.sha256(json.dumps(schema, default=str).encode()).hexdigest()[:12]
+
+def metric_settings(schema):
+    """Config settings that change calculate_metrics output"""
+    return {
+        'version': result_version(schema),
+        'rebalancing_periods': BacktestConfig.REBALANCING_PERIODS,
+        'risk_free_rate': BacktestConfig.RISK_FREE_RATE,
+        'risk_settings': BacktestConfig.RISK_SETTINGS,
+        'covariance': BacktestConfig.COVARIANCE,
+        'correlation_view': BacktestConfig.CORRELATION_VIEW,
+        'holding_periods': BacktestConfig.HOLDING_PERIODS,
+        'scoring_weights': BacktestConfig.SCORING_WEIGHTS,
+        'market_conditions': _describe_setting(BacktestConfig.MARKET_CONDITIONS),
+        'regime_benchmark': BacktestConfig.REGIME_BENCHMARK,
+        'base_currency': BacktestConfig.BASE_CURRENCY
+    }
+
+def result_key(price_data, benchmark_data, portfolio_weights, schema, extra=None):
+    """Content address for a calculate_metrics run.
+
+    Hashes the aligned price and benchmark panels, the portfolio weights,
+    the rebalance periods, every metric setting and the result schema, so
+    any change to the inputs or to what is calculated produces a new key.
+    """
+    hasher = hashlib.sha256()
+    _hash_frame(hasher, price_data)
+    _hash_frame(hasher, benchmark_data)
+    hasher.update(json.dumps({
+        'weights': sorted((str(k), float(v)) for k, v in portfolio_weights.items()),
+        'settings': _describe_setting(metric_settings(schema)),
+        'extra': extra
+    }, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+class ResultStore:
+    """On-disk store of calculate_metrics results with LRU and size-limit eviction.
+
+    Results are pickled one file per key; a small SQLite index tracks
+    size and last access so eviction never has to scan the directory.
+    """
+
+    def __init__(self, path=None, max_bytes=None, max_entries=None):
+        settings = BacktestConfig.RESULT_CACHE
+        self.path = path or settings['DIR']
+        self.max_bytes = max_bytes or settings['MAX_BYTES']
+        self.max_entries = max_entries or settings['MAX_ENTRIES']
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.path, 'index.db'), check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                   key TEXT PRIMARY KEY,
+                   label TEXT,
+                   size INTEGER NOT NULL,
+                   created REAL NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self.conn.commit()
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def resolve(self, prefix):
+        """Expand a unique key prefix to the full key"""
+        with self.lock:
+            rows = self.conn.execute('SELECT key FROM entries WHERE key LIKE ?',
+                                     (f"{prefix}%",)).fetchall()
+        if len(rows) != 1:
+            raise KeyError(f"{'No' if not rows else 'Ambiguous'} cached result for '{prefix}'")
+        return rows[0][0]
+
+    def get(self, key):
+        """Load a cached result, or None on a miss"""
+        path = self._file(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except Exception as e:
+            print(f"Discarding unreadable cached result {key[:12]}: {e}")
+            self.delete(key)
+            return None
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+        return result
+
+    def put(self, key, result, label=None):
+        """Store a result and evict least recently used entries over the limits"""
+        path = self._file(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                """INSERT OR REPLACE INTO entries (key, label, size, created, last_access)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (key, label, os.path.getsize(path), now, now)
+            )
+        self.evict()
+
+    def delete(self, key):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        if os.path.exists(self._file(key)):
+            os.remove(self._file(key))
+
+    def evict(self):
+        """Drop least recently used entries until within size and count limits"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT key, size FROM entries ORDER BY last_access DESC'
+            ).fetchall()
+        total = 0
+        for i, (key, size) in enumerate(rows):
+            total += size
+            if total > self.max_bytes or i >= self.max_entries:
+                self.delete(key)
+
+    def entries(self):
+        """List cached results, most recently used first"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT key, label, size, created, last_access FROM entries ORDER BY last_access DESC'
+            ).fetchall()
+        return [dict(zip(('key', 'label', 'size', 'created', 'last_access'), row)) for row in rows]
+
+def compare_results(a, b):
+    """Differences between two cached calculate_metrics results (b minus a)"""
+    comparison = {}
+    for name in ('metrics', 'correlation'):
+        if name in a and name in b:
+            comparison[name] = b[name].subtract(a[name])
+    if 'risk_contribution' in a and 'risk_contribution' in b:
+        comparison['risk_contribution'] = b['risk_contribution'].subtract(a['risk_contribution'])
+    if 'returns_data' in a and 'returns_data' in b:
+        ra, rb = a['returns_data'], b['returns_data']
+        comparison['returns_overlap'] = {
+            'start': max(ra.index.min(), rb.index.min()) if len(ra) and len(rb) else None,
+            'end': min(ra.index.max(), rb.index.max()) if len(ra) and len(rb) else None,
+            'rows': (len(ra), len(rb))
+        }
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compare cached backtest results")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="List cached results")
+    compare = subparsers.add_parser('compare', help="Compare two cached results (second minus first)")
+    compare.add_argument('first', help="Key or unique key prefix")
+    compare.add_argument('second', help="Key or unique key prefix")
+    args = parser.parse_args()
+
+    for option, value in BacktestConfig.DISPLAY_OPTIONS.items():
+        pd.set_option(option, value)
+    store = ResultStore()
+
+    if args.command == 'list':
+        for entry in store.entries():
+            used = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_access']))
+            print(f"{entry['key'][:12]}  {entry['size'] / 1e6:7.2f} MB  {used}  {entry['label'] or ''}")
+        return
+
+    keys = [store.resolve(args.first), store.resolve(args.second)]
+    results = [store.get(key) for key in keys]
+    comparison = compare_results(*results)
+    print(f"Comparing {keys[0][:12]} -> {keys[1][:12]}")
+    print("\nMetric changes:")
+    print(comparison['metrics'].round(4))
+    print("\nRisk contribution changes:")
+    print(comparison['risk_contribution'].round(4))
+    corr_change = comparison['correlation'].abs().to_numpy()
+    print(f"\nLargest correlation change: {np.nanmax(corr_change) if corr_change.size else 0:.4f}")
+    print(f"Returns overlap: {comparison['returns_overlap']}")
+
+if __name__ == "__main__":
+    main()
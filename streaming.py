@@ -0,0 +1,357 @@
+import argparse
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from statistics import NormalDist
+from config import BacktestConfig
+from bar_store import iter_bar_chunks
+from main import calculate_composite_score, _cornish_fisher_es, _cornish_fisher_z, VAR_METRICS
+
+# Bars per year used to annualize metrics for each bar interval
+PERIODS_PER_YEAR = {
+    '1d': 252,
+    '1h': 252 * 7,
+    '30m': 252 * 13,
+    '15m': 252 * 26,
+    '5m': 252 * 78,
+    '1m': 252 * 390
+}
+CRYPTO_PERIODS_PER_YEAR = {
+    '1d': 365,
+    '1h': 365 * 24,
+    '30m': 365 * 48,
+    '15m': 365 * 96,
+    '5m': 365 * 288,
+    '1m': 365 * 1440
+}
+
+def _merge_moments(a, b):
+    """Merge (count, mean, M2, M3, M4) central moment summaries of two samples"""
+    n_a, mean_a, m2_a, m3_a, m4_a = a
+    n_b, mean_b, m2_b, m3_b, m4_b = b
+    n = n_a + n_b
+    if n_a == 0:
+        return b
+    if n_b == 0:
+        return a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    m2 = m2_a + m2_b + delta ** 2 * n_a * n_b / n
+    m3 = (m3_a + m3_b + delta ** 3 * n_a * n_b * (n_a - n_b) / n ** 2
+          + 3 * delta * (n_a * m2_b - n_b * m2_a) / n)
+    m4 = (m4_a + m4_b + delta ** 4 * n_a * n_b * (n_a ** 2 - n_a * n_b + n_b ** 2) / n ** 3
+          + 6 * delta ** 2 * (n_a ** 2 * m2_b + n_b ** 2 * m2_a) / n ** 2
+          + 4 * delta * (n_a * m3_b - n_b * m3_a) / n)
+    return (n, mean, m2, m3, m4)
+
+def _chunk_moments(values):
+    """Central moment summary of one chunk"""
+    if len(values) == 0:
+        return (0, 0.0, 0.0, 0.0, 0.0)
+    mean = values.mean()
+    dev = values - mean
+    return (len(values), mean, np.sum(dev ** 2), np.sum(dev ** 3), np.sum(dev ** 4))
+
+class RunningMetrics:
+    """Accumulate calculate_risk_metrics figures over a stream of return chunks.
+
+    Moments, compounding, drawdown and win counts are carried in O(1)
+    state. Returns are also spilled to a temporary file so historical VaR
+    and CVaR can be found exactly afterwards with bounded-memory passes.
+    """
+
+    def __init__(self, periods_per_year=252, confidence=None, spill_dir=None, block_rows=1_000_000):
+        self.periods_per_year = periods_per_year
+        self.confidence = confidence or BacktestConfig.RISK_SETTINGS['VAR_CONFIDENCE']
+        self.block_rows = block_rows
+        self.moments = (0, 0.0, 0.0, 0.0, 0.0)
+        self.downside = (0, 0.0, 0.0, 0.0, 0.0)
+        self.wins = 0
+        self.growth = 1.0
+        self.peak = None
+        self.max_drawdown = np.nan
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.spill = tempfile.NamedTemporaryFile(dir=spill_dir, suffix='.f8', delete=False)
+
+    def update(self, returns):
+        """Add a chunk of returns (NaN and infinite values already replaced)"""
+        returns = np.asarray(returns, dtype=np.float64)
+        if len(returns) == 0:
+            return
+        self.spill.write(returns.tobytes())
+        self.moments = _merge_moments(self.moments, _chunk_moments(returns))
+        self.downside = _merge_moments(self.downside, _chunk_moments(returns[returns < 0]))
+        self.wins += int(np.sum(returns > 0))
+        self.minimum = min(self.minimum, returns.min())
+        self.maximum = max(self.maximum, returns.max())
+
+        # Same compounding order as (1 + returns).cumprod()
+        cum = self.growth * np.cumprod(1 + returns)
+        self.growth = cum[-1]
+        running_peak = np.maximum.accumulate(cum)
+        if self.peak is not None:
+            running_peak = np.maximum(running_peak, self.peak)
+        self.peak = running_peak[-1]
+        chunk_drawdown = np.min(cum / running_peak - 1)
+        self.max_drawdown = chunk_drawdown if np.isnan(self.max_drawdown) else min(self.max_drawdown, chunk_drawdown)
+
+    def _blocks(self):
+        """Read the spilled returns back in bounded blocks"""
+        count = self.moments[0]
+        data = np.memmap(self.spill.name, dtype=np.float64, mode='r', shape=(count,))
+        for start in range(0, count, self.block_rows):
+            yield np.array(data[start:start + self.block_rows])
+        del data
+
+    def _historical_var(self, alpha, bins=4096):
+        """Find the 'lower' quantile and tail mean exactly with two spill passes"""
+        count = self.moments[0]
+        k = int(np.floor(alpha * (count - 1)))  # 0-based order statistic
+        if self.minimum == self.maximum:
+            return self.minimum, self.minimum
+
+        # Pass 1: locate the histogram bin holding the k-th smallest value
+        edges = np.linspace(self.minimum, self.maximum, bins + 1)
+        hist = np.zeros(bins, dtype=np.int64)
+        for block in self._blocks():
+            hist += np.histogram(block, bins=edges)[0]
+        cumulative = np.cumsum(hist)
+        b = int(np.searchsorted(cumulative, k + 1))
+        below = cumulative[b - 1] if b > 0 else 0
+        low, high = edges[b], edges[b + 1]
+
+        # Pass 2: collect that bin's values and the sum of everything below it
+        candidates = []
+        below_sum = 0.0
+        for block in self._blocks():
+            if b == bins - 1:
+                in_bin = block >= low
+            else:
+                in_bin = (block >= low) & (block < high)
+            candidates.append(block[in_bin])
+            below_sum += block[block < low].sum()
+        candidates = np.sort(np.concatenate(candidates))
+        var = candidates[k - below]
+        tail = candidates[candidates <= var]
+        cvar = (below_sum + tail.sum()) / (below + len(tail))
+        return var, cvar
+
+    def finalize(self):
+        """Return the metrics dict in calculate_risk_metrics format"""
+        self.spill.flush()
+        n, mean, m2, m3, m4 = self.moments
+        ppy = self.periods_per_year
+        daily_rf = BacktestConfig.RISK_FREE_RATE / ppy
+        try:
+            if n == 0:
+                return {k: np.nan for k in BacktestConfig.DISPLAY_ORDER if k != 'Strategy Score'}
+
+            total_return = self.growth - 1
+            annual_return = (1 + total_return) ** (ppy / n) - 1
+            std = np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+            volatility = std * np.sqrt(ppy)
+            sharpe = ((mean - daily_rf) * np.sqrt(ppy)) / volatility if volatility > 0 else np.nan
+
+            n_down, _, m2_down, _, _ = self.downside
+            downside_std = np.sqrt(m2_down / (n_down - 1)) * np.sqrt(ppy) if n_down > 1 else np.nan
+            sortino = ((mean - daily_rf) * np.sqrt(ppy)) / downside_std if downside_std > 0 else np.nan
+
+            max_drawdown = self.max_drawdown
+            calmar = annual_return / abs(max_drawdown) if max_drawdown < 0 else np.nan
+
+            metrics = {
+                'Total Return': total_return,
+                'Annual Return': annual_return,
+                'Volatility': volatility,
+                'Sharpe Ratio': sharpe,
+                'Sortino Ratio': sortino,
+                'Max Drawdown': max_drawdown,
+                'Calmar Ratio': calmar,
+                'Win Rate': self.wins / n
+            }
+
+            if n >= 2:
+                alpha = 1 - self.confidence
+                hist_var, hist_cvar = self._historical_var(alpha)
+                normal = NormalDist()
+                z = normal.inv_cdf(alpha)
+                if std > 0:
+                    skew = (m3 / n) / std ** 3
+                    kurt = (m4 / n) / std ** 4 - 3
+                    cf_var = mean + _cornish_fisher_z(z, skew, kurt) * std
+                    cf_cvar = mean + _cornish_fisher_es(z, alpha, skew, kurt) * std
+                else:
+                    cf_var = cf_cvar = mean
+                metrics.update({
+                    'VaR (Historical)': hist_var,
+                    'CVaR (Historical)': hist_cvar,
+                    'VaR (Parametric)': mean + z * std,
+                    'CVaR (Parametric)': mean - std * normal.pdf(z) / alpha,
+                    'VaR (Cornish-Fisher)': cf_var,
+                    'CVaR (Cornish-Fisher)': cf_cvar
+                })
+            else:
+                metrics.update({k: np.nan for k in VAR_METRICS})
+
+            return {k: np.nan if np.isinf(v) else v for k, v in metrics.items()}
+        finally:
+            self.close()
+
+    def close(self):
+        """Remove the spill file"""
+        self.spill.close()
+        if os.path.exists(self.spill.name):
+            os.remove(self.spill.name)
+
+def _fill_forward(prices, last):
+    """Forward-fill a (bars, symbols) price array seeded with the last prices of earlier chunks"""
+    stacked = np.vstack([last[None, :], prices])
+    rows = np.where(np.isnan(stacked), 0, np.arange(len(stacked))[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return stacked[rows, np.arange(stacked.shape[1])][1:]
+
+class StreamingRebalancer:
+    """Chunked rebalancing simulation that carries positions and last prices across chunks.
+
+    A symbol with no bar at a timestamp (outside its session) keeps its
+    last price, and rebalances happen on the last bar of each period.
+    """
+
+    def __init__(self, portfolio_weights, rebalance_period):
+        self.tickers = list(portfolio_weights.keys())
+        self.weights = np.array(list(portfolio_weights.values()), dtype=float)
+        self.offset = to_offset(rebalance_period)
+        self.positions = None
+        self.last_prices = np.full(len(self.tickers), np.nan)
+        self.last_value = None
+        self.last_label = None
+        self.bars = 0
+
+    def period_labels(self, index):
+        """Period-end date of the rebalance period each bar falls in"""
+        return (index.normalize() + self.offset * 0).asi8
+
+    def _rebalance(self, value, prices):
+        traded = ~np.isnan(prices)
+        self.positions[traded] = value * self.weights[traded] / prices[traded]
+
+    def process(self, chunk):
+        """Return portfolio values for a chunk of prices (columns in any order).
+
+        A bar is the last of its period when the next bar is in a later
+        period; for a chunk's final bar that is only known from the next
+        chunk, so its rebalance is applied when that chunk arrives.
+        """
+        prices = _fill_forward(chunk[self.tickers].to_numpy(dtype=float), self.last_prices)
+        labels = self.period_labels(chunk.index)
+        if self.positions is None:
+            valid = ~np.isnan(prices[0])
+            self.positions = np.where(valid, self.weights / np.where(valid, prices[0], 1), 0.0)
+        elif labels[0] != self.last_label and self.bars > 1:
+            self._rebalance(self.last_value, self.last_prices)
+
+        # Never rebalance on the very first bar
+        rows = np.flatnonzero(labels[:-1] != labels[1:])
+        rows = rows[rows + self.bars > 0]
+
+        filled = np.nan_to_num(prices, nan=0.0)
+        values = np.empty(len(prices))
+        start = 0
+        for row in rows:
+            values[start:row + 1] = filled[start:row + 1] @ self.positions
+            self._rebalance(values[row], prices[row])
+            start = row + 1
+        values[start:] = filled[start:] @ self.positions
+
+        self.last_prices = prices[-1].copy()
+        self.last_value = values[-1]
+        self.last_label = labels[-1]
+        self.bars += len(prices)
+        return values
+
+def _clean_returns(values, previous):
+    """pct_change with inf/NaN replaced by 0, continuing from the previous chunk.
+
+    values are already forward-filled, so only bars before a series' first
+    price give NaN.
+    """
+    first = np.nan if previous is None else previous
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = values / np.concatenate([[first], values[:-1]]) - 1
+    returns[~np.isfinite(returns)] = 0.0
+    return returns
+
+def streaming_backtest(portfolio_weights, interval='1h', benchmarks=None, start=None, end=None,
+                       periods_per_year=None, chunk_rows=None, store_dir=None):
+    """Backtest rebalancing strategies over bars streamed from the local bar store.
+
+    Memory is bounded by one chunk (a month of bars, or chunk_rows rows)
+    regardless of history length, and results do not depend on how the
+    bars are chunked. Symbols with no bar at a timestamp (e.g. equities
+    outside their session on a mixed crypto/equity panel) keep their last
+    price, and portfolios rebalance on the last bar of each period.
+    """
+    benchmarks = benchmarks or {}
+    if periods_per_year is None:
+        all_crypto = all(BacktestConfig.get_market_type(t) == 'Crypto' for t in portfolio_weights)
+        table = CRYPTO_PERIODS_PER_YEAR if all_crypto else PERIODS_PER_YEAR
+        periods_per_year = table.get(interval, BacktestConfig.RISK_SETTINGS['ANNUALIZATION_FACTOR'])
+
+    symbols = list(dict.fromkeys(list(portfolio_weights) + list(benchmarks)))
+    simulators = {}
+    trackers = {}
+    last_values = {}
+    for period, period_name in BacktestConfig.REBALANCING_PERIODS.items():
+        name = f'Portfolio ({period_name} Rebalancing)'
+        simulators[name] = StreamingRebalancer(portfolio_weights, period)
+        trackers[name] = RunningMetrics(periods_per_year)
+    for ticker, name in benchmarks.items():
+        trackers[f'Benchmark ({name})'] = RunningMetrics(periods_per_year)
+
+    rows = 0
+    try:
+        for chunk in iter_bar_chunks(symbols, interval, start, end, chunk_rows, store_dir):
+            rows += len(chunk)
+            for name, simulator in simulators.items():
+                values = simulator.process(chunk)
+                trackers[name].update(_clean_returns(values, last_values.get(name)))
+                last_values[name] = values[-1]
+            for ticker, bench_name in benchmarks.items():
+                name = f'Benchmark ({bench_name})'
+                previous = last_values.get(name)
+                values = _fill_forward(chunk[[ticker]].to_numpy(dtype=float),
+                                       np.array([np.nan if previous is None else previous]))[:, 0]
+                trackers[name].update(_clean_returns(values, previous))
+                last_values[name] = values[-1]
+
+        print(f"Streamed {rows} {interval} bars for {len(symbols)} symbols")
+        results = {}
+        for name, tracker in trackers.items():
+            metrics = tracker.finalize()
+            metrics['Strategy Score'] = calculate_composite_score(metrics)
+            results[name] = metrics
+    finally:
+        for tracker in trackers.values():
+            tracker.close()
+
+    return pd.DataFrame(results).round(4)
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming backtest over stored intraday bars")
+    parser.add_argument('--interval', default='1h', help="Bar interval stored in the bar store")
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--chunk-rows', type=int, default=None,
+                        help="Split monthly partitions into chunks of at most this many rows")
+    args = parser.parse_args()
+
+    for option, value in BacktestConfig.DISPLAY_OPTIONS.items():
+        pd.set_option(option, value)
+    print(streaming_backtest(BacktestConfig.PORTFOLIO, args.interval, start=args.start,
+                             end=args.end, chunk_rows=args.chunk_rows))
+
+if __name__ == "__main__":
+    main()
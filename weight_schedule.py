@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+def load_weight_schedule(source):
+    """Build a target-weight schedule from a mapping or a CSV file.
+
+    source is either {date: {ticker: weight}} or the path of a CSV with a
+    date column followed by one column per ticker. Each row takes effect
+    from its date until the next row; tickers missing from a row get zero
+    weight. Returns a date-indexed DataFrame with one column per ticker.
+    """
+    if isinstance(source, str):
+        schedule = pd.read_csv(source, index_col=0, parse_dates=True)
+    elif isinstance(source, pd.DataFrame):
+        schedule = source.copy()
+    else:
+        schedule = pd.DataFrame.from_dict(source, orient='index')
+    if schedule.empty:
+        raise ValueError("Weight schedule has no rows")
+    try:
+        schedule.index = pd.to_datetime(schedule.index)
+        schedule = schedule.astype(float).fillna(0.0)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid weight schedule: {e}")
+    if schedule.index.has_duplicates:
+        raise ValueError("Weight schedule has duplicate dates")
+    schedule = schedule.sort_index()
+
+    totals = schedule.sum(axis=1)
+    bad = totals[(totals - 1.0).abs() > 1e-6]
+    if len(bad):
+        raise ValueError(f"Schedule weights on {bad.index[0]:%Y-%m-%d} sum to {bad.iloc[0]}, not 1.0")
+    return schedule
+
+def schedule_weights(schedule, date=None):
+    """Weights in force on a date (the latest row by default) as a {ticker: weight} dict"""
+    position = len(schedule) if date is None else schedule.index.searchsorted(date, side='right')
+    row = schedule.iloc[max(position - 1, 0)]
+    return {ticker: float(weight) for ticker, weight in row.items()}
+
+def align_weight_schedule(schedule, index, tickers):
+    """Target weights for every date of index as a (dates, tickers) array.
+
+    Each date takes the latest schedule row on or before it (dates before
+    the first row take the first row), found for all dates at once with a
+    single searchsorted; tickers absent from the schedule get zero weight.
+    """
+    weights = schedule.reindex(columns=tickers, fill_value=0.0).to_numpy(dtype=float)
+    rows = np.maximum(schedule.index.searchsorted(index, side='right') - 1, 0)
+    return weights[rows]
+
+def schedule_to_dict(schedule):
+    """JSON-friendly {date: {ticker: weight}} form of a schedule"""
+    return {f"{date:%Y-%m-%d}": {ticker: float(weight) for ticker, weight in row.items()}
+            for date, row in schedule.iterrows()}
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from config import BacktestConfig
+from main import calculate_risk_metrics, calculate_composite_score, rebalance_portfolio
+
+class WhatIfSession:
+    """Re-score alternative portfolio weights against an in-memory price panel.
+
+    The aligned price panel and benchmark returns from a completed backtest
+    are kept in memory, and each request runs rebalance_portfolio and the
+    same return cleaning as calculate_metrics on them instead of a full
+    backtest_portfolio run, so scores match the backtest engine exactly.
+    """
+
+    def __init__(self, price_data, strategy_returns):
+        self.price_data = price_data
+        self.benchmark_returns = strategy_returns[
+            [col for col in strategy_returns.columns if col.startswith('Benchmark')]
+        ]
+        self.dates = [d.strftime('%Y-%m-%d') for d in price_data.index]
+        self.benchmark_growth = {
+            col: np.round((1 + self.benchmark_returns[col]).cumprod().to_numpy(), 6).tolist()
+            for col in self.benchmark_returns.columns
+        }
+
+    @classmethod
+    def from_results(cls, results):
+        return cls(results['price_data'], results['strategy_returns'])
+
+    def normalize_weights(self, weights):
+        """Validate requested weights and scale them to sum to 1"""
+        unknown = [ticker for ticker in weights if ticker not in self.price_data.columns]
+        if unknown:
+            raise ValueError(f"Unknown tickers: {', '.join(unknown)}")
+        values = {ticker: float(weight) for ticker, weight in weights.items()}
+        if any(weight < 0 for weight in values.values()):
+            raise ValueError("Weights must be non-negative")
+        total = sum(values.values())
+        if total <= 0:
+            raise ValueError("Weights must sum to more than zero")
+        return {ticker: weight / total for ticker, weight in values.items() if weight > 0}
+
+    def score(self, weights, rebalance_period='ME'):
+        """Simulate new weights and return metrics plus chart series"""
+        if rebalance_period not in BacktestConfig.REBALANCING_PERIODS:
+            raise ValueError(f"Unknown rebalance period: {rebalance_period}")
+        weights = self.normalize_weights(weights)
+
+        values = rebalance_portfolio(weights, self.price_data, rebalance_period)
+        if values.isna().all():
+            raise ValueError("Rebalancing simulation failed")
+        returns = values.pct_change(fill_method=None)
+        returns = returns.replace([np.inf, -np.inf], np.nan).fillna(0)
+
+        metrics = calculate_risk_metrics(returns)
+        metrics['Strategy Score'] = calculate_composite_score(metrics)
+        growth = (1 + returns).cumprod()
+        drawdown = growth / growth.cummax() - 1
+
+        return {
+            'weights': weights,
+            'rebalance_period': rebalance_period,
+            'metrics': {k: None if pd.isna(v) else round(float(v), 4) for k, v in metrics.items()},
+            'chart': {
+                'dates': self.dates,
+                'growth': np.round(growth.to_numpy(), 6).tolist(),
+                'drawdown': np.round(drawdown.to_numpy(), 6).tolist(),
+                'benchmarks': self.benchmark_growth
+            }
+        }